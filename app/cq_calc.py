@@ -1,21 +1,78 @@
 """
 代码质量指标计算库
 """
-import xml.etree.ElementTree as ET
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 
 import numpy
 import pandas as pd
 
+from .scan_result import ScanResult
+
+
+class lazy_property:
+    """
+    第一次访问时计算并保存在实例上，之后直接读取，相当于Python 3.8的functools.cached_property
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = instance.__dict__[self.name] = self.func(instance)
+        return value
+
+
+def class_column(col):
+    """
+    类级度量列，第一次访问时才从class_file中取出
+    """
+    return lazy_property(lambda self: self.class_file[col])
+
+
+class StepScore:
+    """
+    分段打分表：把阈值比较写成表，对整列一次性打分
+    right=True时第i段为 bounds[i-1] < x <= bounds[i]，否则为 bounds[i-1] <= x < bounds[i]
+    NaN与任何阈值的比较都不成立，默认落入最后一段（即if/elif链的else分支）
+    """
+
+    def __init__(self, bounds, scores=(2, 1, 0, -1, -2), right=True, nan_score=None):
+        assert len(scores) == len(bounds) + 1, 'scores should have one more entry than bounds'
+        self.bounds = numpy.asarray(bounds, dtype=numpy.float64)
+        self.scores = numpy.asarray(scores, dtype=numpy.int64)
+        self.side = 'left' if right else 'right'
+        self.nan_score = self.scores[-1] if nan_score is None else nan_score
+
+    def score(self, values):
+        values = numpy.asarray(values, dtype=numpy.float64)
+        result = self.scores[numpy.searchsorted(self.bounds, values, side=self.side)]
+        result[numpy.isnan(values)] = self.nan_score
+        return result
+
+    def __call__(self, col):
+        return pd.Series(self.score(col), index=col.index, name=col.name)
+
 
 class Complexity:
     """
     计算代码级复杂性：the less, the better
     粒度：Version、Class、Method
     """
+    CLASS_COLUMNS = ('WMC', 'Path', 'Name')
+    METHOD_COLUMNS = ()
 
-    def __init__(self, directory, name):
-        self.dir = directory
-        self.class_file = pd.read_csv(f'{directory}/{name}-Class.csv').set_index('LongName', drop=False)
+    def __init__(self, directory, name=None):
+        self.scan = ScanResult.of(directory, name)
+        self.dir = self.scan.dir
+        self.class_file = self.scan.class_file
         self.df = self.class_file[['WMC', 'Path', 'Name']]
         self.complexity = self.df['WMC']
         self.complexity.name = 'complexity'
@@ -27,17 +84,20 @@ class Inheritance:
     计算项继承性: the less, the better
     Version、Class
     """
+    CLASS_COLUMNS = ('DIT',)
+    METHOD_COLUMNS = ()
 
-    def __init__(self, directory, name):
-        self.dir = directory
-        self.class_file = pd.read_csv(f'{directory}/{name}-Class.csv').set_index('LongName', drop=False)
+    def __init__(self, directory, name=None):
+        self.scan = ScanResult.of(directory, name)
+        self.dir = self.scan.dir
+        self.class_file = self.scan.class_file
         # self.noa = self.class_file['NOA']
         # self.noc = self.class_file['NOC']
         # self.nop = self.class_file['NOP']
         # self.nod = self.class_file['NOD']
         self.dit = self.class_file['DIT']
-        self.inheritance = self.get_inherirance()
-        self.inheritance.name = 'inheritance'
+        # class_file由各计算类共用，改名时不能改动其中的列
+        self.inheritance = self.get_inherirance().rename('inheritance')
 
     def get_inherirance(self):
         # return (self.noa + self.noc + self.nop + self.nod + self.dit) / 5
@@ -49,266 +109,205 @@ class ISO25010:
     计算ISO25010可维护性指标（借助Code Smell）：the more, the better
     粒度：Version、Class
     """
-
-    def __init__(self, directory, name):
-        self.dir = directory
-        self.class_file = pd.read_csv(f'{directory}/{name}-Class.csv').set_index('LongName', drop=False)
-        self.method_file = pd.read_csv(f'{directory}/{name}-Method.csv').set_index('LongName', drop=False)
-
-        # 方法级代码度量
-        self.par = self.method_file['NUMPAR']
-        self.nbd = self.method_file['NL']
-        self.mloc = self.method_file['LOC']
-        self.mccc = self.method_file['McCC']
-
-        # 类级代码度量
-        self.cc = self.class_file['CC']
-        self.cllc = self.class_file['CLLC']
-        self.loc = self.class_file['LOC']
-        self.loc_mean = self.class_file['LOC'].mean()
-        self.nom = self.class_file['NM']
-        self.wmc = self.class_file['WMC']
-        self.cloc = self.class_file['LOC']
-        self.cbo = self.class_file['CBO']
-        self.cbo_mean = self.class_file['CBO'].mean()
-        self.dit = self.class_file['DIT']
-
-        # 代码异味指标
-        self.duplicate_code = self.get_duplicate_code()
-        self.long_parameter = self.get_long_parameter()
-        self.long_method = self.get_long_method()
-        self.lazy_class = self.get_lazy_class()
-        self.large_class = self.get_large_class()
-
-        # maintainability子指标
-        self.modularity, self.reusability, self.analyzability, self.modifiability, self.testability = \
-            self.get_sub_iso25010()
-
-        # maintainability指标
-        self.maintainability = self.get_maintainability()
-
-        self.duplicate_code_V = self.duplicate_code.mean()
-        self.long_parameter_V = self.long_parameter.mean()
-        self.long_method_V = self.long_method.mean()
-        self.lazy_class_V = self.lazy_class.mean()
-        self.large_class_V = self.large_class.mean()
-        self.maintainability.name = 'maintainability'
-        self.testability.name = 'testability'
-
-    @staticmethod
-    def _get_duplicate_code(single_class):
-        if single_class <= 0.03:
-            dc = 2
-        elif single_class <= 0.05:
-            dc = 1
-        elif single_class <= 0.1:
-            dc = 0
-        elif single_class <= 0.2:
-            dc = -1
-        else:
-            dc = -2
-        return dc
+    CLASS_COLUMNS = ('CC', 'CLLC', 'LOC', 'NM', 'WMC', 'CBO', 'DIT')
+    METHOD_COLUMNS = ('NUMPAR', 'NL', 'LOC', 'McCC')
+    # 代码异味的分段打分表，对整列一次性打分
+    DUPLICATE_CODE = StepScore((0.03, 0.05, 0.1, 0.2))
+    LONG_PARAMETER = StepScore((1, 3, 5, 7))
+    NBD = StepScore((1, 2, 4, 6))
+    MLOC = StepScore((7, 10, 13, 20))
+    MCCC = StepScore((1.1, 2.0, 3.1, 4.7))
+    NOM = StepScore((1,), scores=(-2, 2), right=False, nan_score=-2)
+    LARGE_CLASS_NOM = StepScore((4, 7, 10, 15))
+    LARGE_CLASS_WMC = StepScore((5, 14, 31, 47))
+    LARGE_CLASS_CLOC = StepScore((28, 70, 130, 195))
+    LARGE_CLASS_CBO = StepScore((1, 3, 5, 7))
+
+    def __init__(self, directory, name=None):
+        # 各项结果在第一次访问时计算，只需要testability时不会计算lazy class等其余异味
+        self.scan = ScanResult.of(directory, name)
+        self.dir = self.scan.dir
+
+    @lazy_property
+    def class_file(self):
+        return self.scan.class_file
+
+    @lazy_property
+    def method_file(self):
+        # 流式读取Method.csv时不保留整个方法表
+        return None if self.scan.stream_methods else self.scan.method_file
+
+    # 方法级代码度量
+    @lazy_property
+    def par(self):
+        return None if self.method_file is None else self.method_file['NUMPAR']
+
+    @lazy_property
+    def nbd(self):
+        return None if self.method_file is None else self.method_file['NL']
+
+    @lazy_property
+    def mloc(self):
+        return None if self.method_file is None else self.method_file['LOC']
+
+    @lazy_property
+    def mccc(self):
+        return None if self.method_file is None else self.method_file['McCC']
+
+    @lazy_property
+    def method_aggregates(self):
+        return self.get_method_aggregates()
+
+    # 类级代码度量
+    cc = class_column('CC')
+    cllc = class_column('CLLC')
+    loc = class_column('LOC')
+    nom = class_column('NM')
+    wmc = class_column('WMC')
+    cloc = class_column('LOC')
+    cbo = class_column('CBO')
+    dit = class_column('DIT')
+
+    @lazy_property
+    def loc_mean(self):
+        return self.loc.mean()
+
+    @lazy_property
+    def cbo_mean(self):
+        return self.cbo.mean()
+
+    # 代码异味指标
+    @lazy_property
+    def duplicate_code(self):
+        return self.get_duplicate_code()
+
+    @lazy_property
+    def long_parameter(self):
+        return self.get_long_parameter()
+
+    @lazy_property
+    def long_method(self):
+        return self.get_long_method()
+
+    @lazy_property
+    def lazy_class(self):
+        return self.get_lazy_class()
+
+    @lazy_property
+    def large_class(self):
+        return self.get_large_class()
+
+    # maintainability子指标
+    @lazy_property
+    def modularity(self):
+        return (self.duplicate_code + self.long_method + self.large_class) / 3
+
+    @lazy_property
+    def reusability(self):
+        return self.modularity
+
+    @lazy_property
+    def analyzability(self):
+        return (self.duplicate_code + self.long_parameter + self.long_method + self.lazy_class) / 4
+
+    @lazy_property
+    def modifiability(self):
+        return (self.duplicate_code + self.long_parameter + self.large_class) / 3
+
+    @lazy_property
+    def testability(self):
+        # 与modularity取值相同，但名字不同，不能共用同一个Series
+        return self.modularity.rename('testability')
+
+    # maintainability指标
+    @lazy_property
+    def maintainability(self):
+        return self.get_maintainability().rename('maintainability')
+
+    @lazy_property
+    def duplicate_code_V(self):
+        return self.duplicate_code.mean()
+
+    @lazy_property
+    def long_parameter_V(self):
+        return self.long_parameter.mean()
+
+    @lazy_property
+    def long_method_V(self):
+        return self.long_method.mean()
+
+    @lazy_property
+    def lazy_class_V(self):
+        return self.lazy_class.mean()
+
+    @lazy_property
+    def large_class_V(self):
+        return self.large_class.mean()
 
     def get_duplicate_code(self):
-        cc = self.cc.map(self._get_duplicate_code)
-        cllc = self.cllc.map(self._get_duplicate_code)
+        cc = self.DUPLICATE_CODE(self.cc)
+        cllc = self.DUPLICATE_CODE(self.cllc)
         # 先映射，再平均
         return (cc + cllc) / 2
 
-    def find_method(self, single_class):
-        """
-        返回类名为class_name的method数据框
-        :param single_class: 类名
-        :return: 相应的method数据框
-        """
-        return self.method_file[self.method_file['LongName'].str.startswith(single_class)]
+    @classmethod
+    def method_values(cls, method_file):
+        # 先对每个方法打分，再按类分组求和
+        long_parameter = cls.LONG_PARAMETER.score(method_file['NUMPAR'])
+        long_method = (long_parameter + cls.NBD.score(method_file['NL']) + cls.MLOC.score(method_file['LOC']) +
+                       cls.MCCC.score(method_file['McCC'])) / 4
+        return {'long_parameter': long_parameter, 'long_method': long_method}
 
-    @staticmethod
-    def _get_long_parameter(single_method):
-        if single_method <= 1:
-            lp = 2
-        elif single_method <= 3:
-            lp = 1
-        elif single_method <= 5:
-            lp = 0
-        elif single_method <= 7:
-            lp = -1
-        else:
-            lp = -2
-        return lp
-
-    def get_long_parameter_class(self, single_class):
-        df = self.find_method(single_class)
-        if len(df) == 0:
-            return 0
-        return df['NUMPAR'].map(self._get_long_parameter).mean()
-
-    def get_long_parameter(self):
-        return self.class_file['LongName'].map(self.get_long_parameter_class)
+    def get_method_aggregates(self):
+        return self.scan.aggregate_methods(self.class_file['LongName'], self.method_values)
 
     @staticmethod
-    def _get_nbd(single_class):
-        if single_class <= 1:
-            nbd = 2
-        elif single_class <= 2:
-            nbd = 1
-        elif single_class <= 4:
-            nbd = 0
-        elif single_class <= 6:
-            nbd = -1
-        else:
-            nbd = -2
-        return nbd
+    def _class_mean(aggregates, key):
+        # 类中没有方法时记为0
+        n = aggregates['n']
+        return (aggregates[f'{key}_sum'] / n).where(n > 0, 0)
 
-    @staticmethod
-    def _get_mloc(single_method):
-        if single_method <= 7:
-            mloc = 2
-        elif single_method <= 10:
-            mloc = 1
-        elif single_method <= 13:
-            mloc = 0
-        elif single_method <= 20:
-            mloc = -1
-        else:
-            mloc = -2
-        return mloc
-
-    @staticmethod
-    def _get_mccc(single_method):
-        if single_method <= 1.1:
-            mccc = 2
-        elif single_method <= 2.0:
-            mccc = 1
-        elif single_method <= 3.1:
-            mccc = 0
-        elif single_method <= 4.7:
-            mccc = -1
-        else:
-            mccc = -2
-        return mccc
-
-    def get_long_method_class(self, single_class):
-        df = self.find_method(single_class)
-        if len(df) == 0:
-            return 0
-        long_parameter = df['NUMPAR'].map(self._get_long_parameter)
-        part1 = df['NL'].map(self._get_nbd)
-        part2 = df['LOC'].map(self._get_mloc)
-        part3 = df['McCC'].map(self._get_mccc)
-        sum_vec = (long_parameter + part1 + part2 + part3) / 4
-        return sum_vec.mean()
+    def get_long_parameter(self):
+        return self._class_mean(self.method_aggregates, 'long_parameter')
 
     def get_long_method(self):
-        return self.class_file['LongName'].map(self.get_long_method_class)
+        return self._class_mean(self.method_aggregates, 'long_method')
 
-    @staticmethod
-    def _get_nom(single_class):
-        if single_class >= 1:
-            nom = 2
-        else:
-            nom = -2
-        return nom
-
-    def _get_lazy_class_part1(self, single_class):
-        # 考虑除数为0
-        if single_class['NM'] == 0:
-            p1 = -2
-        elif (single_class['LOC'] >= self.loc_mean) and (single_class['WMC'] / single_class['NM'] > 2):
-            p1 = 2
-        elif (single_class['LOC'] < self.loc_mean) and (single_class['WMC'] / single_class['NM'] <= 2):
-            p1 = -2
-        else:
-            p1 = 0
-        return p1
-
-    def _get_lazy_class_part2(self, single_class):
-        if (single_class['CBO'] >= self.cbo_mean) and (single_class['DIT'] <= 1):
-            p2 = 2
-        elif (single_class['CBO'] < self.cbo_mean) and (single_class['DIT'] > 1):
-            p2 = -2
-        else:
-            p2 = 0
-        return p2
+    def get_lazy_class_part1(self):
+        """
+        依次判断各条件，先满足的优先，同原先逐行的if/elif
+        """
+        # 考虑除数为0：NM为0时直接取-2，此时的inf不会被用到
+        wmc_per_method = self.wmc / self.nom
+        part1 = numpy.select([self.nom == 0,
+                              (self.loc >= self.loc_mean) & (wmc_per_method > 2),
+                              (self.loc < self.loc_mean) & (wmc_per_method <= 2)],
+                             [-2, 2, -2], default=0)
+        return pd.Series(part1, index=self.class_file.index)
+
+    def get_lazy_class_part2(self):
+        part2 = numpy.select([(self.cbo >= self.cbo_mean) & (self.dit <= 1),
+                              (self.cbo < self.cbo_mean) & (self.dit > 1)],
+                             [2, -2], default=0)
+        return pd.Series(part2, index=self.class_file.index)
 
     def get_lazy_class(self):
-        nom = self.nom.map(self._get_nom)
+        nom = self.NOM(self.nom)
         # mean会忽略NaN
-        part1 = self.class_file.apply(self._get_lazy_class_part1, axis=1)
-        part2 = self.class_file.apply(self._get_lazy_class_part2, axis=1)
+        part1 = self.get_lazy_class_part1()
+        part2 = self.get_lazy_class_part2()
 
         return (nom + part1 + part2) / 3
 
-    @staticmethod
-    def _get_large_class_nom(single_class):
-        if single_class <= 4:
-            nom = 2
-        elif single_class <= 7:
-            nom = 1
-        elif single_class <= 10:
-            nom = 0
-        elif single_class <= 15:
-            nom = -1
-        else:
-            nom = -2
-        return nom
-
-    @staticmethod
-    def _get_large_class_wmc(single_class):
-        if single_class <= 5:
-            wmc = 2
-        elif single_class <= 14:
-            wmc = 1
-        elif single_class <= 31:
-            wmc = 0
-        elif single_class <= 47:
-            wmc = -1
-        else:
-            wmc = -2
-        return wmc
-
-    @staticmethod
-    def _get_large_class_cloc(single_class):
-        if single_class <= 28:
-            cloc = 2
-        elif single_class <= 70:
-            cloc = 1
-        elif single_class <= 130:
-            cloc = 0
-        elif single_class <= 195:
-            cloc = -1
-        else:
-            cloc = -2
-        return cloc
-
-    @staticmethod
-    def _get_large_class_cbo(single_class):
-        if single_class <= 1:
-            cbo = 2
-        elif single_class <= 3:
-            cbo = 1
-        elif single_class <= 5:
-            cbo = 0
-        elif single_class <= 7:
-            cbo = -1
-        else:
-            cbo = -2
-        return cbo
-
     def get_large_class(self):
-        part0 = self.nom.map(self._get_large_class_nom)
-        part1 = self.wmc.map(self._get_large_class_wmc)
-        part2 = self.cloc.map(self._get_large_class_cloc)
-        part3 = self.cbo.map(self._get_large_class_cbo)
+        part0 = self.LARGE_CLASS_NOM(self.nom)
+        part1 = self.LARGE_CLASS_WMC(self.wmc)
+        part2 = self.LARGE_CLASS_CLOC(self.cloc)
+        part3 = self.LARGE_CLASS_CBO(self.cbo)
         return (part0 + part1 + part2 + part3) / 4
 
     def get_sub_iso25010(self):
-        modularity = (self.duplicate_code + self.long_method + self.large_class) / 3
-        reusability = modularity
-        analyzability = (self.duplicate_code + self.long_parameter + self.long_method + self.lazy_class) / 4
-        modifiability = (self.duplicate_code + self.long_parameter + self.large_class) / 3
-        testablility = modularity
-        return modularity, reusability, analyzability, modifiability, testablility
+        return self.modularity, self.reusability, self.analyzability, self.modifiability, self.testability
 
     def get_maintainability(self):
         return (self.modularity + self.reusability + self.analyzability + self.modifiability + self.testability) / 5
@@ -321,12 +320,13 @@ class Readability:
     Version、Class
     注意：不会包括所有的类，这些类的可读性为1
     """
+    CLASS_COLUMNS = ('LLOC',)
+    METHOD_COLUMNS = ()
 
-    def __init__(self, directory, name):
-        self.pmd_file = f'{directory}/sourcemeter/temp/{name}-PMD.xml'
-        self.class_file = pd.read_csv(f'{directory}/{name}-Class.csv').set_index('LongName', drop=False)
-        tree = ET.parse(self.pmd_file)
-        self.root = tree.getroot()
+    def __init__(self, directory, name=None):
+        self.scan = ScanResult.of(directory, name)
+        self.pmd_file = self.scan.pmd_path
+        self.class_file = self.scan.class_file
         self.violations = ['Best Practices', 'Documentation', 'Design', 'Code Style', 'Error Prone']
         self.lloc = self.class_file['LLOC'].sum()
         self.viol_per_loc = self.get_viol_per_loc()
@@ -335,34 +335,14 @@ class Readability:
 
     # 根据violation的种类和程度，获取每个逻辑行的平均violation权重
     def get_viol_per_loc(self):
-        class_d = {}
-
-        for file in self.root:
-            for item in file:
-                if ('class' not in item.attrib) or ('package' not in item.attrib):
-                    continue
-                class_name = item.attrib['package'] + '.' + item.attrib['class']
-                if item.attrib['ruleset'] in self.violations:
-                    if class_name not in class_d:
-                        class_d[class_name] = int(item.attrib['priority'])
-                        continue
-                    class_d[class_name] += int(item.attrib['priority'])
-
-        fail_objs = []
-        # 遍历class_d除以各自的lloc
-        for k in class_d.keys():
-            try:
-                lloc = self.class_file['LLOC'][k]
-                if type(lloc) == pd.core.series.Series:
-                    lloc = lloc.mean()
-                class_d[k] = class_d[k] / lloc
-            # pmd file中有一些interface被误标记为interface在class_file中找不到, 如果直接放弃也不可能造成与其他指标的不一致
-            except KeyError:
-                fail_objs.append(k)
-        # dataframe不能直接用.name改名，要先取成series
-        vio_per_loc = pd.DataFrame.from_dict(class_d, orient='index')[0]
-        valid_entries = vio_per_loc.drop(fail_objs)
-        return valid_entries
+        pmd = self.scan.pmd_violations
+        pmd = pmd[pmd['ruleset'].isin(self.violations)]
+        class_d = pmd.groupby('class', sort=False)['priority'].sum()
+        # 同名的类取LLOC均值
+        lloc = self.class_file['LLOC'].groupby(level=0).mean()
+        # pmd file中有一些interface被误标记为interface在class_file中找不到, 如果直接放弃也不可能造成与其他指标的不一致
+        valid_entries = class_d[class_d.index.isin(lloc.index)]
+        return valid_entries / lloc.reindex(valid_entries.index)
 
     @staticmethod
     def value_normalize(col):
@@ -378,23 +358,25 @@ class RU2000:
     使用RU2000计算项继承性
     the more, the better
     """
+    CLASS_COLUMNS = ('LCOM5', 'NPM', 'NA', 'NM', 'WMC', 'CLOC')
+    METHOD_COLUMNS = ('CLOC', 'LOC')
 
-    def __init__(self, directory, name):
-        self.dir = directory
-        self.class_file = pd.read_csv(f'{directory}/{name}-Class.csv').set_index('LongName', drop=False)
-        self.method_file = pd.read_csv(f'{directory}/{name}-Method.csv').set_index('LongName', drop=False)
+    def __init__(self, directory, name=None):
+        self.scan = ScanResult.of(directory, name)
+        self.dir = self.scan.dir
+        self.class_file = self.scan.class_file
+        # 流式读取Method.csv时不保留整个方法表
+        self.method_file = None if self.scan.stream_methods else self.scan.method_file
 
         self.lcom = self.class_file['LCOM5']
         self.cohesion = ((-2.26852 * self.lcom) + 103.259) / 100
         # 归一化upper
         self.npm = self.value_normalize(self.class_file['NPM'])
-        self.cloc_loc = self.class_file['LongName'].map(self.get_cloc_loc)
-        self.ncm_nm = self.class_file['LongName'].map(self.get_ncm_nm)
-        self.comments_in_definition_na_nm = self.class_file['LongName'].map(self.get_comments_in_definition_na_nm)
+        self.cloc_loc, self.ncm_nm, self.comments_in_definition_na_nm, loc_m = self.get_method_metrics()
         # upper limit metrics
         self.na = self.value_normalize(self.class_file['NA'])
         # 归一化upper
-        self.loc_m = self.value_normalize(self.class_file['LongName'].map(self.get_loc_m))
+        self.loc_m = self.value_normalize(loc_m)
         # 归一化upper
         self.wmc = self.value_normalize(self.class_file['WMC'])
 
@@ -412,86 +394,194 @@ class RU2000:
         threshold = col.median()
         return 1 / (1 + (col / threshold).pow(4))
 
-    def find_method(self, class_name):
+    @staticmethod
+    def method_values(method_file):
+        cloc = method_file['CLOC']
+        return {'cloc': cloc, 'loc': method_file['LOC'], 'commented': cloc > 0}
+
+    def get_method_metrics(self):
         """
-        返回类名为class_name的method数据框
-        :param class_name: 类名
-        :return: 相应的method数据框
+        按类分组计算cloc_loc、ncm_nm、comments_in_definition_na_nm和loc_m，与原先逐类筛选方法再计算的结果一致
         """
-        return self.method_file[self.method_file['LongName'].str.startswith(class_name)]
-
-    def get_cloc_loc(self, class_name):
-        df = self.find_method(class_name)
-        # 如果类中没有方法，则无方法粒度的平均值，无法计算的情况下直接返回0，以下同理
-        if len(df) == 0:
-            return 0
-        comment_lines_per_method = df['CLOC'].mean()
-        loc_per_method = df['LOC'].mean()
-        return comment_lines_per_method / loc_per_method
-
-    def get_ncm_nm(self, class_name):
-        df = self.find_method(class_name)
-        if len(df) == 0:
-            return 0
-        num_of_commented_methods = sum(df['CLOC'] > 0)
-        return num_of_commented_methods / len(df)
-
-    def get_comments_in_definition_na_nm(self, class_name):
-        df = self.find_method(class_name)
-        if len(df) == 0:
-            return 0
-        num_of_method_comments = df['CLOC'].sum()
-        num_of_class_comments = self.class_file['CLOC'][class_name]
-        if type(num_of_class_comments) == pd.core.series.Series:
-            num_of_class_comments = num_of_class_comments.mean()
+        agg = self.scan.aggregate_methods(self.class_file['LongName'], self.method_values)
+        # 如果类中没有方法，则无方法粒度的平均值，直接记为0
+        has_method = agg['n'] > 0
+        comment_lines_per_method = agg['cloc_sum'] / agg['cloc_count']
+        loc_per_method = agg['loc_sum'] / agg['loc_count']
+        cloc_loc = (comment_lines_per_method / loc_per_method).where(has_method, 0)
+        ncm_nm = (agg['commented_sum'] / agg['n']).where(has_method, 0)
+        loc_m = loc_per_method.where(has_method, 0)
+
+        # 同名的类取均值
+        duplicated = self.class_file.index.duplicated(keep=False)
+        num_of_class_comments = self.class_file['CLOC']
+        nam = self.class_file['NA'] + self.class_file['NM']
+        # 原先逐类计算时只有na + nm为整数才判断是否为0：NA、NM列中有缺失值（即浮点列）时照常相除
+        integer_members = pd.api.types.is_integer_dtype(nam)
+        if duplicated.any():
+            num_of_class_comments = num_of_class_comments.groupby(level=0).transform('mean')
+            nam = nam.groupby(level=0).transform('mean')
         # 类定义的comments = 所有的comments - 方法的comments
-        num_of_def_comments = num_of_class_comments - num_of_method_comments
-        na = self.class_file['NA'][class_name]
-        nm = self.class_file['NM'][class_name]
-        nam = na + nm
+        num_of_def_comments = num_of_class_comments - agg['cloc_sum']
+        # 不重名的类na + nm为0时记为0，重名类取均值后（浮点数）照常相除
+        no_member = (nam == 0) & ~duplicated & integer_members
+        # 除数为0时按原先的结果记为inf或NaN，不提示警告
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            comments_in_definition_na_nm = (num_of_def_comments / nam).mask(~has_method | no_member, 0)
+        return cloc_loc, ncm_nm, comments_in_definition_na_nm, loc_m
 
-        if type(nam) == pd.core.series.Series:
-            nam = nam.mean()
+    def get_reusability(self):
+        reusability = (self.Modularity + self.InterfaceSize + self.Documentation + self.Complexity) / 4
+        return reusability
 
-        if (type(nam) == numpy.int64) and (nam == 0):
-            return 0
 
-        return num_of_def_comments / nam
+CALCULATORS = (Complexity, ISO25010, Readability, RU2000, Inheritance)
 
-    def get_loc_m(self, class_name):
-        df = self.find_method(class_name)
-        if len(df) == 0:
-            return 0
-        loc_per_method = df['LOC'].mean()
-        return loc_per_method
 
-    def get_reusability(self):
-        reusability = (self.Modularity + self.InterfaceSize + self.Documentation + self.Complexity) / 4
-        return reusability
+class Indicator:
+    """
+    指标注册表中的一项
+    :param calculator: 计算类，同一版本中用到同一计算类的指标共用一个实例，中间结果缓存在实例上
+    :param attr: 计算类上的结果属性
+    :param inputs: 用到的扫描文件：'Class'、'Method'、'PMD'
+    :param class_columns: 用到的Class.csv度量列，默认为计算类声明的全部列，method_columns同理
+    :param depends: 用到的中间结果（计算类上的属性），先于attr求值
+    """
+
+    def __init__(self, calculator, attr, inputs=('Class',), class_columns=None, method_columns=None, depends=()):
+        self.calculator = calculator
+        self.attr = attr
+        self.inputs = inputs
+        self.class_columns = calculator.CLASS_COLUMNS if class_columns is None else class_columns
+        self.method_columns = calculator.METHOD_COLUMNS if method_columns is None else method_columns
+        self.depends = depends
+
+
+INDICATORS = {
+    # 类的文件路径，用作计算结果的行名
+    'index': Indicator(Complexity, 'index'),
+    'complexity': Indicator(Complexity, 'complexity'),
+    'maintainability': Indicator(ISO25010, 'maintainability', ('Class', 'Method'),
+                                 depends=('duplicate_code', 'long_parameter', 'long_method', 'lazy_class',
+                                          'large_class')),
+    'testability': Indicator(ISO25010, 'testability', ('Class', 'Method'),
+                             class_columns=('CC', 'CLLC', 'LOC', 'NM', 'WMC', 'CBO'),
+                             depends=('duplicate_code', 'long_method', 'large_class')),
+    'readability': Indicator(Readability, 'readability', ('Class', 'PMD')),
+    'reusability': Indicator(RU2000, 'reusability', ('Class', 'Method')),
+    'inheritance': Indicator(Inheritance, 'inheritance'),
+}
+# cq_calculator结果中各列的顺序
+INDICATOR_NAMES = ('maintainability', 'testability', 'readability', 'reusability', 'inheritance', 'complexity')
+
+
+def required_columns(calculators):
+    """
+    汇总各计算类声明的度量列，作为ScanResult的class_columns、method_columns参数
+    """
+    class_columns = {col for calculator in calculators for col in calculator.CLASS_COLUMNS}
+    method_columns = {col for calculator in calculators for col in calculator.METHOD_COLUMNS}
+    return {'class_columns': sorted(class_columns), 'method_columns': sorted(method_columns)}
+
+
+def indicator_columns(names):
+    """
+    汇总所选指标用到的度量列，同required_columns
+    """
+    indicators = [INDICATORS[name] for name in names]
+    class_columns = {col for indicator in indicators for col in indicator.class_columns}
+    method_columns = {col for indicator in indicators for col in indicator.method_columns}
+    return {'class_columns': sorted(class_columns), 'method_columns': sorted(method_columns)}
 
 
 def remove_dup(series):
     return series[~series.index.duplicated()]
 
 
+def run_calculator(calculator, scan, names):
+    """
+    用一个计算类计算若干指标，只返回这些指标（在进程池中运行时只传回这些Series）
+    """
+    instance = calculator(scan)
+    results = {}
+    for name in names:
+        indicator = INDICATORS[name]
+        for attr in indicator.depends:
+            getattr(instance, attr)
+        results[name] = remove_dup(getattr(instance, indicator.attr))
+    return results
+
+
+def make_executor(kind, max_workers=None):
+    """
+    :param kind: 'thread'为线程池，'process'为进程池
+    进程池用spawn方式启动，避免在多线程的web进程中fork
+    """
+    if kind == 'thread':
+        return ThreadPoolExecutor(max_workers)
+    if kind == 'process':
+        return ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context('spawn'))
+    raise ValueError(f'unknown executor: {kind}')
+
+
+def evaluate_indicators(scan, names=INDICATOR_NAMES, executor=None, max_workers=None):
+    """
+    只计算所选的指标，返回{指标名: Series}
+    用不到的计算类不会实例化，其输入文件也不会解析，如不选readability时不读取PMD.xml
+    :param executor: None为依次计算；'thread'、'process'或一个Executor实例为按计算类并行计算，总耗时接近最慢的一项
+    """
+    groups = {}
+    for name in names:
+        groups.setdefault(INDICATORS[name].calculator, []).append(name)
+    if executor is None:
+        results = [run_calculator(calculator, scan, group) for calculator, group in groups.items()]
+    else:
+        pool = executor if isinstance(executor, Executor) else make_executor(executor, max_workers or len(groups))
+        if isinstance(pool, ProcessPoolExecutor):
+            # 多个计算类共用的文件先在本进程解析一次（并写入缓存），子进程不再重复解析
+            inputs = [{kind for name in group for kind in INDICATORS[name].inputs} for group in groups.values()]
+            if sum('Class' in kinds for kinds in inputs) > 1:
+                scan.class_file
+            if sum('Method' in kinds for kinds in inputs) > 1 and not scan.stream_methods:
+                scan.method_file
+        try:
+            futures = [pool.submit(run_calculator, calculator, scan, group) for calculator, group in groups.items()]
+            results = [future.result() for future in futures]
+        finally:
+            if pool is not executor:
+                pool.shutdown()
+    merged = {}
+    for result in results:
+        merged.update(result)
+    return merged
+
+
 # 为某个version计算六项指标的工具函数
 # 返回值是一个合并后的df
-def cq_calculator(version_scan_results_directory, project_name):
-    params = [version_scan_results_directory, project_name]
-    complexity_calculator = Complexity(*params)
-    complexity, index = remove_dup(complexity_calculator.complexity), remove_dup(complexity_calculator.index)
-    maintainability_calculator = ISO25010(*params)
-    maintainability, testablility = remove_dup(maintainability_calculator.maintainability), remove_dup(
-        maintainability_calculator.testability)
-    readability = remove_dup(Readability(*params).readability)
-    reusability = remove_dup(RU2000(*params).reusability)
-    inheritance = remove_dup(Inheritance(*params).inheritance)
-    # 合并该版本的计算结果
-    df = pd.concat([maintainability, testablility, readability, reusability, inheritance, complexity], axis=1)
+def cq_calculator(version_scan_results_directory, project_name, executor=None, max_workers=None,
+                  indicators=INDICATOR_NAMES, source_dir=None):
+    """
+    :param indicators: 只计算其中的指标，结果只包含这些列
+    :param source_dir: 扫描时的源码目录（-projectBaseDir），类路径中该目录之后的部分接在project_name之后；
+                       为None或类路径中没有该目录时，从类路径中第一次出现project_name处截取
+    """
+    names = ['index', *indicators]
+    # 各个计算类共用同一份解析结果，只读取所选指标用到的列
+    scan = ScanResult(version_scan_results_directory, project_name, **indicator_columns(names))
+    results = evaluate_indicators(scan, names, executor, max_workers)
+    index = results['index']
+    # 合并该版本的计算结果，缺少的类（如没有violation的类）补为NaN
+    df = pd.concat([results[name] for name in indicators], axis=1).reindex(index.index)
     assert len(index) > 0, f'{version_scan_results_directory} has no classes'
     # 选择语言不对应，扫描结果为空时不会成立
-    path0 = index[0]
-    start_index = path0.find(project_name)
-    df.index = [s[start_index:] for s in index]
+    path0 = index.iloc[0]
+    # 在worktree中扫描时，类路径为.../OSSworktrees/<project>/<version>/src/...，截取后各版本的路径仍然一致
+    marker = f"/{source_dir.strip('/')}/" if source_dir else None
+    if marker and marker in path0:
+        start_index = path0.find(marker) + len(marker)
+        df.index = [f'{project_name}/{s[start_index:]}' for s in index]
+    else:
+        start_index = path0.find(project_name)
+        df.index = [s[start_index:] for s in index]
     df.fillna(1, inplace=True)
     return df
@@ -0,0 +1,229 @@
+"""
+数组表示的指标树：代替每个节点一个dict、一个list的嵌套结构，只在需要时转换为原有的嵌套格式
+"""
+import sys
+
+import numpy
+
+from .cq_calc import INDICATOR_NAMES
+
+
+class Hierarchy:
+    """
+    节点按插入顺序编号，0为根节点，父节点的编号总小于子节点的编号
+    parent: 父节点编号（int32），根节点为-1
+    segment: 节点名称的最后一段在segments中的编号（int32），根节点为-1
+    segments: 去重（驻留）后的名称片段表
+    leaf: 是否为类节点
+    values: 各节点的指标（float32），每行一个节点，列的顺序同indicators
+    根节点的名称为name，其余节点的完整名称为base加上从根到该节点的各段名称，用/连接
+    """
+
+    def __init__(self, name, base, parent, segment, segments, leaf, values, indicators=INDICATOR_NAMES):
+        self.name = name
+        self.base = base
+        self.parent = parent
+        self.segment = segment
+        self.segments = segments
+        self.leaf = leaf
+        self.values = values
+        self.indicators = tuple(indicators)
+
+    def __len__(self):
+        return len(self.parent)
+
+    @classmethod
+    def from_frame(cls, df, proj_path, name, indicators=INDICATOR_NAMES):
+        """
+        由cq_calculator的结果构造，累加规则与原有的convert相同：
+        只保留以proj_path开头的类路径，到达类粒度（路径在df.index中）后不再向下展开
+        :param df: 以类路径为索引、各项指标为列的数据框
+        :param proj_path: 即项目路径（名称），对应根节点
+        :param name: 根节点的名称，如project_name(version_name)
+        """
+        rows = {}
+        for i, path in enumerate(df.index):
+            # 重名的类取第一次出现的一行
+            rows.setdefault(path, i)
+        parent, segment, leaf_rows = [-1], [-1], [-1]
+        segment_ids = {}
+        children = {}
+        prefix = proj_path + '/'
+        for path in df.index:
+            if not path.startswith(prefix):
+                continue
+            node = 0
+            node_path = proj_path
+            for frag in path[len(prefix):].split('/'):
+                node_path = f'{node_path}/{frag}'
+                frag_id = segment_ids.setdefault(frag, len(segment_ids))
+                key = (node, frag_id)
+                child = children.get(key)
+                if child is None:
+                    child = children[key] = len(parent)
+                    parent.append(node)
+                    segment.append(frag_id)
+                    leaf_rows.append(rows.get(node_path, -1))
+                if leaf_rows[child] >= 0:
+                    # 已经到达类粒度
+                    break
+                node = child
+        leaf_rows = numpy.asarray(leaf_rows, dtype=numpy.int64)
+        leaf = leaf_rows >= 0
+        values = numpy.zeros((len(parent), len(indicators)), dtype=numpy.float64)
+        values[leaf] = df[list(indicators)].to_numpy(dtype=numpy.float64)[leaf_rows[leaf]]
+        hierarchy = cls(name, proj_path, numpy.asarray(parent, dtype=numpy.int32),
+                        numpy.asarray(segment, dtype=numpy.int32), [sys.intern(frag) for frag in segment_ids],
+                        leaf, values, indicators)
+        hierarchy.values = hierarchy.rollup(values).astype(numpy.float32)
+        return hierarchy
+
+    def depth(self):
+        depth = numpy.zeros(len(self), dtype=numpy.int32)
+        # 父节点的编号总小于子节点，按编号顺序即可逐个确定深度
+        for node in range(1, len(self)):
+            depth[node] = depth[self.parent[node]] + 1
+        return depth
+
+    def rollup(self, values):
+        """
+        自底向上累加：从最深的一层开始，每层用一次numpy.add.at把子节点的指标加到父节点上
+        用float64累加，避免大项目中float32的舍入误差
+        """
+        values = numpy.array(values, dtype=numpy.float64)
+        values[~self.leaf] = 0
+        depth = self.depth()
+        order = numpy.argsort(depth, kind='stable')
+        bounds = numpy.searchsorted(depth[order], numpy.arange(depth.max(initial=0) + 2))
+        for level in range(len(bounds) - 2, 0, -1):
+            nodes = order[bounds[level]:bounds[level + 1]]
+            numpy.add.at(values, self.parent[nodes], values[nodes])
+        return values
+
+    def children(self):
+        """
+        各节点的子节点编号列表，保持插入顺序
+        """
+        children = [[] for _ in range(len(self))]
+        for node, parent in enumerate(self.parent.tolist()):
+            if parent >= 0:
+                children[parent].append(node)
+        return children
+
+    def full_names(self):
+        names = [self.name] * len(self)
+        segments = self.segments
+        parents = self.parent.tolist()
+        for node, segment in enumerate(self.segment.tolist()):
+            if node == 0:
+                continue
+            parent = parents[node]
+            names[node] = f'{self.base if parent == 0 else names[parent]}/{segments[segment]}'
+        return names
+
+    def relative_names(self):
+        names = [self.segments[segment] for segment in self.segment.tolist()]
+        names[0] = self.name
+        return names
+
+    def find(self, path):
+        """
+        按相对于根节点的路径（各段用/连接，空字符串为根节点）查找节点编号，找不到时返回None
+        """
+        children = self.children()
+        node = 0
+        for name in split_path(path):
+            node = next((child for child in children[node] if self.segments[self.segment[child]] == name), None)
+            if node is None:
+                return None
+        return node
+
+    def slice(self, path, depth):
+        """
+        以path对应的节点为根、向下depth层的子树，格式见nest_slice
+        """
+        node = self.find(path)
+        if node is None:
+            return None
+        children = self.children()
+        names = self.relative_names()
+        rows, level = [], [node]
+        for _ in range(depth + 1):
+            rows.extend((node, int(self.parent[node]), names[node], bool(self.leaf[node]), self.values[node].tolist())
+                        for node in level)
+            level = [child for node in level for child in children[node]]
+        return nest_slice(rows, self.indicators, path)
+
+    def root_values(self):
+        return dict(zip(self.indicators, self.values[0].tolist()))
+
+    def to_legacy(self, full_names=True):
+        """
+        转换为原有的嵌套格式：{"name", "children", <各项指标>}
+        :param full_names: 节点名称为完整路径；为False时只用最后一段，数据量小得多
+        """
+        names = self.full_names() if full_names else self.relative_names()
+        values = self.values.tolist()
+        nodes = []
+        for node, parent in enumerate(self.parent.tolist()):
+            item = {'name': names[node], 'children': []}
+            item.update(zip(self.indicators, values[node]))
+            nodes.append(item)
+            if parent >= 0:
+                nodes[parent]['children'].append(item)
+        return nodes[0]
+
+    @classmethod
+    def from_legacy(cls, tree, indicators=INDICATOR_NAMES):
+        """
+        由原有的嵌套格式构造，节点名称中与父节点相同的前缀被去掉，只保留最后一段
+        """
+        parent, segment, leaf, values = [-1], [-1], [not tree['children']], [[tree[key] for key in indicators]]
+        segment_ids = {}
+        base = None
+        stack = [(0, tree)]
+        while stack:
+            node, item = stack.pop()
+            for child in item['children']:
+                parent_name, frag = child['name'].rsplit('/', 1)
+                if node == 0 and base is None:
+                    base = parent_name
+                parent.append(node)
+                segment.append(segment_ids.setdefault(frag, len(segment_ids)))
+                leaf.append(not child['children'])
+                values.append([child[key] for key in indicators])
+                stack.append((len(parent) - 1, child))
+        return cls(tree['name'], base or '', numpy.asarray(parent, dtype=numpy.int32),
+                   numpy.asarray(segment, dtype=numpy.int32), [sys.intern(frag) for frag in segment_ids],
+                   numpy.asarray(leaf, dtype=bool), numpy.asarray(values, dtype=numpy.float32), indicators)
+
+
+def split_path(path):
+    return path.split('/') if path else []
+
+
+def nest_slice(rows, indicators, path):
+    """
+    把子树各节点组装为嵌套格式：{"name", "path", "leaf", "children", <各项指标>}
+    path为相对于根节点的路径，可作为下一次请求的参数；最底一层的非类节点leaf为False、children为空，需要时再展开
+    指标同to_treemap保留两位小数
+    :param rows: (node, parent, name, leaf, values)，父节点在子节点之前，第一行为子树的根
+    """
+    items = {}
+    for node, parent, name, leaf, values in rows:
+        item = {'name': name, 'path': path, 'leaf': leaf, 'children': []}
+        item.update(zip(indicators, (round(value, 2) for value in values)))
+        if items:
+            parent_item = items[parent]
+            item['path'] = f'{parent_item["path"]}/{name}' if parent_item['path'] else name
+            parent_item['children'].append(item)
+        items[node] = item
+    return items[rows[0][0]]
+
+
+def root_values(document):
+    """
+    只读取根节点（整个版本）的各项指标，不构造整棵树
+    :param document: 之前嵌入在版本文档中的calc_results，为原有的嵌套格式
+    """
+    return {key: document[key] for key in INDICATOR_NAMES}
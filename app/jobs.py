@@ -0,0 +1,337 @@
+"""
+扫描、计算任务的队列：任务存于MongoDB的jobs集合，由独立的工作进程池领取执行，Web进程只负责入队和查询状态
+工作进程定期写入心跳，进程退出或重启后，心跳超时的任务重新入队，超过重试次数的记为失败
+运行中的任务写入子进程输出的进度；请求取消后，工作进程结束正在执行的子进程，任务记为cancelled
+"""
+import datetime
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import traceback
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, MongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from .models import Version
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+ACTIVE_STATES = [QUEUED, RUNNING]
+FINISHED_STATES = [DONE, FAILED, CANCELLED]
+HEARTBEAT_SECONDS = 30
+# 检查是否请求取消的间隔
+CANCEL_POLL_SECONDS = 2
+# 写入进度的最小间隔
+PROGRESS_SECONDS = 1
+# 超过该时间没有心跳的任务视为其工作进程已退出
+STALE_SECONDS = 120
+MAX_ATTEMPTS = 3
+POLL_SECONDS = 2
+# 查询状态时返回的字段
+STATUS_FIELDS = {'kind': 1, 'project_name': 1, 'version_name': 1, 'user_name': 1, 'state': 1, 'step': 1,
+                 'progress': 1, 'cancel': 1, 'attempts': 1, 'error': 1, 'created': 1, 'started': 1, 'finished': 1,
+                 'revision': 1}
+# 批量任务进度中每个任务返回的字段
+BATCH_JOB_FIELDS = {'version_name': 1, 'state': 1, 'step': 1, 'progress': 1, 'error': 1}
+
+
+def to_object_id(job_id):
+    try:
+        return ObjectId(job_id)
+    except (InvalidId, TypeError):
+        return None
+
+
+class JobQueue:
+    """
+    任务文档：{_id, kind, project_name, version_name, user_name, state, step, progress, cancel, worker, attempts,
+    error, created, started, heartbeat, finished, active}
+    active在排队、运行中时为True，结束时删除，同一版本的同类任务最多只有一个active
+    state: queued、running、done、failed、cancelled；step为运行中的阶段，如scan、calc
+    progress为当前阶段子进程输出的进度{'phase', 'percent', 'line'}，cancel表示已请求取消运行中的任务
+    revision在状态、阶段、进度每次变化时加1，轮询时以此判断是否有新的状态
+    批量任务存于batches集合：{_id, kind, project_name, user_name, jobs, skipped, created}，jobs为按执行顺序排列的任务编号
+    """
+
+    def __init__(self, mongo):
+        self.mongo = mongo
+        self.jobs = mongo.db.jobs
+
+    def ensure_indexes(self):
+        self.jobs.create_index([('state', ASCENDING), ('created', ASCENDING)])
+        self.jobs.create_index([('project_name', ASCENDING), ('version_name', ASCENDING), ('state', ASCENDING)])
+        self.jobs.create_index([('kind', ASCENDING), ('project_name', ASCENDING), ('version_name', ASCENDING)],
+                               unique=True, partialFilterExpression={'active': True})
+
+    def enqueue(self, kind, project_name, version_name=None, user_name=None):
+        """
+        同一个版本已有排队或运行中的同类任务时不重复入队
+        查找和插入在一次upsert中完成，并发入队时由active任务上的唯一索引保证只有一个
+        :return: 任务编号
+        """
+        key = {'kind': kind, 'project_name': project_name, 'version_name': version_name, 'active': True}
+        job = {'user_name': user_name, 'state': QUEUED, 'step': None, 'progress': None, 'cancel': False,
+               'worker': None, 'attempts': 0, 'error': None, 'created': datetime.datetime.utcnow(), 'revision': 0}
+        while True:
+            try:
+                return self.jobs.find_one_and_update(key, {'$setOnInsert': job}, {'_id': 1}, upsert=True,
+                                                     return_document=ReturnDocument.AFTER)['_id']
+            except DuplicateKeyError:
+                # 另一个请求同时插入了同一版本的任务，重新查找
+                continue
+
+    def get(self, job_id):
+        """
+        :return: 任务状态，编号不合法或不存在时为None
+        """
+        job_id = to_object_id(job_id)
+        if job_id is None:
+            return None
+        job = self.jobs.find_one({'_id': job_id}, STATUS_FIELDS)
+        if job is not None:
+            job['_id'] = str(job['_id'])
+            job.setdefault('revision', 0)
+            for key in ('created', 'started', 'finished'):
+                if job.get(key) is not None:
+                    job[key] = str(job[key])
+        return job
+
+    def enqueue_batch(self, kind, project_name, version_names, user_name=None, skipped=None):
+        """
+        按version_names的顺序把多个版本的任务入队，并记录为一个批量任务
+        :param skipped: 已经完成、不需要入队的版本名，只用于统计进度
+        :return: 批量任务编号
+        """
+        job_ids = [self.enqueue(kind, project_name, version_name, user_name) for version_name in version_names]
+        batch = {'kind': kind, 'project_name': project_name, 'user_name': user_name, 'jobs': job_ids,
+                 'skipped': list(skipped or []), 'created': datetime.datetime.utcnow()}
+        return self.mongo.db.batches.insert_one(batch).inserted_id
+
+    def get_batch(self, batch_id):
+        """
+        汇总批量任务中各个任务的状态
+        :return: 批量任务进度，编号不合法或不存在时为None
+        """
+        batch_id = to_object_id(batch_id)
+        if batch_id is None:
+            return None
+        batch = self.mongo.db.batches.find_one({'_id': batch_id})
+        if batch is None:
+            return None
+        jobs = list(self.jobs.find({'_id': {'$in': batch['jobs']}}, BATCH_JOB_FIELDS))
+        counts = dict.fromkeys(ACTIVE_STATES + FINISHED_STATES, 0)
+        for job in jobs:
+            counts[job['state']] += 1
+        total = len(batch['jobs'])
+        if counts[QUEUED] + counts[RUNNING] > 0:
+            state = RUNNING
+        else:
+            state = FAILED if counts[FAILED] > 0 else (CANCELLED if counts[CANCELLED] > 0 else DONE)
+        return {'_id': str(batch['_id']), 'kind': batch['kind'], 'project_name': batch['project_name'],
+                'user_name': batch['user_name'], 'created': str(batch['created']), 'state': state,
+                'total': total, 'skipped': len(batch['skipped']), 'counts': counts,
+                'progress': sum(counts[key] for key in FINISHED_STATES) / total if total else 1.0,
+                'running': [{'version_name': job['version_name'], 'step': job['step'], 'progress': job.get('progress')}
+                            for job in jobs if job['state'] == RUNNING],
+                # 只返回错误信息的最后一行，完整信息通过/api/jobs/<job_id>查询
+                'failed': [{'job_id': str(job['_id']), 'version_name': job['version_name'],
+                            'error': job['error'].strip().splitlines()[-1] if job['error'] else None}
+                           for job in jobs if job['state'] == FAILED]}
+
+    def claim(self, worker):
+        """
+        按入队顺序领取一个任务，同一时刻入队的按_id排序
+        """
+        now = datetime.datetime.utcnow()
+        return self.jobs.find_one_and_update(
+            {'state': QUEUED},
+            {'$set': {'state': RUNNING, 'worker': worker, 'started': now, 'heartbeat': now},
+             '$inc': {'attempts': 1, 'revision': 1}},
+            sort=[('created', ASCENDING), ('_id', ASCENDING)], return_document=ReturnDocument.AFTER)
+
+    def heartbeat(self, job_id, worker):
+        self.jobs.update_one({'_id': job_id, 'worker': worker, 'state': RUNNING},
+                             {'$set': {'heartbeat': datetime.datetime.utcnow()}})
+
+    def set_step(self, job_id, step):
+        self.jobs.update_one({'_id': job_id}, {'$set': {'step': step, 'progress': None}, '$inc': {'revision': 1}})
+
+    def set_progress(self, job_id, worker, progress):
+        self.jobs.update_one({'_id': job_id, 'worker': worker, 'state': RUNNING},
+                             {'$set': {'progress': progress}, '$inc': {'revision': 1}})
+
+    def is_cancelled(self, job_id):
+        job = self.jobs.find_one({'_id': job_id}, {'cancel': 1})
+        return job is not None and job.get('cancel', False)
+
+    def cancel(self, job_id):
+        """
+        排队中的任务直接取消；运行中的任务标记为请求取消，由工作进程结束子进程后记为cancelled
+        :return: 取消后的任务状态，编号不合法或不存在时为None
+        """
+        job_id = to_object_id(job_id)
+        if job_id is None:
+            return None
+        self.jobs.update_one({'_id': job_id, 'state': QUEUED},
+                             {'$set': {'state': CANCELLED, 'cancel': True, 'finished': datetime.datetime.utcnow()},
+                              '$unset': {'active': ''}, '$inc': {'revision': 1}})
+        self.jobs.update_one({'_id': job_id, 'state': RUNNING, 'cancel': {'$ne': True}},
+                             {'$set': {'cancel': True}, '$inc': {'revision': 1}})
+        return self.get(job_id)
+
+    def finish(self, job_id, worker, error=None, cancelled=False):
+        if cancelled:
+            state = CANCELLED
+        else:
+            state = DONE if error is None else FAILED
+        self.jobs.update_one({'_id': job_id, 'worker': worker, 'state': RUNNING},
+                             {'$set': {'state': state, 'error': error, 'step': None,
+                                       'finished': datetime.datetime.utcnow()},
+                              '$unset': {'active': ''}, '$inc': {'revision': 1}})
+
+    def requeue_stale(self):
+        """
+        心跳超时的任务重新入队，已达到重试次数的记为失败
+        """
+        deadline = datetime.datetime.utcnow() - datetime.timedelta(seconds=STALE_SECONDS)
+        stale = {'state': RUNNING, 'heartbeat': {'$lt': deadline}}
+        # 已请求取消的不再重新入队
+        self.jobs.update_many(dict(stale, cancel=True),
+                              {'$set': {'state': CANCELLED, 'step': None, 'finished': datetime.datetime.utcnow()},
+                               '$unset': {'active': ''}, '$inc': {'revision': 1}})
+        self.jobs.update_many(dict(stale, attempts={'$gte': MAX_ATTEMPTS}),
+                              {'$set': {'state': FAILED, 'error': 'worker lost', 'step': None,
+                                        'finished': datetime.datetime.utcnow()},
+                               '$unset': {'active': ''}, '$inc': {'revision': 1}})
+        self.jobs.update_many(stale, {'$set': {'state': QUEUED, 'worker': None, 'step': None},
+                                      '$inc': {'revision': 1}})
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobMonitor:
+    """
+    运行中的任务：在后台线程中写入心跳、检查是否请求取消，并按PROGRESS_SECONDS的间隔写入进度
+    """
+
+    def __init__(self, queue, job_id, worker):
+        self.queue = queue
+        self.job_id = job_id
+        self.worker = worker
+        # 请求取消后被设置，传给子进程的执行函数
+        self.cancelled = threading.Event()
+        self.stopped = threading.Event()
+        self.last_progress = 0
+
+    def progress(self, progress):
+        now = time.monotonic()
+        if now - self.last_progress >= PROGRESS_SECONDS:
+            self.last_progress = now
+            self.queue.set_progress(self.job_id, self.worker, progress)
+
+    def check(self):
+        # 在两个步骤之间检查是否请求取消
+        if self.cancelled.is_set():
+            raise JobCancelled(self.job_id)
+
+    def watch(self):
+        last_beat = time.monotonic()
+        while not self.stopped.wait(CANCEL_POLL_SECONDS):
+            if self.queue.is_cancelled(self.job_id):
+                self.cancelled.set()
+            if time.monotonic() - last_beat >= HEARTBEAT_SECONDS:
+                last_beat = time.monotonic()
+                self.queue.heartbeat(self.job_id, self.worker)
+
+
+def run_version_job(mongo, queue, job, monitor):
+    """
+    扫描并计算一个版本，已完成的步骤不再重复
+    """
+    version = Version.get_version(job['project_name'], job['version_name'], mongo)
+    if version is None:
+        raise LookupError(f"no version {job['version_name']} in {job['project_name']}")
+    if not version.scanned:
+        queue.set_step(job['_id'], 'scan')
+        version.scan(progress=monitor.progress, cancelled=monitor.cancelled)
+    monitor.check()
+    if not version.calculated:
+        queue.set_step(job['_id'], 'calc')
+        version.calc()
+
+
+# 任务类型及其执行函数：func(mongo, queue, job, monitor)
+JOB_HANDLERS = {
+    'version': run_version_job,
+}
+
+
+class Database:
+    """
+    工作进程中不使用Flask，只提供models所需的db属性，用法同PyMongo
+    """
+
+    def __init__(self, uri):
+        self.cx = MongoClient(uri)
+        self.db = self.cx.get_default_database()
+
+
+def run_job(mongo, queue, job, worker):
+    # 执行期间在后台线程中写入心跳、检查是否请求取消
+    monitor = JobMonitor(queue, job['_id'], worker)
+    watcher = threading.Thread(target=monitor.watch, daemon=True)
+    watcher.start()
+    try:
+        JOB_HANDLERS[job['kind']](mongo, queue, job, monitor)
+    except Exception:
+        if monitor.cancelled.is_set():
+            queue.finish(job['_id'], worker, cancelled=True)
+        else:
+            queue.finish(job['_id'], worker, error=traceback.format_exc())
+    else:
+        queue.finish(job['_id'], worker)
+    finally:
+        monitor.stopped.set()
+        watcher.join()
+
+
+def work(uri):
+    """
+    工作进程：循环领取并执行任务
+    """
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    mongo = Database(uri)
+    queue = JobQueue(mongo)
+    while True:
+        queue.requeue_stale()
+        job = queue.claim(worker)
+        if job is None:
+            time.sleep(POLL_SECONDS)
+            continue
+        print(f"{worker}: {job['kind']} {job['project_name']} {job['version_name']}")
+        run_job(mongo, queue, job, worker)
+
+
+def run_workers(uri, n_workers):
+    """
+    启动n_workers个工作进程，退出的进程会被重新启动
+    """
+    JobQueue(Database(uri)).ensure_indexes()
+    ctx = multiprocessing.get_context('spawn')
+    processes = {}
+    try:
+        while True:
+            for i in range(n_workers):
+                if i not in processes or not processes[i].is_alive():
+                    # 不设为daemon，CALC_EXECUTOR=process时工作进程中计算指标还需要创建进程池
+                    processes[i] = ctx.Process(target=work, args=(uri,))
+                    processes[i].start()
+            time.sleep(POLL_SECONDS)
+    finally:
+        for process in processes.values():
+            process.terminate()
@@ -1,7 +1,6 @@
 """
 Flask视图函数
 """
-import json
 import os
 
 from flask import Flask, url_for, request, g
@@ -11,7 +10,10 @@ from flask_pymongo import PyMongo
 from pymongo import MongoClient
 
 from ..errors import my_auth_error, api_message
+from ..jobs import FINISHED_STATES, JobQueue
 from ..models import User, Project, Version
+from ..node_store import MAX_SLICE_DEPTH, load_hierarchy, load_slice
+from ..render_cache import RenderCache, cached_response
 from ..utils import get_tags_github
 from ..visualize import to_treemap, to_linechart
 
@@ -27,6 +29,8 @@ if os.getenv('RUN'):
     mongo = PyMongo(app, uri=f'{mongodb_url}/run')
     app.config['SECRET_KEY'] = 'mql'
     app.config['mongo'] = mongo
+    RenderCache(mongo).ensure_indexes()
+    JobQueue(mongo).ensure_indexes()
     if not User.get_user('mql', app.config['mongo']):
         common_user = User(user_name='mql', passwd_hash='python', mongo=app.config['mongo'])
         common_user.save()
@@ -44,32 +48,58 @@ def query_treemap():
     version_name = request.json.get('version_name')
     # project_name = 'alibaba/cooma'
     # version_name = '0.4.0'
+    # 默认节点名称只用最后一段，需要完整路径时传入full_names
+    full_names = bool(request.json.get('full_names', False))
+    query = {'project_name': project_name, 'version_name': version_name}
+    version = app.config['mongo'].db.versions.find_one(query, {'calc_tree.tree': 1})
+    if version is None:
+        return api_message(404, message=f'no version {version_name} in {project_name}')
+    # key中包含指标树的编号，重新计算后不会读到之前的结果
+    key = f"treemap:{project_name}:{version_name}:{version.get('calc_tree', {}).get('tree')}:{full_names}"
+
+    def render():
+        hierarchy = load_hierarchy(app.config['mongo'], app.config['mongo'].db.versions.find_one(query))
+        if hierarchy is None:
+            return api_message(404, message=f'{project_name}({version_name}) has not been calculated')
+        data = {'treemap_opts': to_treemap(hierarchy, project_name, version_name, full_names=full_names)}
+        return api_message(200, code=1000, data=data)
+
+    return cached_response(app.config['mongo'], key, project_name, version_name, render)
+
+
+# 逐层展开的treemap：只返回path下depth层的节点，前端点击时再以子节点的path请求
+@app.route('/api/treemap/nodes', methods=['POST'])
+def query_treemap_nodes():
+    project_name = request.json.get('project_name')
+    version_name = request.json.get('version_name')
+    path = request.json.get('path', '')
+    depth = request.json.get('depth', 2)
+    try:
+        depth = int(depth)
+    except (TypeError, ValueError):
+        return api_message(400, message=f'invalid depth {depth}')
+    # 超出范围的depth截断到0..MAX_SLICE_DEPTH，返回的depth为实际展开的层数
+    depth = min(max(depth, 0), MAX_SLICE_DEPTH)
     version = app.config['mongo'].db.versions.find_one({'project_name': project_name, 'version_name': version_name})
-    calc_results = version['calc_results']
-    c = to_treemap(calc_results, project_name, version_name)
-    treemap_opts_str = c.dump_options_with_quotes()
-    data = {'treemap_opts': json.loads(treemap_opts_str)}
+    if version is None:
+        return api_message(404, message=f'no version {version_name} in {project_name}')
+    tree = load_slice(app.config['mongo'], version, path, depth)
+    if tree is None:
+        return api_message(404, message=f'no node {path} in {project_name}({version_name})')
+    data = {'path': path, 'depth': depth, 'tree': tree}
     return api_message(200, code=1000, data=data)
 
 
 @app.route('/api/linechart', methods=['POST'])
 def query_linechart():
     project_name = request.json.get('project_name')
-    versions = app.config['mongo'].db.versions.find({'project_name': project_name})
-    versions_data = [{
-        'version_name': version['version_name'],
-        'complexity': version['calc_results']['complexity'],
-        'maintainability': version['calc_results']['maintainability'],
-        'testability': version['calc_results']['testability'],
-        'readability': version['calc_results']['readability'],
-        'reusability': version['calc_results']['reusability'],
-        'inheritance': version['calc_results']['inheritance'],
-    }
-        for version in versions if version['calc_results']]
-    c = to_linechart(versions_data, project_name)
-    linechart_opts_str = c.dump_options_with_quotes()
-    data = {'linechart_opts': json.loads(linechart_opts_str)}
-    return api_message(200, code=1000, data=data)
+
+    def render():
+        versions_data = Version.get_summaries(project_name, app.config['mongo'])
+        data = {'linechart_opts': to_linechart(versions_data, project_name)}
+        return api_message(200, code=1000, data=data)
+
+    return cached_response(app.config['mongo'], f'linechart:{project_name}', project_name, None, render)
 
 
 @app.route('/api/users', methods=['POST'])
@@ -274,10 +304,13 @@ def get_version():
         return api_message(404)
     if 'mql' in version.project.owners_list:
         data = dict(version)
+        hierarchy = version.get_hierarchy()
+        if hierarchy is not None:
+            data['calc_results'] = hierarchy.to_legacy(full_names=request_dict.get('full_names', True))
         return api_message(200, 1000, data=data)
 
 
-# 扫描、计算version的指标数值
+# 扫描、计算version的指标数值：加入任务队列后立即返回任务编号，由工作进程执行（见worker.py）
 @app.route('/api/version', methods=['PUT'])
 @auth.login_required
 def get_version_results():
@@ -286,12 +319,102 @@ def get_version_results():
     # 通过user来判断是否可以获取
     if version is None:
         return api_message(404)
-    if g.user.user_name in version.project.owners_list:
-        if not version.scanned:
-            version.scan()
-        if not version.calculated:
-            version.calc()
-    return api_message(201, code=1000, message='finished scanning and claculating task')
+    if g.user.user_name not in version.project.owners_list:
+        return api_message(403, message=f"The user {g.user.user_name} hasn't added the project {version.project_name}.")
+    if version.scanned and version.calculated:
+        return api_message(200, code=1000, message='the version has been scanned and calculated')
+    job_id = str(JobQueue(app.config['mongo']).enqueue('version', version.project_name, version.version_name,
+                                                       g.user.user_name))
+    new_info = {'Location': url_for('get_job', job_id=job_id, _external=True)}
+    response_data, http_code = api_message(202, code=1000, message='scanning and calculating task queued',
+                                           data={'job_id': job_id})
+    return response_data, http_code, new_info
+
+
+# 查询任务状态：queued、running、done、failed
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@auth.login_required
+def get_job(job_id):
+    job = JobQueue(app.config['mongo']).get(job_id)
+    if job is None:
+        return api_message(404, message=f'no job {job_id}')
+    return api_message(200, code=1000, data=job)
+
+
+# 轮询任务状态和进度：since为上次返回的revision，没有新的状态时返回304，不在工作线程中等待
+# 客户端每隔几秒以最新的revision再次请求，直到任务结束
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+@auth.login_required
+def get_job_events(job_id):
+    since = request.args.get('since')
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            return api_message(400, message=f'invalid since {since}')
+    job = JobQueue(app.config['mongo']).get(job_id)
+    if job is None:
+        return api_message(404, message=f'no job {job_id}')
+    if since is not None and job['revision'] <= since and job['state'] not in FINISHED_STATES:
+        return api_message(304)
+    return api_message(200, code=1000, data=job)
+
+
+# 取消任务：排队中的直接取消，运行中的由工作进程结束正在执行的git、SourceMeter进程
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+@auth.login_required
+def cancel_job(job_id):
+    queue = JobQueue(app.config['mongo'])
+    job = queue.get(job_id)
+    if job is None:
+        return api_message(404, message=f'no job {job_id}')
+    project = Project.get_project(job['project_name'], app.config['mongo'])
+    if project is None or g.user.user_name not in project.owners_list:
+        return api_message(403, message=f"The user {g.user.user_name} hasn't added the project {job['project_name']}.")
+    if job['state'] in FINISHED_STATES:
+        return api_message(409, message=f"job {job_id} has been {job['state']}", data=job)
+    return api_message(200, code=1000, message='cancel requested', data=queue.cancel(job_id))
+
+
+# 批量扫描、计算项目的版本：可用first、last限定版本范围（含两端），pattern为版本名的通配符
+# 按提交时间顺序入队，跳过已经扫描并计算的版本，由多个工作进程并行执行
+@app.route('/api/batches', methods=['POST'])
+@auth.login_required
+def new_batch():
+    request_dict = request.json
+    project_name = request_dict.get('project_name')
+    project = Project.get_project(project_name, app.config['mongo'])
+    if project is None:
+        return api_message(404, message=f'no project {project_name}')
+    if g.user.user_name not in project.owners_list:
+        return api_message(403, message=f"The user {g.user.user_name} hasn't added the project {project_name}.")
+    versions = Version.select_versions(project_name, app.config['mongo'], first=request_dict.get('first'),
+                                       last=request_dict.get('last'), pattern=request_dict.get('pattern'))
+    if versions is None:
+        return api_message(404, message=f"no version {request_dict.get('first')} or {request_dict.get('last')} "
+                                        f"in {project_name}")
+    finished = [version['version_name'] for version in versions
+                if version.get('scanned') and version.get('calculated')]
+    pending = [version['version_name'] for version in versions
+               if not (version.get('scanned') and version.get('calculated'))]
+    if len(pending) == 0:
+        return api_message(200, code=1000, message=f'{len(finished)} versions have been scanned and calculated')
+    batch_id = str(JobQueue(app.config['mongo']).enqueue_batch('version', project_name, pending, g.user.user_name,
+                                                               skipped=finished))
+    new_info = {'Location': url_for('get_batch', batch_id=batch_id, _external=True)}
+    response_data, http_code = api_message(202, code=1000, message=f'{len(pending)} versions queued',
+                                           data={'batch_id': batch_id, 'queued': pending, 'skipped': finished})
+    return response_data, http_code, new_info
+
+
+# 查询批量任务的进度：各状态的任务数、运行中的版本及其阶段、失败的版本
+@app.route('/api/batches/<batch_id>', methods=['GET'])
+@auth.login_required
+def get_batch(batch_id):
+    batch = JobQueue(app.config['mongo']).get_batch(batch_id)
+    if batch is None:
+        return api_message(404, message=f'no batch {batch_id}')
+    return api_message(200, code=1000, data=batch)
 
 
 # 获取某个项目的version信息
@@ -1,9 +1,14 @@
 """
 # My Simple MongoDB ORM: User, Project, Version
 """
+import fnmatch
+
 from flask_pymongo import PyMongo
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer, SignatureExpired, BadSignature
 
+from .hierarchy import root_values
+from .node_store import NodeStore, load_hierarchy
+from .render_cache import RenderCache
 from .utils import CodeManager, CodeScanner, IndicatorsCalculator, get_tags_local, get_last_commit_local
 
 
@@ -189,6 +194,7 @@ class Project:
         # TypeError: documents must be a non - empty list
         if len(new_versions) > 0:
             self.mongo.db.versions.insert_many(new_versions)
+        RenderCache(self.mongo).invalidate(self.project_name)
         return True
 
     def delete(self, user_name):
@@ -198,6 +204,8 @@ class Project:
             code_manager.remove()
             self.mongo.db.projects.delete_one({'project_name': self.project_name})
             self.mongo.db.versions.delete_many({'project_name': self.project_name})
+            NodeStore(self.mongo).delete_project(self.project_name)
+            RenderCache(self.mongo).invalidate(self.project_name)
         myquery = {'project_name': self.project_name}
         new_values = {'$set': {'owners_list': self.owners_list}}
         self.mongo.db.projects.update_one(myquery, new_values)
@@ -207,7 +215,7 @@ class Project:
 # 把Version独立出来作为Project的versions_list的对象，用来存储结果，分析在Project中调用
 class Version:
     def __init__(self, project, version_name, mongo, version_committer, version_time, scanned=False, calculated=False,
-                 calc_results=None):
+                 calc_results=None, calc_tree=None, calc_summary=None):
         if calc_results is None:
             calc_results = {}
         self.project = project
@@ -220,6 +228,9 @@ class Version:
         self.calculated = calculated
         self.version_scan_results_dir = f'OSSresults/{self.project_name}/java/{self.version_name}'
         self.calc_results = calc_results
+        # 节点存储中指标树的概要，见NodeStore
+        self.calc_tree = calc_tree
+        self.calc_summary = calc_summary
 
     @staticmethod
     def keys():
@@ -242,7 +253,9 @@ class Version:
 
     @staticmethod
     def get_versions(project_name, mongo):
-        versions_cursor = mongo.db.versions.find({'project_name': project_name}).sort('version_time')
+        # 不返回指标树，需要时通过get_version逐个获取；calc_summary很小，一并返回
+        versions_cursor = mongo.db.versions.find({'project_name': project_name},
+                                                 {'calc_results': 0, 'calc_tree': 0}).sort('version_time')
         versions_list = list(versions_cursor)
         # 用于展示用户的项目信息，暂时全部返回
         for i in range(len(versions_list)):
@@ -250,12 +263,67 @@ class Version:
             versions_list[i]['version_time'] = str(versions_list[i]['version_time'])
         return versions_list
 
-    def scan(self):
-        # 实例化CodeScanner
-        cs = CodeScanner(self)
-        # 切换到本实例对应的版本
-        cs.checkout()
-        cs.scan()
+    @staticmethod
+    def select_versions(project_name, mongo, first=None, last=None, pattern=None):
+        """
+        按提交时间排序的版本，用于批量扫描
+        :param first: 起始版本名（含），为None时从最早的版本开始
+        :param last: 结束版本名（含），为None时到最新的版本为止
+        :param pattern: 版本名的通配符，如v1.*
+        :return: [{'version_name', 'scanned', 'calculated'}]；first或last不存在时返回None
+        """
+        versions = list(mongo.db.versions.find({'project_name': project_name},
+                                               {'_id': 0, 'version_name': 1, 'scanned': 1, 'calculated': 1})
+                        .sort('version_time'))
+        names = [version['version_name'] for version in versions]
+        if (first is not None and first not in names) or (last is not None and last not in names):
+            return None
+        start = 0 if first is None else names.index(first)
+        stop = len(names) if last is None else names.index(last) + 1
+        return [version for version in versions[start:stop]
+                if pattern is None or fnmatch.fnmatchcase(version['version_name'], pattern)]
+
+    @staticmethod
+    def get_summaries(project_name, mongo):
+        """
+        各个已计算版本的根节点指标，只读取版本文档中的calc_summary
+        之前计算、还没有calc_summary的版本从指标树中读取根节点，并补写calc_summary
+        :return: [{'version_name', <各项指标>}]
+        """
+        versions = list(mongo.db.versions.find({'project_name': project_name, 'calculated': True},
+                                               {'_id': 0, 'version_name': 1, 'calc_summary': 1}))
+        missing = [version['version_name'] for version in versions if not version.get('calc_summary')]
+        if missing:
+            summaries = Version.backfill_summaries(project_name, missing, mongo)
+            for version in versions:
+                if not version.get('calc_summary'):
+                    version['calc_summary'] = summaries.get(version['version_name'])
+        return [{'version_name': version['version_name'], **version['calc_summary']}
+                for version in versions if version['calc_summary']]
+
+    @staticmethod
+    def backfill_summaries(project_name, version_names, mongo):
+        versions = list(mongo.db.versions.find({'project_name': project_name, 'version_name': {'$in': version_names}},
+                                               {'_id': 0, 'version_name': 1, 'calc_tree': 1, 'calc_results': 1}))
+        summaries = NodeStore(mongo).root_values(
+            project_name, {version['version_name']: version['calc_tree'] for version in versions
+                           if version.get('calc_tree')})
+        summaries.update((version['version_name'], root_values(version['calc_results'])) for version in versions
+                         if not version.get('calc_tree') and version.get('calc_results'))
+        for version_name, summary in summaries.items():
+            mongo.db.versions.update_one({'project_name': project_name, 'version_name': version_name},
+                                         {'$set': {'calc_summary': summary}})
+        return summaries
+
+    def get_hierarchy(self):
+        return load_hierarchy(self.mongo, {'project_name': self.project_name, 'version_name': self.version_name,
+                                           'calc_tree': self.calc_tree, 'calc_results': self.calc_results})
+
+    def scan(self, progress=None, cancelled=None):
+        # 实例化CodeScanner，progress、cancelled见CodeScanner
+        cs = CodeScanner(self, progress=progress, cancelled=cancelled)
+        # 在单独的worktree中检出本实例对应的版本并扫描
+        cs.scan_version()
         myquery = {'project_name': self.project_name, 'version_name': self.version_name}
         new_values = {'$set': {'scanned': True}}
         self.mongo.db.versions.update_one(myquery, new_values)
@@ -264,8 +332,18 @@ class Version:
     def calc(self):
         # 在project的时候，version就存到mongodb，有计算结果之后只需要更新字段
         ci = IndicatorsCalculator(self)
-        indicators = ci.calc_indicators()
+        hierarchy = ci.calc_indicators()
+        node_store = NodeStore(self.mongo)
+        calc_tree = node_store.save(self.project_name, self.version_name, hierarchy)
         myquery = {'project_name': self.project_name, 'version_name': self.version_name}
-        new_values = {'$set': {'calculated': True, 'calc_results': indicators}}
+        # 版本文档中只保留概要，指向新写入的节点，之后再删除之前的节点
+        # calc_summary为根节点的各项指标，折线图只读取这一字段
+        calc_summary = hierarchy.root_values()
+        new_values = {'$set': {'calculated': True, 'calc_results': None, 'calc_tree': calc_tree,
+                               'calc_summary': calc_summary}}
         self.mongo.db.versions.update_one(myquery, new_values)
+        node_store.delete_stale(self.project_name, self.version_name, calc_tree['tree'])
+        RenderCache(self.mongo).invalidate(self.project_name, self.version_name)
+        self.calc_tree = calc_tree
+        self.calc_summary = calc_summary
         return True
@@ -0,0 +1,153 @@
+"""
+指标树的节点存储：每个节点一个文档，存于nodes集合，以(project_name, version_name, parent)建索引
+versions中只保留树的概要（calc_tree），不再把整棵树嵌入版本文档，避免大项目超出16MB的文档上限
+"""
+import sys
+
+import numpy
+from bson import ObjectId
+from pymongo import ASCENDING
+
+from .hierarchy import Hierarchy, nest_slice, split_path
+
+NODES_INDEX = [('project_name', ASCENDING), ('version_name', ASCENDING), ('parent', ASCENDING)]
+NODE_FIELDS = {'_id': 0, 'node': 1, 'parent': 1, 'name': 1, 'leaf': 1, 'values': 1}
+# 一次请求最多展开的层数
+MAX_SLICE_DEPTH = 8
+
+
+class NodeStore:
+    """
+    节点文档：{project_name, version_name, tree, node, parent, name, leaf, values}
+    tree: 每次计算生成的编号，versions中的calc_tree.tree指向当前的一代；新一代写完后才切换并删除旧的节点，
+    读取时按tree过滤，重新计算的过程中读到的总是完整的一棵树
+    node、parent: 节点编号与父节点编号，同Hierarchy，根节点的parent为-1
+    name: 根节点为完整名称，其余节点为名称的最后一段
+    values: 各项指标，顺序同calc_tree.indicators
+    """
+
+    def __init__(self, mongo):
+        self.mongo = mongo
+        self.nodes = mongo.db.nodes
+
+    def ensure_indexes(self):
+        # 已存在时不会重复创建
+        self.nodes.create_index(NODES_INDEX)
+
+    def save(self, project_name, version_name, hierarchy):
+        """
+        写入新的一代节点
+        :return: 存入versions的概要
+        """
+        self.ensure_indexes()
+        tree = ObjectId()
+        names = hierarchy.relative_names()
+        parents = hierarchy.parent.tolist()
+        leaves = hierarchy.leaf.tolist()
+        values = hierarchy.values.tolist()
+        documents = ({'project_name': project_name, 'version_name': version_name, 'tree': tree, 'node': node,
+                      'parent': parents[node], 'name': names[node], 'leaf': leaves[node], 'values': values[node]}
+                     for node in range(len(hierarchy)))
+        # insert_many会自动分批发送
+        self.nodes.insert_many(documents, ordered=False)
+        return {'tree': tree, 'name': hierarchy.name, 'base': hierarchy.base,
+                'indicators': list(hierarchy.indicators), 'nodes': len(hierarchy)}
+
+    def delete_stale(self, project_name, version_name, tree):
+        """
+        删除某个版本中不属于当前一代的节点
+        """
+        self.nodes.delete_many({'project_name': project_name, 'version_name': version_name, 'tree': {'$ne': tree}})
+
+    def delete_project(self, project_name):
+        self.nodes.delete_many({'project_name': project_name})
+
+    def load(self, project_name, version_name, calc_tree):
+        """
+        读取整棵树
+        """
+        n_nodes = calc_tree['nodes']
+        parent = numpy.full(n_nodes, -1, dtype=numpy.int32)
+        segment = numpy.full(n_nodes, -1, dtype=numpy.int32)
+        leaf = numpy.zeros(n_nodes, dtype=bool)
+        values = numpy.zeros((n_nodes, len(calc_tree['indicators'])), dtype=numpy.float32)
+        segment_ids = {}
+        cursor = self.nodes.find({'project_name': project_name, 'version_name': version_name,
+                                  'tree': calc_tree['tree']}, NODE_FIELDS)
+        # 不要求按编号排序，按编号放回各数组即可
+        for document in cursor:
+            node = document['node']
+            parent[node] = document['parent']
+            leaf[node] = document['leaf']
+            values[node] = document['values']
+            if node:
+                segment[node] = segment_ids.setdefault(document['name'], len(segment_ids))
+        return Hierarchy(calc_tree['name'], calc_tree['base'], parent, segment,
+                         [sys.intern(frag) for frag in segment_ids], leaf, values, calc_tree['indicators'])
+
+    def slice(self, project_name, version_name, calc_tree, path, depth):
+        """
+        读取以path对应的节点为根、向下depth层的子树，每一层用(project_name, version_name, parent)索引查询一次
+        :param path: 相对于根节点的路径，各段用/连接，空字符串为根节点
+        :return: nest_slice的结果，找不到path时返回None
+        """
+        query = {'project_name': project_name, 'version_name': version_name, 'tree': calc_tree['tree']}
+        # 逐级按名称查找
+        document = self.nodes.find_one(dict(query, parent=-1), NODE_FIELDS)
+        for name in split_path(path):
+            if document is None:
+                return None
+            document = self.nodes.find_one(dict(query, parent=document['node'], name=name), NODE_FIELDS)
+        if document is None:
+            return None
+        rows, level = [], [document]
+        for i in range(depth + 1):
+            rows.extend((document['node'], document['parent'], document['name'], document['leaf'],
+                         document['values']) for document in level)
+            parents = [document['node'] for document in level if not document['leaf']]
+            if i == depth or not parents:
+                break
+            # 按编号排序，子节点的顺序同计算时的插入顺序
+            level = sorted(self.nodes.find(dict(query, parent={'$in': parents}), NODE_FIELDS),
+                           key=lambda document: document['node'])
+        return nest_slice(rows, calc_tree['indicators'], path)
+
+    def root_values(self, project_name, calc_trees):
+        """
+        一次查询读取多个版本的根节点指标
+        :param calc_trees: {version_name: calc_tree}
+        :return: {version_name: {indicator: value}}
+        """
+        trees = {calc_tree['tree']: calc_tree for calc_tree in calc_trees.values()}
+        cursor = self.nodes.find({'project_name': project_name, 'parent': -1, 'tree': {'$in': list(trees)}},
+                                 {'_id': 0, 'version_name': 1, 'tree': 1, 'values': 1})
+        return {document['version_name']: dict(zip(trees[document['tree']]['indicators'], document['values']))
+                for document in cursor}
+
+
+def load_hierarchy(mongo, version):
+    """
+    读取版本文档对应的指标树：新的版本在节点存储中，之前的版本仍嵌入在calc_results中
+    :param version: 版本文档，至少包含project_name、version_name、calc_tree、calc_results
+    :return: Hierarchy，未计算时为None
+    """
+    if version.get('calc_tree'):
+        return NodeStore(mongo).load(version['project_name'], version['version_name'], version['calc_tree'])
+    if version.get('calc_results'):
+        return Hierarchy.from_legacy(version['calc_results'])
+    return None
+
+
+def load_slice(mongo, version, path='', depth=2):
+    """
+    读取版本文档对应的指标树中的一个子树，depth不超过MAX_SLICE_DEPTH
+    之前嵌入在calc_results中的结果先构造整棵树再截取
+    :return: 子树，未计算或找不到path时为None
+    """
+    depth = min(max(depth, 0), MAX_SLICE_DEPTH)
+    if version.get('calc_tree'):
+        return NodeStore(mongo).slice(version['project_name'], version['version_name'], version['calc_tree'], path,
+                                      depth)
+    if version.get('calc_results'):
+        return Hierarchy.from_legacy(version['calc_results']).slice(path, depth)
+    return None
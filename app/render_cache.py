@@ -0,0 +1,132 @@
+"""
+图表结果的缓存：序列化、压缩后的响应存于MongoDB的renders集合，各gunicorn工作进程共用
+重新计算版本、更新或删除项目时使对应的缓存失效；同一个key同时未命中时只有一个请求生成，其余的等待其结果
+"""
+import datetime
+import gzip
+import json
+import time
+import uuid
+
+from flask import Response, request
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+# 生成中的占位最多保留的秒数，超时后（如生成的进程退出）由其他请求接手
+LOCK_SECONDS = 300
+POLL_SECONDS = 0.1
+# 单个文档不能超过16MB，过大的结果不缓存
+MAX_PAYLOAD = 15 * 2 ** 20
+# 缓存最多保留的秒数
+TTL_SECONDS = 7 * 24 * 3600
+
+
+class RenderCache:
+    """
+    缓存文档：{_id: key, project_name, version_name, state, owner, expires, payload, created}
+    state为pending时表示owner正在生成，expires为占位的期限；为ready时payload为gzip压缩的JSON
+    折线图等项目级别的缓存version_name为None
+    """
+
+    def __init__(self, mongo):
+        self.mongo = mongo
+        self.renders = mongo.db.renders
+
+    def ensure_indexes(self):
+        self.renders.create_index([('project_name', ASCENDING), ('version_name', ASCENDING)])
+        self.renders.create_index('created', expireAfterSeconds=TTL_SECONDS)
+
+    def get(self, key, project_name, version_name, render):
+        """
+        :param render: 未命中时调用，返回可以JSON序列化的响应内容
+        :return: gzip压缩的JSON
+        """
+        deadline = time.monotonic() + LOCK_SECONDS
+        while True:
+            document = self.renders.find_one({'_id': key})
+            if document is not None and document['state'] == 'ready':
+                return document['payload']
+            owner = self.lock(key, project_name, version_name, document)
+            if owner is not None:
+                return self.fill(key, owner, render)
+            if time.monotonic() > deadline:
+                # 一直等不到结果时自己生成，不写入缓存
+                return compress(render())
+            time.sleep(POLL_SECONDS)
+
+    def lock(self, key, project_name, version_name, document):
+        """
+        占位：没有缓存或之前的占位已超时时写入自己的owner
+        :return: owner，已被其他请求占用时为None
+        """
+        owner = uuid.uuid4().hex
+        now = datetime.datetime.utcnow()
+        expires = now + datetime.timedelta(seconds=LOCK_SECONDS)
+        if document is None:
+            try:
+                self.renders.insert_one({'_id': key, 'project_name': project_name, 'version_name': version_name,
+                                         'state': 'pending', 'owner': owner, 'expires': expires, 'created': now})
+            except DuplicateKeyError:
+                return None
+            return owner
+        if document['expires'] > now:
+            return None
+        result = self.renders.update_one({'_id': key, 'owner': document['owner'], 'state': 'pending'},
+                                         {'$set': {'owner': owner, 'expires': expires, 'created': now}})
+        return owner if result.modified_count else None
+
+    def fill(self, key, owner, render):
+        try:
+            payload = compress(render())
+        except Exception:
+            self.renders.delete_one({'_id': key, 'owner': owner})
+            raise
+        if len(payload) > MAX_PAYLOAD:
+            self.renders.delete_one({'_id': key, 'owner': owner})
+        else:
+            # 生成期间缓存被清除（版本重新计算等）时占位已不存在，结果不写入
+            self.renders.update_one({'_id': key, 'owner': owner},
+                                    {'$set': {'state': 'ready', 'payload': payload}, '$unset': {'expires': ''}})
+        return payload
+
+    def invalidate(self, project_name, version_name=None):
+        """
+        清除某个版本的缓存以及项目级别的缓存；不指定版本时清除整个项目的缓存
+        """
+        query = {'project_name': project_name}
+        if version_name is not None:
+            query['version_name'] = {'$in': [version_name, None]}
+        self.renders.delete_many(query)
+
+
+def compress(body):
+    return gzip.compress(json.dumps(body, separators=(',', ':')).encode('utf-8'), compresslevel=6)
+
+
+def cached_response(mongo, key, project_name, version_name, render):
+    """
+    以缓存的结果作为响应：客户端接受gzip时直接返回压缩的内容
+    :param render: 返回api_message的结果，状态码不是200时不缓存
+    """
+    responses = {}
+
+    def render_body():
+        body, http_code = responses['response'] = render()
+        if http_code != 200:
+            raise NotCached
+        return body
+
+    try:
+        payload = RenderCache(mongo).get(key, project_name, version_name, render_body)
+    except NotCached:
+        return responses['response']
+    if 'gzip' in request.accept_encodings:
+        response = Response(payload, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+    return Response(gzip.decompress(payload), mimetype='application/json')
+
+
+class NotCached(Exception):
+    pass
@@ -0,0 +1,160 @@
+"""
+流式执行子进程：边运行边读取输出，只保留最后若干行，并从git、SourceMeter的输出中解析进度
+子进程在新的进程组中运行，超时或取消时结束整个进程组（包括SourceMeter启动的分析程序）
+"""
+import codecs
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+
+# 默认保留的输出行数
+TAIL_LINES = 200
+# 不完整的行最多缓存的字符数，超过时按一行处理
+MAX_LINE_CHARS = 64 * 1024
+# 结束进程组时先发送SIGTERM，等待该时间后发送SIGKILL
+KILL_GRACE_SECONDS = 5
+POLL_SECONDS = 0.2
+# git的进度：Receiving objects:  45% (450/1000)、Resolving deltas: 100% (20/20), done.
+PROGRESS_PATTERN = re.compile(r'^(?:remote: )?(?P<phase>[A-Za-z][A-Za-z ]*?):\s+(?P<percent>\d{1,3})%')
+# SourceMeter没有百分比，以正在执行的步骤作为阶段，如：Running AnalyzerJava...、[Metric] Calculating...
+STEP_PATTERN = re.compile(r'^(?P<phase>(?:Running|Executing|Starting|\[\w+\])\s.*?)(?:\.{3})?$')
+
+
+class CommandError(RuntimeError):
+    def __init__(self, args, message, lines):
+        self.args_ = args
+        self.lines = list(lines)
+        tail = '\n'.join(self.lines[-20:])
+        super().__init__(f'command "{format_args(args)}" {message}:\n{tail}')
+
+
+class CommandTimeout(CommandError):
+    pass
+
+
+class CommandCancelled(CommandError):
+    pass
+
+
+def format_args(args):
+    return args if isinstance(args, str) else ' '.join(args)
+
+
+def parse_progress(line):
+    """
+    :return: {'phase', 'percent'}，不是进度信息时为None
+    """
+    match = PROGRESS_PATTERN.match(line)
+    if match:
+        return {'phase': match.group('phase'), 'percent': min(int(match.group('percent')), 100)}
+    match = STEP_PATTERN.match(line)
+    if match:
+        return {'phase': match.group('phase'), 'percent': None}
+    return None
+
+
+def kill_group(process):
+    """
+    结束子进程所在的进程组，SIGTERM后仍未退出的发送SIGKILL
+    """
+    if os.name != 'posix':
+        process.kill()
+        return
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    try:
+        process.wait(KILL_GRACE_SECONDS)
+    except subprocess.TimeoutExpired:
+        pass
+    try:
+        # 主进程已退出时，组中可能还有其他进程
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def read_lines(stream, on_line):
+    """
+    按\\n或\\r分行读取，git在同一行中用\\r刷新进度
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    pending = ''
+    while True:
+        chunk = stream.read1(65536) if hasattr(stream, 'read1') else stream.read(65536)
+        text = decoder.decode(chunk, final=not chunk)
+        pending += text
+        parts = re.split(r'\r\n|\r|\n', pending)
+        pending = parts.pop()
+        if len(pending) > MAX_LINE_CHARS:
+            parts.append(pending)
+            pending = ''
+        for part in parts:
+            on_line(part)
+        if not chunk:
+            break
+    if pending:
+        on_line(pending)
+
+
+def run_stream(args, cwd=None, timeout=None, cancelled=None, progress=None, max_lines=TAIL_LINES, shell=False):
+    """
+    执行命令并逐行读取输出（stderr合并到stdout）
+    :param args: 参数列表，shell为True时为命令字符串
+    :param timeout: 超时秒数，超时后结束进程组并抛出CommandTimeout
+    :param cancelled: threading.Event，被设置后结束进程组并抛出CommandCancelled
+    :param progress: 回调函数progress({'phase', 'percent', 'line'})，每读到一行非空输出调用一次
+    :param max_lines: 保留的输出行数，为None时保留全部（用于输出即结果的命令，如git log）
+    :return: 保留的非空输出行
+    """
+    lines = deque(maxlen=max_lines)
+    state = {'phase': None, 'percent': None, 'line': None}
+
+    def on_line(line):
+        line = line.strip()
+        if not line:
+            return
+        lines.append(line)
+        if progress is not None:
+            parsed = parse_progress(line)
+            if parsed is not None:
+                state.update(parsed)
+            state['line'] = line
+            progress(dict(state))
+
+    kwargs = {'start_new_session': True} if os.name == 'posix' else \
+        {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    process = subprocess.Popen(args, cwd=cwd, shell=shell, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, **kwargs)
+    reader = threading.Thread(target=read_lines, args=(process.stdout, on_line), daemon=True)
+    reader.start()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                code = process.wait(POLL_SECONDS)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+            if cancelled is not None and cancelled.is_set():
+                kill_group(process)
+                raise CommandCancelled(args, 'was cancelled', lines)
+            if deadline is not None and time.monotonic() > deadline:
+                kill_group(process)
+                raise CommandTimeout(args, f'timed out after {timeout}s', lines)
+    except BaseException:
+        if process.poll() is None:
+            kill_group(process)
+        raise
+    finally:
+        # 子进程退出后，其后台进程可能仍持有管道，不无限等待
+        reader.join(KILL_GRACE_SECONDS)
+        process.stdout.close()
+    if code != 0:
+        raise CommandError(args, f'exited with {code}', lines)
+    return list(lines)
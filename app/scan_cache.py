@@ -0,0 +1,199 @@
+"""
+扫描结果的持久化列式缓存：把解析、裁剪后的数据框按列存为.npy，放在原始扫描文件旁边
+再次计算同一版本时直接内存映射读取，不再解析CSV和XML；原始文件的大小或内容变化后缓存自动失效
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy
+import pandas as pd
+
+CACHE_FORMAT = 2
+
+
+def file_digest(path, chunk_size=2 ** 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': file_digest(path)}
+
+
+def save_frame(frame, directory):
+    """
+    数值列存为.npy；字符串和category列存为int32编码加上以换行分隔的取值表，NaN编码为-1
+    """
+    columns = []
+    for i, col in enumerate(frame.columns):
+        values = frame[col]
+        if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            numpy.save(f'{directory}/{i}.npy', values.to_numpy())
+            columns.append({'name': col, 'kind': 'numeric'})
+            continue
+        categorical = values.astype('category')
+        numpy.save(f'{directory}/{i}.npy', categorical.cat.codes.to_numpy().astype(numpy.int32))
+        with open(f'{directory}/{i}.txt', 'w', encoding='utf-8') as f:
+            f.write('\n'.join(categorical.cat.categories))
+        kind = 'category' if isinstance(values.dtype, pd.CategoricalDtype) else 'string'
+        columns.append({'name': col, 'kind': kind, 'categories': len(categorical.cat.categories)})
+    return columns
+
+
+def load_frame(directory, columns, names=None):
+    """
+    数值列直接使用内存映射的数组，不复制到内存中；mmap_mode为c，修改时只复制被修改的页，不写回文件
+    :param names: 只读取其中的列，为None时读取全部列
+    """
+    data = {}
+    for i, column in enumerate(columns):
+        if names is not None and column['name'] not in names:
+            continue
+        # 以ndarray的视图使用，仍共用映射的内存
+        values = numpy.load(f'{directory}/{i}.npy', mmap_mode='c').view(numpy.ndarray)
+        if column['kind'] == 'numeric':
+            data[column['name']] = values
+            continue
+        with open(f'{directory}/{i}.txt', encoding='utf-8') as f:
+            text = f.read()
+        categories = text.split('\n') if column['categories'] else []
+        if column['kind'] == 'category':
+            data[column['name']] = pd.Categorical.from_codes(values, categories)
+        else:
+            # 相同的取值共用同一个字符串对象
+            table = numpy.asarray(categories + [numpy.nan], dtype=object)
+            data[column['name']] = table[values]
+    # copy=False时各列不合并为一个二维块，数值列仍指向内存映射的数组
+    return pd.DataFrame(data, copy=False)
+
+
+class ScanCache:
+    """
+    一个版本目录下的缓存，每种扫描文件（kind）一个子目录
+    每次写入生成{kind}/<generation>/，写完后原子地替换{kind}/current（其内容为当前generation的名称），再删除旧的generation
+    读取时先读current，读到的generation在切换前一直完整；恰好在读取过程中被删除时重新读取current
+    """
+    POINTER = 'current'
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _generation(self, kind):
+        try:
+            with open(f'{self.directory}/{kind}/{self.POINTER}', encoding='utf-8') as f:
+                return f'{self.directory}/{kind}/{f.read().strip()}'
+        except OSError:
+            return None
+
+    @staticmethod
+    def _meta(generation):
+        try:
+            with open(f'{generation}/meta.json', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _valid(self, meta, generation, source, columns):
+        if meta is None or meta['format'] != CACHE_FORMAT:
+            return False
+        if columns is None:
+            if not meta['all_columns']:
+                return False
+        elif not set(columns) <= {column['name'] for column in meta['columns']}:
+            return False
+        stat = os.stat(source)
+        signature = meta['source']
+        if stat.st_size != signature['size']:
+            return False
+        if stat.st_mtime_ns != signature['mtime_ns']:
+            # 修改时间变了（如被复制或touch），以内容哈希为准
+            if file_digest(source) != signature['sha1']:
+                return False
+            signature['mtime_ns'] = stat.st_mtime_ns
+            self._write_meta(generation, meta)
+        return True
+
+    @staticmethod
+    def _write_meta(generation, meta):
+        path = f'{generation}/meta.json'
+        try:
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            pass
+
+    def _read(self, kind, source, columns):
+        """
+        :return: 缓存的数据框，没有缓存或已失效时为None
+        """
+        # 第一次读到的generation可能刚好被新的写入替换并删除，此时重新读取current
+        for _ in range(2):
+            generation = self._generation(kind)
+            if generation is None:
+                return None
+            meta = self._meta(generation)
+            if meta is None:
+                continue
+            if not self._valid(meta, generation, source, columns):
+                return None
+            try:
+                return load_frame(generation, meta['columns'], columns)
+            except FileNotFoundError:
+                continue
+        return None
+
+    def load(self, kind, source, columns, parse):
+        """
+        命中时从缓存读取，否则调用parse()解析原文件并写入缓存
+        :param source: 原始扫描文件，缓存以其大小和内容哈希为键
+        :param columns: 需要的列，为None时需要全部列
+        """
+        frame = self._read(kind, source, columns)
+        if frame is not None:
+            return frame
+        frame = parse()
+        try:
+            self.save(kind, source, columns, frame)
+        except OSError:
+            # 结果目录不可写时只是不缓存
+            pass
+        return frame
+
+    def save(self, kind, source, columns, frame):
+        signature = file_signature(source)
+        kind_dir = f'{self.directory}/{kind}'
+        os.makedirs(kind_dir, exist_ok=True)
+        generation = tempfile.mkdtemp(dir=kind_dir, prefix='gen-')
+        try:
+            meta = {'format': CACHE_FORMAT, 'source': signature, 'all_columns': columns is None, 'rows': len(frame),
+                    'columns': save_frame(frame, generation)}
+            with open(f'{generation}/meta.json', 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            pointer = f'{kind_dir}/{self.POINTER}'
+            with open(f'{generation}.{self.POINTER}', 'w', encoding='utf-8') as f:
+                f.write(os.path.basename(generation))
+            os.replace(f'{generation}.{self.POINTER}', pointer)
+        except BaseException:
+            shutil.rmtree(generation, ignore_errors=True)
+            raise
+        # 切换后再删除之前的generation（以及之前格式的缓存文件），同时写入的其他进程已切换到的generation保留
+        kept = {os.path.basename(generation), self.POINTER, os.path.basename(self._generation(kind) or '')}
+        for name in os.listdir(kind_dir):
+            if name in kept:
+                continue
+            path = f'{kind_dir}/{name}'
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
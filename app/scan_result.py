@@ -0,0 +1,261 @@
+"""
+SourceMeter扫描结果的读取：每个版本的扫描文件只解析一次，供各个指标计算类共用
+"""
+import os
+import sys
+import threading
+import xml.etree.ElementTree as ET
+
+import numpy
+import pandas as pd
+
+from .scan_cache import ScanCache
+
+# 固定的列类型：标识符一律按字符串读取，避免形如数字的类名、包名被推断为数值
+ID_DTYPES = {'ID': str, 'Name': str, 'LongName': str, 'Parent': str, 'Component': str, 'Path': str}
+# 同一文件中的类共用Path，用category存储；Name用于字符串拼接，驻留后共用同一个字符串对象
+CATEGORY_COLUMNS = ['Path']
+INTERNED_COLUMNS = ['Name']
+INT32 = numpy.iinfo(numpy.int32)
+# Method.csv超过该大小时自动切换为分块流式聚合
+STREAM_METHODS_BYTES = 256 * 2 ** 20
+METHOD_CHUNK_ROWS = 200000
+
+
+def downcast(frame):
+    """
+    压缩数据框的内存占用：整数列转为int32，Path转为category，Name驻留
+    浮点列（CC、CLLC等）保持float64：它们要与0.03、0.05等十进制阈值比较，转为float32会使取值跨过阈值
+    """
+    for col in frame.columns:
+        values = frame[col]
+        if col in CATEGORY_COLUMNS:
+            frame[col] = values.astype('category')
+        elif col in INTERNED_COLUMNS:
+            frame[col] = values.map(sys.intern, na_action='ignore')
+        elif pd.api.types.is_integer_dtype(values) and len(values) > 0 and \
+                INT32.min <= values.min() and values.max() <= INT32.max:
+            frame[col] = values.astype(numpy.int32)
+    return frame
+
+
+def read_options(columns):
+    """
+    :param columns: 需要的度量列，LongName总会读取；为None时读取全部列
+    """
+    usecols = None if columns is None else sorted({'LongName', *columns})
+    dtype = ID_DTYPES if usecols is None else {col: ID_DTYPES[col] for col in usecols if col in ID_DTYPES}
+    return {'usecols': usecols, 'dtype': dtype}
+
+
+def index_by_long_name(frame):
+    return frame.set_index('LongName', drop=False)
+
+
+def read_scan_csv(path, columns=None, **kwargs):
+    """
+    读取SourceMeter的Class.csv或Method.csv
+    """
+    frame = pd.read_csv(path, **read_options(columns), **kwargs)
+    return index_by_long_name(downcast(frame))
+
+
+def iter_scan_csv(path, columns=None, chunksize=METHOD_CHUNK_ROWS):
+    """
+    分块读取，每次只在内存中保留chunksize行
+    """
+    for chunk in pd.read_csv(path, chunksize=chunksize, **read_options(columns)):
+        yield downcast(chunk).set_index('LongName', drop=False)
+
+
+def read_pmd_violations(path):
+    """
+    用iterparse流式读取PMD报告，边读边清理已处理的元素，只保留(package.class, ruleset, priority)
+    与原先遍历根节点的孙节点一致，缺少package或class属性的violation被忽略
+    """
+    classes, rulesets, priorities = [], [], []
+    root = None
+    depth = 0
+    for event, elem in ET.iterparse(path, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 2:
+            # <pmd><file><violation/></file></pmd>
+            attrib = elem.attrib
+            if 'class' in attrib and 'package' in attrib:
+                classes.append(sys.intern(attrib['package'] + '.' + attrib['class']))
+                rulesets.append(sys.intern(attrib.get('ruleset', '')))
+                priorities.append(int(attrib['priority']))
+            elem.clear()
+        elif depth == 1:
+            # 一个file处理完毕，释放根节点对它的引用
+            root.clear()
+    return pd.DataFrame({
+        'class': pd.Series(classes, dtype=object),
+        'ruleset': pd.Categorical(rulesets),
+        'priority': numpy.asarray(priorities, dtype=numpy.int32),
+    })
+
+
+class ScanResult:
+    """
+    一个版本的扫描结果，各文件在第一次用到时解析
+    class_columns、method_columns为需要读取的度量列，为None时读取全部列
+    stream_methods为True时分块读取Method.csv做聚合，为None时在第一次用到方法表时按文件大小自动选择
+    cache为True时解析结果缓存在{directory}/{name}-cache下，流式读取的Method.csv不缓存
+    可以在多个线程中共用，每个文件仍只解析一次；传给子进程时若启用了缓存，只传路径，子进程从缓存内存映射读取
+    """
+    LAZY_ATTRS = ('_class_file', '_method_file', '_method_index', '_pmd_violations')
+
+    def __init__(self, directory, name, class_columns=None, method_columns=None, stream_methods=None,
+                 chunksize=METHOD_CHUNK_ROWS, cache=True):
+        self.dir = directory
+        self.name = name
+        self.class_columns = class_columns
+        self.method_columns = method_columns
+        self.class_path = f'{directory}/{name}-Class.csv'
+        self.method_path = f'{directory}/{name}-Method.csv'
+        self.pmd_path = f'{directory}/sourcemeter/temp/{name}-PMD.xml'
+        self._stream_methods = stream_methods
+        self.chunksize = chunksize
+        self.cache = ScanCache(f'{directory}/{name}-cache') if cache else None
+        self._init_lazy()
+
+    def _init_lazy(self):
+        for attr in self.LAZY_ATTRS:
+            setattr(self, attr, None)
+        self._locks = {attr: threading.Lock() for attr in self.LAZY_ATTRS}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_locks']
+        if self.cache is not None:
+            for attr in self.LAZY_ATTRS:
+                state[attr] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._locks = {attr: threading.Lock() for attr in self.LAZY_ATTRS}
+
+    @classmethod
+    def of(cls, directory, name=None):
+        """
+        计算类既可以传入ScanResult，也可以沿用(directory, name)的写法
+        """
+        if isinstance(directory, cls):
+            return directory
+        return cls(directory, name)
+
+    def _lazy(self, attr, load):
+        # 双重检查，多个线程同时访问时只有一个线程解析
+        value = getattr(self, attr)
+        if value is None:
+            with self._locks[attr]:
+                value = getattr(self, attr)
+                if value is None:
+                    value = load()
+                    setattr(self, attr, value)
+        return value
+
+    def _load(self, kind, source, columns, parse):
+        if self.cache is None:
+            return parse()
+        return self.cache.load(kind, source, columns, parse)
+
+    def _load_csv(self, kind, source, columns):
+        columns = None if columns is None else {'LongName', *columns}
+        frame = self._load(kind, source, columns, lambda: downcast(pd.read_csv(source, **read_options(columns))))
+        return index_by_long_name(frame)
+
+    @property
+    def stream_methods(self):
+        # 只用到Class.csv、PMD报告的计算类不需要Method.csv
+        if self._stream_methods is None:
+            self._stream_methods = os.path.getsize(self.method_path) > STREAM_METHODS_BYTES
+        return self._stream_methods
+
+    @property
+    def class_file(self):
+        return self._lazy('_class_file', lambda: self._load_csv('Class', self.class_path, self.class_columns))
+
+    @property
+    def method_file(self):
+        return self._lazy('_method_file', lambda: self._load_csv('Method', self.method_path, self.method_columns))
+
+    @property
+    def method_index(self):
+        return self._lazy('_method_index', lambda: MethodIndex(self.method_file))
+
+    @property
+    def pmd_violations(self):
+        return self._lazy('_pmd_violations',
+                          lambda: self._load('PMD', self.pmd_path, None, lambda: read_pmd_violations(self.pmd_path)))
+
+    def aggregate_methods(self, class_names, method_values):
+        """
+        按类对方法做分组求和、计数，结果同MethodIndex.aggregate
+        :param method_values: 把方法数据框映射为{键: 列}的函数
+        流式模式下逐块读取Method.csv，只累加各块的部分和，不在内存中保留整个方法表；
+        参与求和的都是整数或0.25的整数倍，分块累加与整体求和的结果完全一致
+        """
+        if not self.stream_methods:
+            return self.method_index.aggregate(class_names, method_values(self.method_file))
+        total = None
+        for chunk in iter_scan_csv(self.method_path, self.method_columns, self.chunksize):
+            partial = MethodIndex(chunk).aggregate(class_names, method_values(chunk))
+            total = partial if total is None else total + partial
+        if total is None:
+            # 只有表头的Method.csv
+            empty = read_scan_csv(self.method_path, self.method_columns, nrows=0)
+            total = MethodIndex(empty).aggregate(class_names, method_values(empty))
+        return total
+
+
+class MethodIndex:
+    """
+    类→方法的前缀索引，每个版本只需构建一次
+    方法表按LongName排序后，以某个类名为前缀的方法恰好是连续的一段行，与按类名用str.startswith筛选的结果相同
+    """
+    # 比任何实际出现的字符都大，类名加上它即为前缀范围的上界
+    _MAX_CHAR = '\U0010ffff'
+
+    def __init__(self, method_file):
+        names = method_file['LongName'].to_numpy(dtype=object)
+        self.order = numpy.argsort(names, kind='mergesort')
+        self.names = names[self.order]
+
+    def ranges(self, class_names):
+        """
+        返回各个类对应方法的行范围[lo, hi)（按排序后的行号）
+        """
+        class_names = numpy.asarray(class_names, dtype=object)
+        lo = numpy.searchsorted(self.names, class_names, side='left')
+        hi = numpy.searchsorted(self.names, class_names + self._MAX_CHAR, side='left')
+        return lo, hi
+
+    @staticmethod
+    def _range_sum(col, lo, hi):
+        # 前缀和相减；参与求和的都是整数或0.25的整数倍，与逐段求和的结果完全一致
+        prefix = numpy.concatenate(([0.0], numpy.cumsum(col, dtype=numpy.float64)))
+        return prefix[hi] - prefix[lo]
+
+    def aggregate(self, class_names, values):
+        """
+        对每个类的方法做分组求和、计数
+        :param class_names: 类名Series，结果与其索引对齐
+        :param values: {键: 与方法表行顺序一致的列}
+        :return: 数据框，n为方法数，{键}_sum为忽略NaN的和，{键}_count为非NaN的个数
+        """
+        lo, hi = self.ranges(class_names)
+        result = {'n': hi - lo}
+        for key, col in values.items():
+            col = numpy.asarray(col, dtype=numpy.float64)[self.order]
+            valid = ~numpy.isnan(col)
+            result[f'{key}_sum'] = self._range_sum(numpy.where(valid, col, 0), lo, hi)
+            result[f'{key}_count'] = self._range_sum(valid, lo, hi)
+        return pd.DataFrame(result, index=class_names.index)
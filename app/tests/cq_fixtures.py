@@ -0,0 +1,100 @@
+"""
+为指标计算测试构造小规模的SourceMeter扫描结果
+"""
+import os
+import shutil
+import tempfile
+
+import numpy
+import pandas as pd
+
+RULESETS = ['Best Practices', 'Documentation', 'Design', 'Code Style', 'Error Prone', 'Multithreading']
+
+
+def make_class_frame(name, n_classes=60, seed=0):
+    rng = numpy.random.RandomState(seed)
+    rows = []
+    for i in range(n_classes):
+        package = f'com.{name}.p{i % 5}'
+        # 故意构造互为前缀的类名（A1与A10）和内部类
+        class_name = f'A{i}' if i % 7 else f'A{i // 7}.Inner'
+        rows.append({
+            'ID': f'L{i}',
+            'Name': class_name.split('.')[-1],
+            'LongName': f'{package}.{class_name}',
+            'Path': f'/home/mql/OSSprojects/alibaba/{name}/src/main/java/com/{name}/p{i % 5}/A{i}.java',
+        })
+    df = pd.DataFrame(rows)
+    for col in ['WMC', 'DIT', 'LOC', 'NM', 'CBO', 'LLOC', 'LCOM5', 'NPM', 'NA', 'CLOC', 'NOC', 'RFC', 'NLM', 'NII',
+                'NOI', 'TLOC']:
+        df[col] = rng.randint(0, 40, n_classes)
+    # 不含成员的类
+    df.loc[df.index % 11 == 0, ['NM', 'NA']] = 0
+    df['CC'] = rng.choice([0, 0.03, 0.05, 0.1, 0.2, 0.35], n_classes)
+    df['CLLC'] = rng.choice([0, 0.03, 0.05, 0.1, 0.2, 0.35], n_classes)
+    # 重名的类：完全相同的行，以及另一个目录下同名、不含成员的类
+    other = df.iloc[[2]].copy()
+    other['Path'] = other['Path'].str.replace('/src/main/java/', '/src/test/java/')
+    other[['NM', 'NA']] = 0
+    other['CLOC'] += 3
+    df = pd.concat([df, df.iloc[[3, 11]], other], ignore_index=True)
+    return df
+
+
+def make_method_frame(class_frame, seed=0):
+    rng = numpy.random.RandomState(seed)
+    rows = []
+    for i, long_name in enumerate(class_frame['LongName'].drop_duplicates()):
+        # 一部分类没有方法
+        for j in range(i % 4):
+            rows.append({'LongName': f'{long_name}.m{j}(I)V', 'Name': f'm{j}'})
+    df = pd.DataFrame(rows)
+    n = len(df)
+    for col, high in [('NUMPAR', 10), ('NL', 8), ('LOC', 30), ('CLOC', 6), ('LLOC', 25)]:
+        df[col] = rng.randint(0, high, n)
+    df['McCC'] = rng.randint(1, 7, n)
+    return df.sample(frac=1, random_state=seed)
+
+
+def make_pmd_xml(class_frame, seed=0):
+    rng = numpy.random.RandomState(seed)
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<pmd version="6.0.0">']
+    for long_name in class_frame['LongName'].drop_duplicates():
+        package, class_name = long_name.rsplit('.', 1)
+        lines.append(f'<file name="{class_name}.java">')
+        for _ in range(rng.randint(0, 5)):
+            ruleset = RULESETS[rng.randint(len(RULESETS))]
+            priority = rng.randint(1, 6)
+            lines.append(f'<violation rule="R" ruleset="{ruleset}" package="{package}" class="{class_name}" '
+                         f'priority="{priority}">message</violation>')
+        lines.append('<violation rule="R" ruleset="Design" priority="3">no class</violation>')
+        lines.append('</file>')
+    # 在Class.csv中找不到的类
+    lines.append('<file name="Missing.java"><violation ruleset="Design" package="com.x" class="Missing" priority="2"/>'
+                 '</file>')
+    lines.append('</pmd>')
+    return '\n'.join(lines)
+
+
+def write_scan_results(directory, name, n_classes=60, seed=0):
+    """
+    在directory下写入{name}-Class.csv、{name}-Method.csv和sourcemeter/temp/{name}-PMD.xml
+    """
+    os.makedirs(f'{directory}/sourcemeter/temp', exist_ok=True)
+    class_frame = make_class_frame(name, n_classes, seed)
+    class_frame.to_csv(f'{directory}/{name}-Class.csv', index=False)
+    make_method_frame(class_frame, seed).to_csv(f'{directory}/{name}-Method.csv', index=False)
+    with open(f'{directory}/sourcemeter/temp/{name}-PMD.xml', 'w') as f:
+        f.write(make_pmd_xml(class_frame, seed))
+
+
+class ScanResultsMixin:
+    """
+    测试用例的setUp在临时目录self.directory下写入cooma的扫描结果，tearDown时删除
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        write_scan_results(self.directory, 'cooma')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
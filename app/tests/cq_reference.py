@@ -0,0 +1,241 @@
+"""
+指标计算的参考实现：向量化之前cq_calc中逐个取值、逐个类计算的写法，只用于测试新的实现与原先的结果一致
+"""
+import numpy
+import pandas as pd
+
+
+# ISO25010代码异味的分段打分函数，与ISO25010中的打分表一一对应
+def get_duplicate_code(single_class):
+    if single_class <= 0.03:
+        dc = 2
+    elif single_class <= 0.05:
+        dc = 1
+    elif single_class <= 0.1:
+        dc = 0
+    elif single_class <= 0.2:
+        dc = -1
+    else:
+        dc = -2
+    return dc
+
+
+def get_long_parameter(single_method):
+    if single_method <= 1:
+        lp = 2
+    elif single_method <= 3:
+        lp = 1
+    elif single_method <= 5:
+        lp = 0
+    elif single_method <= 7:
+        lp = -1
+    else:
+        lp = -2
+    return lp
+
+
+def get_nbd(single_class):
+    if single_class <= 1:
+        nbd = 2
+    elif single_class <= 2:
+        nbd = 1
+    elif single_class <= 4:
+        nbd = 0
+    elif single_class <= 6:
+        nbd = -1
+    else:
+        nbd = -2
+    return nbd
+
+
+def get_mloc(single_method):
+    if single_method <= 7:
+        mloc = 2
+    elif single_method <= 10:
+        mloc = 1
+    elif single_method <= 13:
+        mloc = 0
+    elif single_method <= 20:
+        mloc = -1
+    else:
+        mloc = -2
+    return mloc
+
+
+def get_mccc(single_method):
+    if single_method <= 1.1:
+        mccc = 2
+    elif single_method <= 2.0:
+        mccc = 1
+    elif single_method <= 3.1:
+        mccc = 0
+    elif single_method <= 4.7:
+        mccc = -1
+    else:
+        mccc = -2
+    return mccc
+
+
+def get_nom(single_class):
+    if single_class >= 1:
+        nom = 2
+    else:
+        nom = -2
+    return nom
+
+
+def get_large_class_nom(single_class):
+    if single_class <= 4:
+        nom = 2
+    elif single_class <= 7:
+        nom = 1
+    elif single_class <= 10:
+        nom = 0
+    elif single_class <= 15:
+        nom = -1
+    else:
+        nom = -2
+    return nom
+
+
+def get_large_class_wmc(single_class):
+    if single_class <= 5:
+        wmc = 2
+    elif single_class <= 14:
+        wmc = 1
+    elif single_class <= 31:
+        wmc = 0
+    elif single_class <= 47:
+        wmc = -1
+    else:
+        wmc = -2
+    return wmc
+
+
+def get_large_class_cloc(single_class):
+    if single_class <= 28:
+        cloc = 2
+    elif single_class <= 70:
+        cloc = 1
+    elif single_class <= 130:
+        cloc = 0
+    elif single_class <= 195:
+        cloc = -1
+    else:
+        cloc = -2
+    return cloc
+
+
+def get_large_class_cbo(single_class):
+    if single_class <= 1:
+        cbo = 2
+    elif single_class <= 3:
+        cbo = 1
+    elif single_class <= 5:
+        cbo = 0
+    elif single_class <= 7:
+        cbo = -1
+    else:
+        cbo = -2
+    return cbo
+
+
+# lazy class逐行计算的两部分，single_class为Class.csv中的一行
+def get_lazy_class_part1(single_class, loc_mean):
+    # 考虑除数为0
+    if single_class['NM'] == 0:
+        p1 = -2
+    elif (single_class['LOC'] >= loc_mean) and (single_class['WMC'] / single_class['NM'] > 2):
+        p1 = 2
+    elif (single_class['LOC'] < loc_mean) and (single_class['WMC'] / single_class['NM'] <= 2):
+        p1 = -2
+    else:
+        p1 = 0
+    return p1
+
+
+def get_lazy_class_part2(single_class, cbo_mean):
+    if (single_class['CBO'] >= cbo_mean) and (single_class['DIT'] <= 1):
+        p2 = 2
+    elif (single_class['CBO'] < cbo_mean) and (single_class['DIT'] > 1):
+        p2 = -2
+    else:
+        p2 = 0
+    return p2
+
+
+# 逐类筛选方法再计算的类级度量
+def find_method(method_file, class_name):
+    """
+    返回类名为class_name的method数据框
+    """
+    return method_file[method_file['LongName'].str.startswith(class_name)]
+
+
+def get_long_parameter_class(method_file, single_class):
+    df = find_method(method_file, single_class)
+    if len(df) == 0:
+        return 0
+    return df['NUMPAR'].map(get_long_parameter).mean()
+
+
+def get_long_method_class(method_file, single_class):
+    df = find_method(method_file, single_class)
+    if len(df) == 0:
+        return 0
+    long_parameter = df['NUMPAR'].map(get_long_parameter)
+    part1 = df['NL'].map(get_nbd)
+    part2 = df['LOC'].map(get_mloc)
+    part3 = df['McCC'].map(get_mccc)
+    sum_vec = (long_parameter + part1 + part2 + part3) / 4
+    return sum_vec.mean()
+
+
+def get_cloc_loc(method_file, class_name):
+    df = find_method(method_file, class_name)
+    # 如果类中没有方法，则无方法粒度的平均值，无法计算的情况下直接返回0，以下同理
+    if len(df) == 0:
+        return 0
+    comment_lines_per_method = df['CLOC'].mean()
+    loc_per_method = df['LOC'].mean()
+    return comment_lines_per_method / loc_per_method
+
+
+def get_ncm_nm(method_file, class_name):
+    df = find_method(method_file, class_name)
+    if len(df) == 0:
+        return 0
+    num_of_commented_methods = sum(df['CLOC'] > 0)
+    return num_of_commented_methods / len(df)
+
+
+def get_comments_in_definition_na_nm(class_file, method_file, class_name):
+    df = find_method(method_file, class_name)
+    if len(df) == 0:
+        return 0
+    num_of_method_comments = df['CLOC'].sum()
+    num_of_class_comments = class_file['CLOC'][class_name]
+    if type(num_of_class_comments) == pd.core.series.Series:
+        num_of_class_comments = num_of_class_comments.mean()
+    # 类定义的comments = 所有的comments - 方法的comments
+    num_of_def_comments = num_of_class_comments - num_of_method_comments
+    na = class_file['NA'][class_name]
+    nm = class_file['NM'][class_name]
+    nam = na + nm
+
+    if type(nam) == pd.core.series.Series:
+        nam = nam.mean()
+
+    # 原先为type(nam) == numpy.int64，整数列压缩为int32后仍按整数判断
+    if isinstance(nam, numpy.integer) and (nam == 0):
+        return 0
+
+    return num_of_def_comments / nam
+
+
+def get_loc_m(method_file, class_name):
+    df = find_method(method_file, class_name)
+    if len(df) == 0:
+        return 0
+    loc_per_method = df['LOC'].mean()
+    return loc_per_method
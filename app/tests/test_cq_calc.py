@@ -0,0 +1,386 @@
+"""
+代码质量指标计算库测试用例
+"""
+import os
+import shutil
+import sys
+import unittest
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from unittest import mock
+
+import numpy
+import pandas as pd
+
+import cq_reference
+from cq_fixtures import ScanResultsMixin, write_scan_results
+
+sys.path.append('.')
+from app.cq_calc import ISO25010, RU2000, Complexity, Inheritance, Readability, CALCULATORS, INDICATOR_NAMES, \
+    cq_calculator, evaluate_indicators, indicator_columns, required_columns
+from app.hierarchy import Hierarchy
+from app.scan_cache import ScanCache
+from app.scan_result import MethodIndex, ScanResult, read_pmd_violations
+
+GOLDEN_FILE = os.path.join(os.path.dirname(__file__), 'cq_golden.csv')
+
+
+class GoldenTestCase(ScanResultsMixin, unittest.TestCase):
+    def test_golden(self):
+        # cq_golden.csv为向量化之前的cq_calculator在同一份扫描结果上的输出
+        expected = pd.read_csv(GOLDEN_FILE, index_col=0)
+        pd.testing.assert_frame_equal(expected, cq_calculator(self.directory, 'cooma'), check_dtype=False)
+
+
+class WorktreePathTestCase(ScanResultsMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        # 在worktree中扫描时SourceMeter记录的类路径
+        class_path = f'{self.directory}/cooma-Class.csv'
+        class_file = pd.read_csv(class_path)
+        class_file['Path'] = class_file['Path'].str.replace('/home/mql/OSSprojects/alibaba/cooma/',
+                                                            '/srv/cqc/OSSworktrees/alibaba/cooma/v0.4.0/')
+        class_file.to_csv(class_path, index=False)
+
+    def test_source_dir(self):
+        expected = pd.read_csv(GOLDEN_FILE, index_col=0)
+        df = cq_calculator(self.directory, 'cooma', source_dir='OSSworktrees/alibaba/cooma/v0.4.0')
+        pd.testing.assert_frame_equal(expected, df, check_dtype=False)
+        hierarchy = Hierarchy.from_frame(df, 'cooma', 'alibaba/cooma(v0.4.0)')
+        self.assertEqual(['src'], [child['name'] for child in hierarchy.to_legacy(full_names=False)['children']])
+        # 绝对路径同样可以
+        df = cq_calculator(self.directory, 'cooma', source_dir='/srv/cqc/OSSworktrees/alibaba/cooma/v0.4.0/')
+        pd.testing.assert_frame_equal(expected, df, check_dtype=False)
+
+    def test_without_source_dir(self):
+        # 不给出源码目录时，从第一次出现项目名处截取，多出版本一层
+        df = cq_calculator(self.directory, 'cooma')
+        self.assertTrue(df.index[0].startswith('cooma/v0.4.0/src/'))
+
+
+class StepScoreTestCase(unittest.TestCase):
+    # 打分表与原有的分段函数一一对应
+    pairs = [
+        (ISO25010.DUPLICATE_CODE, cq_reference.get_duplicate_code),
+        (ISO25010.LONG_PARAMETER, cq_reference.get_long_parameter),
+        (ISO25010.NBD, cq_reference.get_nbd),
+        (ISO25010.MLOC, cq_reference.get_mloc),
+        (ISO25010.MCCC, cq_reference.get_mccc),
+        (ISO25010.NOM, cq_reference.get_nom),
+        (ISO25010.LARGE_CLASS_NOM, cq_reference.get_large_class_nom),
+        (ISO25010.LARGE_CLASS_WMC, cq_reference.get_large_class_wmc),
+        (ISO25010.LARGE_CLASS_CLOC, cq_reference.get_large_class_cloc),
+        (ISO25010.LARGE_CLASS_CBO, cq_reference.get_large_class_cbo),
+    ]
+
+    @staticmethod
+    def probe_values(scorer):
+        # 阈值本身、阈值两侧最近的浮点数，以及若干随机值和特殊值
+        bounds = scorer.bounds
+        values = [numpy.nan, numpy.inf, -numpy.inf, -1.0, 0.0, 1e9]
+        values += list(bounds) + list(numpy.nextafter(bounds, numpy.inf)) + list(numpy.nextafter(bounds, -numpy.inf))
+        values += list(numpy.random.RandomState(0).uniform(-1, bounds[-1] * 2 + 1, 1000))
+        return values
+
+    def assert_same(self, scorer, step_func, col):
+        expected = col.map(step_func)
+        actual = scorer(col)
+        self.assertEqual(expected.tolist(), actual.tolist())
+        self.assertTrue(actual.index.equals(col.index))
+        self.assertEqual(actual.dtype, numpy.int64)
+
+    def test_float_columns(self):
+        for scorer, step_func in self.pairs:
+            col = pd.Series(self.probe_values(scorer), dtype=numpy.float64)
+            self.assert_same(scorer, step_func, col)
+
+    def test_int_columns(self):
+        for scorer, step_func in self.pairs:
+            col = pd.Series(numpy.arange(-3, 300), index=[f'c{i}' for i in range(303)])
+            self.assert_same(scorer, step_func, col)
+
+    def test_empty_column(self):
+        for scorer, step_func in self.pairs:
+            self.assertEqual(len(scorer(pd.Series([], dtype=numpy.float64))), 0)
+
+
+class MethodIndexTestCase(ScanResultsMixin, unittest.TestCase):
+    def test_ranges_match_startswith(self):
+        calculator = ISO25010(self.directory, 'cooma')
+        index = MethodIndex(calculator.method_file)
+        lo, hi = index.ranges(calculator.class_file['LongName'])
+        for class_name, start, stop in zip(calculator.class_file['LongName'], lo, hi):
+            expected = sorted(cq_reference.find_method(calculator.method_file, class_name)['LongName'])
+            self.assertEqual(expected, list(index.names[start:stop]))
+
+    def test_iso25010_aggregates(self):
+        # 分组聚合的结果与逐类扫描的结果完全一致
+        calculator = ISO25010(self.directory, 'cooma')
+        class_names = calculator.class_file['LongName']
+        method_file = calculator.method_file
+        pd.testing.assert_series_equal(class_names.map(partial(cq_reference.get_long_parameter_class, method_file)),
+                                       calculator.long_parameter, check_names=False, check_exact=True)
+        pd.testing.assert_series_equal(class_names.map(partial(cq_reference.get_long_method_class, method_file)),
+                                       calculator.long_method, check_names=False, check_exact=True)
+
+    def assert_ru2000_aggregates(self):
+        calculator = RU2000(self.directory, 'cooma')
+        class_names = calculator.class_file['LongName']
+        # 逐类计算时除数为0得到inf或NaN
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            class_file, method_file = calculator.class_file, calculator.method_file
+            expected = [class_names.map(partial(cq_reference.get_cloc_loc, method_file)),
+                        class_names.map(partial(cq_reference.get_ncm_nm, method_file)),
+                        class_names.map(partial(cq_reference.get_comments_in_definition_na_nm, class_file,
+                                                method_file)),
+                        class_names.map(partial(cq_reference.get_loc_m, method_file))]
+        for expected_col, actual_col in zip(expected, calculator.get_method_metrics()):
+            pd.testing.assert_series_equal(expected_col, actual_col, check_dtype=False, check_names=False,
+                                           check_exact=True)
+
+    def test_ru2000_aggregates(self):
+        self.assert_ru2000_aggregates()
+
+    def test_ru2000_float_members(self):
+        # NA列中有缺失值时为浮点列，na + nm为0的类照常相除
+        path = f'{self.directory}/cooma-Class.csv'
+        class_frame = pd.read_csv(path)
+        class_frame.loc[5, 'NA'] = numpy.nan
+        class_frame.to_csv(path, index=False)
+        self.assert_ru2000_aggregates()
+
+
+class ScanResultTestCase(ScanResultsMixin, unittest.TestCase):
+    def test_parse_once(self):
+        with mock.patch('app.scan_result.pd.read_csv', wraps=pd.read_csv) as read_csv:
+            cq_calculator(self.directory, 'cooma')
+        self.assertEqual(2, read_csv.call_count)
+
+    def test_backward_compatible(self):
+        scan = ScanResult(self.directory, 'cooma')
+        pd.testing.assert_series_equal(Complexity(self.directory, 'cooma').index, Complexity(scan).index)
+        self.assertIs(ISO25010(scan).class_file, Complexity(scan).class_file)
+
+    def test_pruned_columns(self):
+        scan = ScanResult(self.directory, 'cooma', **required_columns(CALCULATORS))
+        self.assertNotIn('RFC', scan.class_file.columns)
+        self.assertEqual({'LongName', 'NUMPAR', 'NL', 'LOC', 'McCC', 'CLOC'}, set(scan.method_file.columns))
+        self.assertEqual(numpy.int32, scan.class_file['WMC'].dtype)
+        self.assertEqual(numpy.float64, scan.class_file['CC'].dtype)
+        self.assertEqual('category', scan.class_file['Path'].dtype.name)
+
+
+class ScanCacheTestCase(ScanResultsMixin, unittest.TestCase):
+    def test_reuse_cache(self):
+        expected = cq_calculator(self.directory, 'cooma')
+        with mock.patch('app.scan_result.pd.read_csv') as read_csv, \
+                mock.patch('app.scan_result.read_pmd_violations') as read_pmd:
+            actual = cq_calculator(self.directory, 'cooma')
+        read_csv.assert_not_called()
+        read_pmd.assert_not_called()
+        pd.testing.assert_frame_equal(expected, actual, check_exact=True)
+
+    def test_same_frames(self):
+        parsed = ScanResult(self.directory, 'cooma', cache=False)
+        ScanResult(self.directory, 'cooma').class_file
+        cached = ScanResult(self.directory, 'cooma')
+        pd.testing.assert_frame_equal(parsed.class_file, cached.class_file, check_exact=True)
+        pd.testing.assert_frame_equal(parsed.pmd_violations, ScanResult(self.directory, 'cooma').pmd_violations,
+                                      check_exact=True)
+
+    def test_invalidate(self):
+        ScanResult(self.directory, 'cooma').class_file
+        write_scan_results(self.directory, 'cooma', n_classes=30, seed=1)
+        self.assertEqual(33, len(ScanResult(self.directory, 'cooma').class_file))
+
+    def test_more_columns(self):
+        ScanResult(self.directory, 'cooma', class_columns=['WMC']).class_file
+        class_file = ScanResult(self.directory, 'cooma', class_columns=['WMC', 'DIT']).class_file
+        self.assertEqual({'LongName', 'WMC', 'DIT'}, set(class_file.columns))
+        with mock.patch('app.scan_result.pd.read_csv') as read_csv:
+            class_file = ScanResult(self.directory, 'cooma', class_columns=['DIT']).class_file
+        read_csv.assert_not_called()
+        self.assertEqual({'LongName', 'DIT'}, set(class_file.columns))
+
+    def test_memory_mapped(self):
+        ScanResult(self.directory, 'cooma').class_file
+        values = ScanResult(self.directory, 'cooma').class_file['WMC'].to_numpy()
+        bases = []
+        while values is not None:
+            bases.append(values)
+            values = getattr(values, 'base', None)
+        self.assertTrue(any(isinstance(base, numpy.memmap) for base in bases))
+
+    def test_replace_generation(self):
+        scan = ScanResult(self.directory, 'cooma')
+        scan.class_file
+        cache = ScanCache(f'{self.directory}/cooma-cache')
+        old = cache._generation('Class')
+        cache.save('Class', scan.class_path, None, scan.class_file)
+        new = cache._generation('Class')
+        self.assertNotEqual(old, new)
+        self.assertFalse(os.path.exists(old))
+        # 读到旧的generation后它被删除，重新读取current
+        with mock.patch.object(ScanCache, '_generation', side_effect=[old, new]), \
+                mock.patch('app.scan_result.pd.read_csv') as read_csv:
+            class_file = ScanResult(self.directory, 'cooma').class_file
+        read_csv.assert_not_called()
+        pd.testing.assert_frame_equal(scan.class_file, class_file, check_exact=True)
+
+
+class ConcurrentTestCase(ScanResultsMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.expected = cq_calculator(self.directory, 'cooma')
+
+    def test_thread_pool(self):
+        pd.testing.assert_frame_equal(self.expected, cq_calculator(self.directory, 'cooma', executor='thread'),
+                                      check_exact=True)
+
+    def test_process_pool(self):
+        pd.testing.assert_frame_equal(self.expected, cq_calculator(self.directory, 'cooma', executor='process'),
+                                      check_exact=True)
+
+    def test_shared_scan(self):
+        # 线程池中各计算类共用一份解析结果，每个文件只解析一次
+        with mock.patch('app.scan_result.pd.read_csv', wraps=pd.read_csv) as read_csv:
+            scan = ScanResult(self.directory, 'cooma', cache=False, **required_columns(CALCULATORS))
+            with ThreadPoolExecutor(5) as pool:
+                evaluate_indicators(scan, INDICATOR_NAMES, executor=pool)
+        self.assertEqual(2, read_csv.call_count)
+
+    def test_unknown_executor(self):
+        with self.assertRaises(ValueError):
+            cq_calculator(self.directory, 'cooma', executor='gpu')
+
+
+class IndicatorRegistryTestCase(ScanResultsMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.expected = cq_calculator(self.directory, 'cooma', executor=None)
+        shutil.rmtree(f'{self.directory}/cooma-cache')
+
+    def test_subset(self):
+        for names in [['complexity'], ['readability'], ['testability', 'inheritance'], ['reusability']]:
+            pd.testing.assert_frame_equal(self.expected[names],
+                                          cq_calculator(self.directory, 'cooma', indicators=names), check_exact=True)
+
+    def test_skip_pmd(self):
+        with mock.patch('app.scan_result.read_pmd_violations') as read_pmd:
+            cq_calculator(self.directory, 'cooma', indicators=['maintainability', 'reusability', 'complexity'])
+        read_pmd.assert_not_called()
+
+    def test_skip_methods(self):
+        with mock.patch('app.scan_result.pd.read_csv', wraps=pd.read_csv) as read_csv:
+            cq_calculator(self.directory, 'cooma', indicators=['complexity', 'inheritance'])
+        self.assertEqual([f'{self.directory}/cooma-Class.csv'], [call[0][0] for call in read_csv.call_args_list])
+        self.assertEqual(['DIT', 'LongName', 'Name', 'Path', 'WMC'], read_csv.call_args[1]['usecols'])
+
+    def test_intermediate_results(self):
+        # testability用不到lazy class
+        scan = ScanResult(self.directory, 'cooma', **indicator_columns(['testability']))
+        with mock.patch.object(ISO25010, 'get_lazy_class', side_effect=AssertionError) as get_lazy_class:
+            testability = evaluate_indicators(scan, ['testability'])['testability']
+        get_lazy_class.assert_not_called()
+        pd.testing.assert_series_equal(self.expected['testability'], testability.set_axis(self.expected.index),
+                                       check_exact=True)
+        self.assertNotIn('DIT', scan.class_file.columns)
+
+
+class StreamMethodsTestCase(ScanResultsMixin, unittest.TestCase):
+    def test_same_as_in_memory(self):
+        in_memory = ScanResult(self.directory, 'cooma', stream_methods=False)
+        streaming = ScanResult(self.directory, 'cooma', stream_methods=True, chunksize=7)
+        expected, actual = ISO25010(in_memory), ISO25010(streaming)
+        self.assertIsNone(actual.method_file)
+        for attr in ['long_parameter', 'long_method', 'maintainability']:
+            pd.testing.assert_series_equal(getattr(expected, attr), getattr(actual, attr), check_exact=True)
+        for expected_col, actual_col in zip(RU2000(in_memory).get_method_metrics(),
+                                            RU2000(streaming).get_method_metrics()):
+            pd.testing.assert_series_equal(expected_col, actual_col, check_exact=True)
+
+    def test_auto_switch(self):
+        self.assertFalse(ScanResult(self.directory, 'cooma').stream_methods)
+        expected = cq_calculator(self.directory, 'cooma')
+        with mock.patch('app.scan_result.STREAM_METHODS_BYTES', 0):
+            self.assertTrue(ScanResult(self.directory, 'cooma').stream_methods)
+            pd.testing.assert_frame_equal(expected, cq_calculator(self.directory, 'cooma'), check_exact=True)
+
+    def test_without_method_file(self):
+        # 只用到Class.csv、PMD报告的计算类不读取Method.csv
+        names = ['complexity', 'readability', 'inheritance']
+        expected = cq_calculator(self.directory, 'cooma', indicators=names)
+        os.remove(f'{self.directory}/cooma-Method.csv')
+        Complexity(self.directory, 'cooma')
+        Inheritance(self.directory, 'cooma')
+        Readability(self.directory, 'cooma')
+        pd.testing.assert_frame_equal(expected, cq_calculator(self.directory, 'cooma', indicators=names),
+                                      check_exact=True)
+
+
+class LazyClassTestCase(unittest.TestCase):
+    @staticmethod
+    def make_calculator(class_file):
+        # 只设置lazy class用到的属性
+        calculator = ISO25010.__new__(ISO25010)
+        calculator.class_file = class_file
+        calculator.nom, calculator.loc, calculator.wmc = class_file['NM'], class_file['LOC'], class_file['WMC']
+        calculator.cbo, calculator.dit = class_file['CBO'], class_file['DIT']
+        calculator.loc_mean, calculator.cbo_mean = class_file['LOC'].mean(), class_file['CBO'].mean()
+        return calculator
+
+    def assert_same(self, class_file):
+        calculator = self.make_calculator(class_file)
+        pd.testing.assert_series_equal(class_file.apply(cq_reference.get_lazy_class_part1, axis=1,
+                                                        loc_mean=calculator.loc_mean),
+                                       calculator.get_lazy_class_part1(), check_dtype=False)
+        pd.testing.assert_series_equal(class_file.apply(cq_reference.get_lazy_class_part2, axis=1,
+                                                        cbo_mean=calculator.cbo_mean),
+                                       calculator.get_lazy_class_part2(), check_dtype=False)
+
+    def test_random_classes(self):
+        rng = numpy.random.RandomState(0)
+        columns = ['NM', 'LOC', 'WMC', 'CBO', 'DIT']
+        class_file = pd.DataFrame(rng.randint(0, 6, (2000, len(columns))), columns=columns,
+                                  index=[f'c{i}' for i in range(2000)])
+        self.assert_same(class_file)
+
+    def test_zero_and_nan(self):
+        nan = numpy.nan
+        class_file = pd.DataFrame({'NM': [0, 0, 1, nan, 2, 4],
+                                   'LOC': [10, nan, 3, 5, 20, 1],
+                                   'WMC': [0, 3, nan, 2, 5, 8],
+                                   'CBO': [1, nan, 0, 3, 2, 9],
+                                   'DIT': [0, 2, nan, 1, 3, 1]})
+        self.assert_same(class_file)
+
+
+class ReadabilityTestCase(ScanResultsMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.pmd_file = f'{self.directory}/sourcemeter/temp/cooma-PMD.xml'
+
+    def test_read_violations(self):
+        root = ET.parse(self.pmd_file).getroot()
+        expected = [(item.attrib['package'] + '.' + item.attrib['class'], item.attrib['ruleset'],
+                     int(item.attrib['priority']))
+                    for file in root for item in file if 'class' in item.attrib and 'package' in item.attrib]
+        violations = read_pmd_violations(self.pmd_file)
+        self.assertEqual(expected, list(zip(violations['class'], violations['ruleset'], violations['priority'])))
+
+    def test_viol_per_loc(self):
+        calculator = Readability(self.directory, 'cooma')
+        class_d = {}
+        for class_name, ruleset, priority in read_pmd_violations(self.pmd_file).itertuples(index=False):
+            if ruleset in calculator.violations:
+                class_d[class_name] = class_d.get(class_name, 0) + priority
+        lloc = calculator.class_file['LLOC']
+        with numpy.errstate(divide='ignore'):
+            expected = {k: v / lloc[[k]].mean() for k, v in class_d.items() if k in lloc.index}
+        self.assertNotIn('com.x.Missing', calculator.readability.index)
+        self.assertEqual(expected, calculator.readability.to_dict())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+"""
+指标树构造测试用例
+"""
+import math
+import random
+import sys
+import unittest
+
+import numpy
+import pandas as pd
+
+sys.path.append('.')
+from app.cq_calc import INDICATOR_NAMES
+from app.hierarchy import Hierarchy, root_values
+
+
+# 原有的实现，作为对照
+def generate_whole_set(index):
+    whole_set = set()
+    for path in index:
+        frags = path.split('/')
+        for i in range(len(frags), 0, -1):
+            p_path = '/'.join(frags[:i])
+            if p_path not in whole_set:
+                whole_set.add(p_path)
+            else:
+                break
+    return whole_set
+
+
+def convert(target, proj_path, whole_set, fine_grained_dict):
+    totals = dict.fromkeys(INDICATOR_NAMES, 0)
+    for path in filter(lambda s: '/'.join(s.split('/')[:-1]) == proj_path, whole_set):
+        child = {'name': path, 'children': []}
+        target['children'].append(child)
+        if path in fine_grained_dict:
+            values = {indicator: fine_grained_dict[path][indicator] for indicator in INDICATOR_NAMES}
+            child.update(values)
+        else:
+            values = convert(child, path, whole_set, fine_grained_dict)
+        for indicator in INDICATOR_NAMES:
+            totals[indicator] += values[indicator]
+    target.update(totals)
+    return totals
+
+
+def make_classes(n_classes, seed=0):
+    rng = random.Random(seed)
+    fine_grained_dict = {}
+    for i in range(n_classes):
+        packages = '/'.join(f'p{rng.randint(0, 3)}' for _ in range(rng.randint(0, 5)))
+        path = f'cooma/src/main/java/{packages}/A{i % 40}.java/A{i}'.replace('//', '/')
+        fine_grained_dict[path] = {indicator: rng.choice([rng.random(), rng.randint(0, 9), 1])
+                                   for indicator in INDICATOR_NAMES}
+    return fine_grained_dict
+
+
+def to_frame(fine_grained_dict):
+    return pd.DataFrame.from_dict(fine_grained_dict, orient='index', columns=list(INDICATOR_NAMES))
+
+
+class HierarchyTestCase(unittest.TestCase):
+    def assert_same_tree(self, expected, actual):
+        # 原有实现中子节点的顺序取决于集合的遍历顺序，比较时按名称排序；指标以float32存储，只比较到其精度
+        stack = [(expected, actual)]
+        while stack:
+            expected, actual = stack.pop()
+            self.assertEqual(list(expected), list(actual))
+            self.assertEqual(expected['name'], actual['name'])
+            for indicator in INDICATOR_NAMES:
+                self.assertTrue(math.isclose(expected[indicator], actual[indicator], rel_tol=1e-6, abs_tol=1e-6),
+                                (expected['name'], indicator))
+            expected_children = sorted(expected['children'], key=lambda node: node['name'])
+            actual_children = sorted(actual['children'], key=lambda node: node['name'])
+            self.assertEqual([node['name'] for node in expected_children], [node['name'] for node in actual_children])
+            stack.extend(zip(expected_children, actual_children))
+
+    def build_both(self, fine_grained_dict):
+        expected = {'name': 'alibaba/cooma(v1)', 'children': []}
+        convert(expected, 'cooma', generate_whole_set(fine_grained_dict), fine_grained_dict)
+        hierarchy = Hierarchy.from_frame(to_frame(fine_grained_dict), 'cooma', 'alibaba/cooma(v1)')
+        return expected, hierarchy.to_legacy()
+
+    def test_same_as_convert(self):
+        self.assert_same_tree(*self.build_both(make_classes(500)))
+
+    def test_paths_outside_project(self):
+        fine_grained_dict = make_classes(50)
+        fine_grained_dict['other/src/A.java/A'] = dict.fromkeys(INDICATOR_NAMES, 1)
+        fine_grained_dict['cooma'] = dict.fromkeys(INDICATOR_NAMES, 1)
+        fine_grained_dict['cooma/src//B.java/B'] = dict.fromkeys(INDICATOR_NAMES, 1)
+        self.assert_same_tree(*self.build_both(fine_grained_dict))
+
+    def test_arrays(self):
+        fine_grained_dict = {'cooma/a/A.java/A': dict(zip(INDICATOR_NAMES, [1, 2, 3, 4, 5, 6])),
+                             'cooma/a/B.java/B': dict(zip(INDICATOR_NAMES, [0.5, 0, 0, 0, 0, 1])),
+                             'cooma/C.java/C': dict(zip(INDICATOR_NAMES, [1, 1, 1, 1, 1, 1]))}
+        hierarchy = Hierarchy.from_frame(to_frame(fine_grained_dict), 'cooma', 'alibaba/cooma(v1)')
+        # 根、a、A.java、A、B.java、B、C.java、C
+        self.assertEqual([-1, 0, 1, 2, 1, 4, 0, 6], hierarchy.parent.tolist())
+        self.assertEqual(['a', 'A.java', 'A', 'B.java', 'B', 'C.java', 'C'],
+                         [hierarchy.segments[i] for i in hierarchy.segment[1:]])
+        self.assertEqual([False, False, False, True, False, True, False, True], hierarchy.leaf.tolist())
+        self.assertEqual(numpy.float32, hierarchy.values.dtype)
+        self.assertEqual({'maintainability': 2.5, 'testability': 3, 'readability': 4, 'reusability': 5,
+                          'inheritance': 6, 'complexity': 8}, hierarchy.root_values())
+        self.assertEqual(['alibaba/cooma(v1)', 'cooma/a', 'cooma/a/A.java', 'cooma/a/A.java/A'],
+                         hierarchy.full_names()[:4])
+        legacy = hierarchy.to_legacy()
+        self.assertEqual(['name', 'children', *INDICATOR_NAMES], list(legacy))
+        leaf = legacy['children'][0]['children'][0]['children'][0]
+        self.assertEqual({'name': 'cooma/a/A.java/A', 'children': [], **fine_grained_dict['cooma/a/A.java/A']},
+                         leaf)
+
+    def test_deep_hierarchy(self):
+        # 深度远超递归上限
+        depth = sys.getrecursionlimit() * 3
+        path = 'cooma/' + '/'.join(f'p{i}' for i in range(depth)) + '/A.java/A'
+        hierarchy = Hierarchy.from_frame(to_frame({path: dict.fromkeys(INDICATOR_NAMES, 1.5)}), 'cooma', 'root')
+        self.assertEqual(depth + 3, len(hierarchy))
+        self.assertTrue((hierarchy.values == 1.5).all())
+        # 各层共用名称片段表
+        self.assertEqual(depth + 2, len(hierarchy.segments))
+        node, levels = hierarchy.to_legacy(), 0
+        while node['children']:
+            node, levels = node['children'][0], levels + 1
+        self.assertEqual(depth + 2, levels)
+        self.assertEqual(path, node['name'])
+
+    def test_duplicated_class_paths(self):
+        df = to_frame({'cooma/A.java/A': dict.fromkeys(INDICATOR_NAMES, 1)})
+        df = pd.concat([df, df * 3])
+        hierarchy = Hierarchy.from_frame(df, 'cooma', 'root')
+        self.assertEqual(3, len(hierarchy))
+        self.assertEqual(1, hierarchy.root_values()['complexity'])
+
+
+class LegacyTestCase(unittest.TestCase):
+    def setUp(self):
+        fine_grained_dict = make_classes(300)
+        fine_grained_dict['cooma/src//B.java/B'] = dict.fromkeys(INDICATOR_NAMES, 1)
+        self.hierarchy = Hierarchy.from_frame(to_frame(fine_grained_dict), 'cooma', 'alibaba/cooma(v1)')
+
+    def test_relative_names(self):
+        legacy = self.hierarchy.to_legacy(full_names=False)
+        self.assertEqual('alibaba/cooma(v1)', legacy['name'])
+        self.assertEqual('src', legacy['children'][0]['name'])
+        self.assertEqual('main', legacy['children'][0]['children'][0]['name'])
+
+    def test_legacy_document(self):
+        # 之前嵌入在版本文档中的嵌套格式仍然可以读取
+        legacy = self.hierarchy.to_legacy()
+        hierarchy = Hierarchy.from_legacy(legacy)
+        self.assertEqual('cooma', hierarchy.base)
+        self.assertEqual(legacy, hierarchy.to_legacy())
+        self.assertEqual(self.hierarchy.to_legacy(full_names=False), hierarchy.to_legacy(full_names=False))
+
+    def test_root_values(self):
+        self.assertEqual(self.hierarchy.root_values(), root_values(self.hierarchy.to_legacy()))
+
+    def test_root_only(self):
+        hierarchy = Hierarchy.from_frame(to_frame({'other/A.java/A': dict.fromkeys(INDICATOR_NAMES, 1)}), 'cooma',
+                                         'root')
+        self.assertEqual(hierarchy.to_legacy(), Hierarchy.from_legacy(hierarchy.to_legacy()).to_legacy())
+
+    def test_slice(self):
+        tree = self.hierarchy.slice('', 1)
+        self.assertEqual('alibaba/cooma(v1)', tree['name'])
+        self.assertEqual(['src'], [child['name'] for child in tree['children']])
+        # 最底一层不展开，但可以用path继续请求
+        self.assertEqual([], tree['children'][0]['children'])
+        self.assertFalse(tree['children'][0]['leaf'])
+        self.assertEqual(round(self.hierarchy.root_values()['complexity'], 2), tree['complexity'])
+        tree = self.hierarchy.slice('src/main/java', 2)
+        self.assertEqual(('java', 'src/main/java'), (tree['name'], tree['path']))
+        files = [node for node in tree['children'] if node['name'].endswith('.java')]
+        self.assertEqual(f'src/main/java/{files[0]["name"]}', files[0]['path'])
+        classes = [node for node in files[0]['children'] if node['leaf']]
+        self.assertTrue(classes)
+        self.assertTrue(all(not node['children'] for node in classes))
+        self.assertIsNone(self.hierarchy.slice('src/none', 2))
+        self.assertEqual(self.hierarchy.slice('src//B.java', 0)['path'], 'src//B.java')
+
+
+if __name__ == '__main__':
+    unittest.main()
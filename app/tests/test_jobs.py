@@ -0,0 +1,193 @@
+"""
+任务队列测试用例
+"""
+import datetime
+import os
+import sys
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from flask_pymongo import PyMongo
+from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
+
+sys.path.append('.')
+from app import jobs
+from app.jobs import JobQueue, run_job
+from app.main.views import app
+from app.models import User, Version
+
+
+class JobQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        mongodb_url = os.getenv('MONGODB_URL')
+        self.mongo_client = MongoClient(mongodb_url)
+        self.mongo_client.drop_database('test')
+        self.mongo = PyMongo(app, uri=f'{mongodb_url}/test')
+        self.queue = JobQueue(self.mongo)
+        self.queue.ensure_indexes()
+
+    def tearDown(self):
+        self.mongo_client.drop_database('test')
+        jobs.JOB_HANDLERS.pop('test', None)
+
+    def test_enqueue(self):
+        job_id = self.queue.enqueue('version', 'alibaba/cooma', 'v1', 'mql')
+        # 排队中的同一任务不重复入队
+        self.assertEqual(job_id, self.queue.enqueue('version', 'alibaba/cooma', 'v1', 'mql'))
+        self.assertNotEqual(job_id, self.queue.enqueue('version', 'alibaba/cooma', 'v2', 'mql'))
+        status = self.queue.get(str(job_id))
+        self.assertEqual(('queued', 'alibaba/cooma', 'v1'),
+                         (status['state'], status['project_name'], status['version_name']))
+        self.assertIsNone(self.queue.get('not an id'))
+        self.assertIsNone(self.queue.get('0' * 24))
+
+    def test_enqueue_once(self):
+        # 并发入队同一版本只有一个任务
+        with ThreadPoolExecutor(8) as pool:
+            job_ids = set(pool.map(lambda _: self.queue.enqueue('version', 'alibaba/cooma', 'v1'), range(32)))
+        self.assertEqual(1, len(job_ids))
+        job_id = job_ids.pop()
+        self.assertEqual(1, self.mongo.db.jobs.count_documents({}))
+        with self.assertRaises(DuplicateKeyError):
+            self.mongo.db.jobs.insert_one({'kind': 'version', 'project_name': 'alibaba/cooma', 'version_name': 'v1',
+                                           'active': True})
+        # 结束后可以再次入队
+        job = self.queue.claim('w1')
+        self.queue.finish(job['_id'], 'w1')
+        self.assertNotIn('active', self.mongo.db.jobs.find_one({'_id': job_id}))
+        self.assertNotEqual(job_id, self.queue.enqueue('version', 'alibaba/cooma', 'v1'))
+
+    def test_claim_in_order(self):
+        first = self.queue.enqueue('version', 'alibaba/cooma', 'v1')
+        second = self.queue.enqueue('version', 'alibaba/cooma', 'v2')
+        self.assertEqual(first, self.queue.claim('w1')['_id'])
+        self.assertEqual(second, self.queue.claim('w2')['_id'])
+        self.assertIsNone(self.queue.claim('w1'))
+        self.queue.finish(first, 'w1')
+        self.queue.finish(second, 'w2', error='boom')
+        self.assertEqual('done', self.queue.get(str(first))['state'])
+        self.assertEqual(('failed', 'boom'), tuple(self.queue.get(str(second))[key] for key in ('state', 'error')))
+        # 完成之后可以再次入队
+        self.assertNotEqual(first, self.queue.enqueue('version', 'alibaba/cooma', 'v1'))
+
+    def test_requeue_stale(self):
+        job_id = self.queue.enqueue('version', 'alibaba/cooma', 'v1')
+        self.queue.claim('lost')
+        past = datetime.datetime.utcnow() - datetime.timedelta(seconds=jobs.STALE_SECONDS + 1)
+        self.mongo.db.jobs.update_one({'_id': job_id}, {'$set': {'heartbeat': past}})
+        self.queue.requeue_stale()
+        self.assertEqual('queued', self.queue.get(str(job_id))['state'])
+        # 退出的工作进程不能再改变任务状态
+        self.assertEqual(2, self.queue.claim('w1')['attempts'])
+        self.queue.finish(job_id, 'lost')
+        self.assertEqual('running', self.queue.get(str(job_id))['state'])
+        # 达到重试次数后记为失败
+        self.mongo.db.jobs.update_one({'_id': job_id}, {'$set': {'heartbeat': past, 'attempts': jobs.MAX_ATTEMPTS}})
+        self.queue.requeue_stale()
+        self.assertEqual('failed', self.queue.get(str(job_id))['state'])
+
+    def test_run_job(self):
+        steps = []
+
+        def handler(mongo, queue, job, monitor):
+            queue.set_step(job['_id'], 'scan')
+            steps.append(job['version_name'])
+            if job['version_name'] == 'v2':
+                raise RuntimeError('scan failed')
+
+        jobs.JOB_HANDLERS['test'] = handler
+        for version_name in ('v1', 'v2'):
+            self.queue.enqueue('test', 'alibaba/cooma', version_name)
+            job = self.queue.claim('w1')
+            run_job(self.mongo, self.queue, job, 'w1')
+        self.assertEqual(['v1', 'v2'], steps)
+        states = {job['version_name']: job for job in self.mongo.db.jobs.find()}
+        self.assertEqual('done', states['v1']['state'])
+        self.assertIsNone(states['v1']['step'])
+        self.assertEqual('failed', states['v2']['state'])
+        self.assertIn('scan failed', states['v2']['error'])
+
+    def test_cancel(self):
+        queued = self.queue.enqueue('version', 'alibaba/cooma', 'v1')
+        running = self.queue.enqueue('version', 'alibaba/cooma', 'v2')
+        self.mongo.db.jobs.update_one({'_id': running}, {'$set': {'created': datetime.datetime(2000, 1, 1)}})
+        job = self.queue.claim('w1')
+        self.assertEqual('cancelled', self.queue.cancel(str(queued))['state'])
+        status = self.queue.cancel(str(running))
+        self.assertEqual(('running', True), (status['state'], status['cancel']))
+        self.assertIsNone(self.queue.cancel('not an id'))
+
+        # 工作进程发现取消请求后结束子进程，任务记为cancelled
+        def handler(mongo, queue, job, monitor):
+            queue.set_step(job['_id'], 'scan')
+            monitor.progress({'phase': 'Receiving objects', 'percent': 10, 'line': 'Receiving objects:  10%'})
+            self.assertEqual(10, queue.get(str(job['_id']))['progress']['percent'])
+            self.assertTrue(monitor.cancelled.wait(jobs.CANCEL_POLL_SECONDS * 3))
+            raise RuntimeError('killed')
+
+        jobs.JOB_HANDLERS['test'] = handler
+        job['kind'] = 'test'
+        run_job(self.mongo, self.queue, job, 'w1')
+        status = self.queue.get(str(running))
+        self.assertEqual(('cancelled', None), (status['state'], status['error']))
+
+    def test_job_events(self):
+        app.config.update(TESTING=True, mongo=self.mongo)
+        User(user_name='mql', passwd_hash='python', mongo=self.mongo).save()
+        headers = {'Token': User.get_user('mql', self.mongo).generate_auth_token().decode('utf-8')}
+        job_id = str(self.queue.enqueue('version', 'alibaba/cooma', 'v1'))
+        client = app.test_client()
+        data = client.get(f'/api/jobs/{job_id}/events', headers=headers).json['data']
+        self.assertEqual(('queued', 0), (data['state'], data['revision']))
+        # 没有新的状态时立即返回304
+        self.assertEqual(304, client.get(f'/api/jobs/{job_id}/events?since=0', headers=headers).status_code)
+        job = self.queue.claim('w1')
+        self.queue.set_step(job['_id'], 'scan')
+        data = client.get(f'/api/jobs/{job_id}/events?since=0', headers=headers).json['data']
+        self.assertEqual(('running', 'scan', 2), (data['state'], data['step'], data['revision']))
+        self.queue.finish(job['_id'], 'w1')
+        # 已结束的任务总是返回状态
+        data = client.get(f'/api/jobs/{job_id}/events?since=100', headers=headers).json['data']
+        self.assertEqual(('done', 3), (data['state'], data['revision']))
+        self.assertEqual(400, client.get(f'/api/jobs/{job_id}/events?since=x', headers=headers).status_code)
+        self.assertEqual(404, client.get('/api/jobs/not an id/events', headers=headers).status_code)
+        # 不接受查询参数中的token
+        token = headers['Token']
+        self.assertEqual(1001, client.get(f'/api/jobs/{job_id}/events?token={token}').json['code'])
+
+    def test_batch(self):
+        self.queue.enqueue('version', 'alibaba/cooma', 'v3')
+        batch_id = self.queue.enqueue_batch('version', 'alibaba/cooma', ['v2', 'v3', 'v4'], 'mql', skipped=['v1'])
+        # 已经排队的版本不重复入队，按给定的顺序领取
+        self.assertEqual(['v3', 'v2', 'v4'], [self.queue.claim(f'w{i}')['version_name'] for i in range(3)])
+        batch = self.queue.get_batch(str(batch_id))
+        self.assertEqual((3, 1, 'running', 0.0), (batch['total'], batch['skipped'], batch['state'], batch['progress']))
+        self.assertEqual(3, batch['counts']['running'])
+        for i, error in enumerate([None, 'Traceback\nRuntimeError: scan failed\n', None]):
+            self.queue.finish(self.mongo.db.jobs.find_one({'worker': f'w{i}'})['_id'], f'w{i}', error=error)
+        batch = self.queue.get_batch(str(batch_id))
+        self.assertEqual(('failed', 1.0, []), (batch['state'], batch['progress'], batch['running']))
+        self.assertEqual([('v2', 'RuntimeError: scan failed')],
+                         [(job['version_name'], job['error']) for job in batch['failed']])
+        self.assertIsNone(self.queue.get_batch('not an id'))
+
+    def test_select_versions(self):
+        self.mongo.db.versions.insert_many([
+            {'project_name': 'alibaba/cooma', 'version_name': name, 'scanned': False, 'calculated': False,
+             'version_time': datetime.datetime(2020, 1, day)}
+            for day, name in [(3, 'v1.1'), (1, 'v0.9'), (4, 'v2.0'), (2, 'v1.0')]])
+
+        def names(**kwargs):
+            return [version['version_name'] for version in Version.select_versions('alibaba/cooma', self.mongo,
+                                                                                   **kwargs)]
+
+        self.assertEqual(['v0.9', 'v1.0', 'v1.1', 'v2.0'], names())
+        self.assertEqual(['v1.0', 'v1.1'], names(first='v1.0', last='v1.1'))
+        self.assertEqual(['v1.1', 'v2.0'], names(first='v1.1'))
+        self.assertEqual(['v1.0', 'v1.1'], names(pattern='v1.*'))
+        self.assertIsNone(Version.select_versions('alibaba/cooma', self.mongo, last='v3.0'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+"""
+指标树节点存储测试用例
+"""
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from flask_pymongo import PyMongo
+from pymongo import MongoClient
+
+from test_hierarchy import make_classes, to_frame
+
+sys.path.append('.')
+from app.hierarchy import Hierarchy
+from app.main.views import app
+from app.models import Version
+from app.node_store import MAX_SLICE_DEPTH, NodeStore, load_hierarchy, load_slice
+
+
+class NodeStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        mongodb_url = os.getenv('MONGODB_URL')
+        self.mongo_client = MongoClient(mongodb_url)
+        self.mongo_client.drop_database('test')
+        self.mongo = PyMongo(app, uri=f'{mongodb_url}/test')
+        self.store = NodeStore(self.mongo)
+        self.hierarchy = Hierarchy.from_frame(to_frame(make_classes(300)), 'cooma', 'alibaba/cooma(v1)')
+
+    def tearDown(self):
+        self.mongo_client.drop_database('test')
+
+    def version(self, calc_tree):
+        return {'project_name': 'alibaba/cooma', 'version_name': 'v1', 'calc_tree': calc_tree, 'calc_results': None}
+
+    def test_round_trip(self):
+        calc_tree = self.store.save('alibaba/cooma', 'v1', self.hierarchy)
+        self.assertEqual(len(self.hierarchy), calc_tree['nodes'])
+        hierarchy = load_hierarchy(self.mongo, self.version(calc_tree))
+        self.assertEqual(self.hierarchy.to_legacy(), hierarchy.to_legacy())
+        self.assertEqual(self.hierarchy.to_legacy(full_names=False), hierarchy.to_legacy(full_names=False))
+
+    def test_recalc(self):
+        old = self.store.save('alibaba/cooma', 'v1', self.hierarchy)
+        new = self.store.save('alibaba/cooma', 'v1', self.hierarchy)
+        # 切换之前旧的一代仍然完整
+        self.assertEqual(self.hierarchy.to_legacy(), load_hierarchy(self.mongo, self.version(old)).to_legacy())
+        self.store.delete_stale('alibaba/cooma', 'v1', new['tree'])
+        self.assertEqual(len(self.hierarchy), self.mongo.db.nodes.count_documents({}))
+        self.assertEqual(self.hierarchy.to_legacy(), load_hierarchy(self.mongo, self.version(new)).to_legacy())
+
+    def test_root_values(self):
+        calc_tree = self.store.save('alibaba/cooma', 'v1', self.hierarchy)
+        self.assertEqual({'v1': self.hierarchy.root_values()},
+                         self.store.root_values('alibaba/cooma', {'v1': calc_tree}))
+
+    def test_slice(self):
+        version = self.version(self.store.save('alibaba/cooma', 'v1', self.hierarchy))
+        for path, depth in [('', 0), ('', 2), ('src/main/java', 3)]:
+            self.assertEqual(self.hierarchy.slice(path, depth), load_slice(self.mongo, version, path, depth))
+        self.assertIsNone(load_slice(self.mongo, version, 'src/none', 2))
+
+    def test_slice_depth(self):
+        self.mongo.db.versions.insert_one(self.version(self.store.save('alibaba/cooma', 'v1', self.hierarchy)))
+        app.config.update(TESTING=True, mongo=self.mongo)
+        client = app.test_client()
+        query = {'project_name': 'alibaba/cooma', 'version_name': 'v1', 'path': ''}
+        # 超出范围的depth截断到0..MAX_SLICE_DEPTH
+        for depth, expected in [(-1, 0), (2, 2), ('3', 3), (100, MAX_SLICE_DEPTH)]:
+            data = client.post('/api/treemap/nodes', json=dict(query, depth=depth)).json['data']
+            self.assertEqual(expected, data['depth'])
+            self.assertEqual(self.hierarchy.slice('', expected), data['tree'])
+        for depth in ['x', None, [2]]:
+            self.assertEqual(400, client.post('/api/treemap/nodes', json=dict(query, depth=depth)).status_code)
+
+    def test_embedded_results(self):
+        # 之前嵌入在版本文档中的结果仍然可以读取
+        version = {'project_name': 'alibaba/cooma', 'version_name': 'v1',
+                   'calc_results': self.hierarchy.to_legacy()}
+        self.assertEqual(self.hierarchy.to_legacy(), load_hierarchy(self.mongo, version).to_legacy())
+        self.assertEqual(self.hierarchy.slice('src/main/java', 2), load_slice(self.mongo, version, 'src/main/java', 2))
+        self.assertIsNone(load_hierarchy(self.mongo, dict(version, calc_results=None)))
+
+    def test_summaries(self):
+        calc_tree = self.store.save('alibaba/cooma', 'v2', self.hierarchy)
+        summary = self.hierarchy.root_values()
+        self.mongo.db.versions.insert_many([
+            {'project_name': 'alibaba/cooma', 'version_name': 'v1', 'calculated': True,
+             'calc_results': self.hierarchy.to_legacy()},
+            {'project_name': 'alibaba/cooma', 'version_name': 'v2', 'calculated': True, 'calc_results': None,
+             'calc_tree': calc_tree},
+            {'project_name': 'alibaba/cooma', 'version_name': 'v3', 'calculated': True, 'calc_results': None,
+             'calc_tree': calc_tree, 'calc_summary': summary},
+            {'project_name': 'alibaba/cooma', 'version_name': 'v4', 'calculated': False, 'calc_results': None}])
+        expected = [{'version_name': version_name, **summary} for version_name in ['v1', 'v2', 'v3']]
+        self.assertEqual(expected, Version.get_summaries('alibaba/cooma', self.mongo))
+        # 之前计算的版本补写了calc_summary
+        self.assertEqual(summary, self.mongo.db.versions.find_one({'version_name': 'v1'})['calc_summary'])
+        self.assertEqual(summary, self.mongo.db.versions.find_one({'version_name': 'v2'})['calc_summary'])
+
+    def test_calc(self):
+        self.mongo.db.versions.insert_one({'project_name': 'alibaba/cooma', 'version_name': 'v1', 'scanned': True,
+                                           'calculated': False, 'calc_results': None})
+        version = Version(SimpleNamespace(project_name='alibaba/cooma'), 'v1', self.mongo, 'committer', None,
+                          scanned=True)
+        # 不实际扫描，直接返回构造好的指标树
+        with mock.patch('app.models.IndicatorsCalculator') as calculator:
+            calculator.return_value.calc_indicators.return_value = self.hierarchy
+            self.assertTrue(version.calc())
+        summary = self.hierarchy.root_values()
+        document = self.mongo.db.versions.find_one({'version_name': 'v1'})
+        self.assertTrue(document['calculated'])
+        self.assertEqual(summary, document['calc_summary'])
+        self.assertEqual(summary, version.calc_summary)
+        self.assertEqual(document['calc_tree'], version.calc_tree)
+        self.assertEqual(self.hierarchy.to_legacy(), version.get_hierarchy().to_legacy())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+"""
+图表结果缓存测试用例
+"""
+import datetime
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+
+from flask_pymongo import PyMongo
+from pymongo import MongoClient
+
+sys.path.append('.')
+from app.main.views import app
+from app.render_cache import RenderCache
+
+
+def decode(payload):
+    return json.loads(gzip.decompress(payload))
+
+
+class RenderCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        mongodb_url = os.getenv('MONGODB_URL')
+        self.mongo_client = MongoClient(mongodb_url)
+        self.mongo_client.drop_database('test')
+        self.mongo = PyMongo(app, uri=f'{mongodb_url}/test')
+        self.cache = RenderCache(self.mongo)
+        self.cache.ensure_indexes()
+        self.calls = 0
+
+    def tearDown(self):
+        self.mongo_client.drop_database('test')
+
+    def render(self, seconds=0):
+        self.calls += 1
+        time.sleep(seconds)
+        return {'code': 1000, 'data': {'calls': self.calls}}
+
+    def test_hit(self):
+        self.assertEqual(1, decode(self.cache.get('treemap:a', 'alibaba/cooma', 'v1', self.render))['data']['calls'])
+        self.assertEqual(1, decode(self.cache.get('treemap:a', 'alibaba/cooma', 'v1', self.render))['data']['calls'])
+        self.assertEqual(1, self.calls)
+
+    def test_coalesce(self):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            self.cache.get('treemap:a', 'alibaba/cooma', 'v1', lambda: self.render(0.5)))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, self.calls)
+        self.assertEqual(4, len(results))
+        self.assertEqual(1, len(set(results)))
+
+    def test_invalidate(self):
+        self.cache.get('treemap:v1', 'alibaba/cooma', 'v1', self.render)
+        self.cache.get('treemap:v2', 'alibaba/cooma', 'v2', self.render)
+        self.cache.get('linechart', 'alibaba/cooma', None, self.render)
+        self.cache.invalidate('alibaba/cooma', 'v1')
+        self.assertEqual(['treemap:v2'], [document['_id'] for document in self.mongo.db.renders.find()])
+        self.cache.invalidate('alibaba/cooma')
+        self.assertEqual(0, self.mongo.db.renders.count_documents({}))
+
+    def test_invalidate_while_rendering(self):
+        # 生成期间缓存被清除，结果返回给本次请求但不写入
+        def render():
+            self.cache.invalidate('alibaba/cooma', 'v1')
+            return self.render()
+
+        self.cache.get('treemap:a', 'alibaba/cooma', 'v1', render)
+        self.assertEqual(0, self.mongo.db.renders.count_documents({}))
+
+    def test_expired_lock(self):
+        self.mongo.db.renders.insert_one({'_id': 'treemap:a', 'project_name': 'alibaba/cooma', 'version_name': 'v1',
+                                          'state': 'pending', 'owner': 'gone',
+                                          'expires': datetime.datetime.utcnow() - datetime.timedelta(seconds=1),
+                                          'created': datetime.datetime.utcnow()})
+        self.assertEqual(1, decode(self.cache.get('treemap:a', 'alibaba/cooma', 'v1', self.render))['data']['calls'])
+        self.assertEqual('ready', self.mongo.db.renders.find_one({'_id': 'treemap:a'})['state'])
+
+    def test_error_not_cached(self):
+        def render():
+            raise RuntimeError
+
+        with self.assertRaises(RuntimeError):
+            self.cache.get('treemap:a', 'alibaba/cooma', 'v1', render)
+        self.assertEqual(0, self.mongo.db.renders.count_documents({}))
+
+
+if __name__ == '__main__':
+    unittest.main()
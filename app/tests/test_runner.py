@@ -0,0 +1,79 @@
+"""
+流式执行子进程的测试用例，需要在类Unix系统中运行
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.append('.')
+from app.runner import CommandCancelled, CommandError, CommandTimeout, parse_progress, run_stream
+
+
+def alive(pid):
+    # 僵尸进程视为已结束
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().split(')')[-1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+
+@unittest.skipUnless(os.name == 'posix', 'requires a POSIX shell')
+class RunStreamTestCase(unittest.TestCase):
+    def test_lines(self):
+        self.assertEqual(['a', 'b', 'c'], run_stream(['printf', 'a\\n\\nb\\r\\nc']))
+        self.assertEqual(['out', 'err'], run_stream('echo out; echo err >&2', shell=True))
+
+    def test_tail(self):
+        lines = run_stream(['seq', '100000'], max_lines=10)
+        self.assertEqual([str(i) for i in range(99991, 100001)], lines)
+        self.assertEqual(100000, len(run_stream(['seq', '100000'], max_lines=None)))
+
+    def test_progress(self):
+        updates = []
+        output = ('Cloning into x...\\nReceiving objects:  10% (1/10)\\rReceiving objects: 100% (10/10), done.\\n'
+                  'Resolving deltas:  50% (1/2)\\rmore\\n')
+        run_stream(['printf', '%b', output], progress=updates.append)
+        self.assertEqual([(None, None), ('Receiving objects', 10), ('Receiving objects', 100),
+                          ('Resolving deltas', 50), ('Resolving deltas', 50)],
+                         [(update['phase'], update['percent']) for update in updates])
+        self.assertEqual('more', updates[-1]['line'])
+
+    def test_parse_progress(self):
+        self.assertEqual({'phase': 'Counting objects', 'percent': 7},
+                         parse_progress('remote: Counting objects:   7% (7/100)'))
+        self.assertEqual({'phase': 'Running AnalyzerJava', 'percent': None}, parse_progress('Running AnalyzerJava...'))
+        self.assertIsNone(parse_progress('Note: switching to v1.0'))
+
+    def test_error(self):
+        with self.assertRaises(CommandError) as cm:
+            run_stream('echo failed; exit 3', shell=True)
+        self.assertIn('exited with 3', str(cm.exception))
+        self.assertEqual(['failed'], cm.exception.lines)
+
+    def test_timeout_kills_group(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            start = time.monotonic()
+            # 后台的子进程与shell在同一进程组中，一并结束
+            with self.assertRaises(CommandTimeout):
+                run_stream(f'sleep 30 & echo $! > {tmp}/pid; wait', shell=True, timeout=0.5)
+            self.assertLess(time.monotonic() - start, 10)
+            with open(f'{tmp}/pid') as f:
+                pid = int(f.read())
+            time.sleep(0.2)
+            self.assertFalse(alive(pid))
+
+    def test_cancel(self):
+        cancelled = threading.Event()
+        threading.Timer(0.3, cancelled.set).start()
+        start = time.monotonic()
+        with self.assertRaises(CommandCancelled):
+            run_stream(['sleep', '30'], cancelled=cancelled)
+        self.assertLess(time.monotonic() - start, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+"""
+在git worktree中检出版本、整理扫描结果的测试用例，使用临时目录中的本地仓库，不需要联网
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest import mock
+
+from cq_fixtures import write_scan_results
+
+sys.path.append('.')
+from app.runner import CommandCancelled
+from app.utils import WORKTREE_LOCK_FILE, CodeScanner, IndicatorsCalculator, get_tags_local, worktree_lock
+
+TAGS = ['v0.1', 'v0.2', 'v0.3', 'v0.4']
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def git(cwd, *args):
+    subprocess.run(['git', *args], cwd=cwd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class WorktreeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.project_path = f'{self.tmp}/OSSprojects/alibaba/cooma'
+        os.makedirs(self.project_path)
+        git(self.project_path, 'init', '-q')
+        for tag in TAGS:
+            with open(f'{self.project_path}/VERSION', 'w') as f:
+                f.write(tag)
+            git(self.project_path, 'add', 'VERSION')
+            git(self.project_path, '-c', 'user.name=mql', '-c', 'user.email=mql@example.com', 'commit', '-q',
+                '-m', tag)
+            git(self.project_path, 'tag', tag)
+        self.project = SimpleNamespace(project_name='alibaba/cooma', project_path=self.project_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def scanner(self, version_name):
+        version = SimpleNamespace(project=self.project, version_name=version_name,
+                                  version_scan_results_dir=f'{self.tmp}/OSSresults/alibaba/cooma/java/{version_name}')
+        scanner = CodeScanner(version)
+        scanner.worktree_path = f'{self.tmp}/OSSworktrees/alibaba/cooma/{version_name}'
+        return scanner
+
+    def checkout_and_read(self, tag):
+        scanner = self.scanner(tag)
+        scanner.add_worktree()
+        try:
+            return read(f'{scanner.worktree_path}/VERSION')
+        finally:
+            scanner.remove_worktree()
+
+    def test_parallel_worktrees(self):
+        with ThreadPoolExecutor(max_workers=len(TAGS)) as executor:
+            self.assertEqual(TAGS, list(executor.map(self.checkout_and_read, TAGS)))
+        # 共用的clone不受影响，worktree都已删除
+        self.assertEqual(TAGS[-1], read(f'{self.project_path}/VERSION'))
+        self.assertEqual([], os.listdir(f'{self.tmp}/OSSworktrees/alibaba/cooma'))
+        worktrees = subprocess.run(['git', 'worktree', 'list'], cwd=self.project_path, stdout=subprocess.PIPE,
+                                   universal_newlines=True, check=True).stdout.splitlines()
+        self.assertEqual(1, len(worktrees))
+
+    def test_leftover_worktree(self):
+        # 之前中断留下的worktree不影响再次检出
+        scanner = self.scanner('v0.2')
+        scanner.add_worktree()
+        self.assertEqual('v0.2', self.checkout_and_read('v0.2'))
+
+    def test_scan_removes_worktree(self):
+        scanned = []
+        scanner = self.scanner('v0.3')
+        scanner.scan = lambda base_dir=None: scanned.append(read(f'{base_dir}/VERSION'))
+        scanner.scan_version()
+        self.assertEqual(['v0.3'], scanned)
+        self.assertFalse(os.path.exists(scanner.worktree_path))
+
+    def fake_sourcemeter(self, error=None):
+        def run_cmd(args, **kwargs):
+            options = dict(arg[1:].split('=', 1) for arg in args[1:])
+            results_dir = f"{options['resultsDir']}/{options['projectName']}/java/{options['currentDate']}"
+            os.makedirs(results_dir)
+            open(f"{results_dir}/{options['projectName']}-Class.csv", 'w').close()
+            if error is not None:
+                raise error
+            return []
+
+        return run_cmd
+
+    def test_cancelled_scan(self):
+        # 中断的扫描不留下不完整的结果，再次扫描时不会被跳过
+        scanner = self.scanner('v0.3')
+        error = CommandCancelled(['SourceMeterJava'], 'was cancelled', [])
+        with mock.patch('app.utils.run_cmd', self.fake_sourcemeter(error)):
+            self.assertRaises(CommandCancelled, scanner.scan, self.project_path)
+        results_dir = scanner.version.version_scan_results_dir
+        self.assertEqual([], os.listdir(os.path.dirname(results_dir)))
+        with mock.patch('app.utils.run_cmd', self.fake_sourcemeter()):
+            scanner.scan(self.project_path)
+        self.assertEqual(['cooma-Class.csv'], os.listdir(results_dir))
+        self.assertEqual(['v0.3'], os.listdir(os.path.dirname(results_dir)))
+
+    @unittest.skipIf(os.name != 'posix', 'file lock uses fcntl')
+    def test_worktree_lock_across_processes(self):
+        # 另一个工作进程在锁被占用时不能对同一个clone增删worktree
+        script = ('import fcntl, sys\n'
+                  'with open(sys.argv[1], "a") as f:\n'
+                  '    try:\n'
+                  '        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)\n'
+                  '    except BlockingIOError:\n'
+                  '        sys.exit(1)\n')
+        lock_file = f'{self.project_path}/{WORKTREE_LOCK_FILE}'
+        with worktree_lock(self.project_path):
+            self.assertEqual(1, subprocess.run([sys.executable, '-c', script, lock_file]).returncode)
+        self.assertEqual(0, subprocess.run([sys.executable, '-c', script, lock_file]).returncode)
+
+    def test_tags_local(self):
+        # 版本名中的特殊字符不经过shell
+        git(self.project_path, '-c', 'user.name=mql', '-c', 'user.email=mql@example.com', 'commit', '-q',
+            '--allow-empty', '-m', 'rc')
+        git(self.project_path, 'tag', "v1.0;echo$(id)&'rc'")
+        cwd = os.getcwd()
+        os.chdir(self.tmp)
+        try:
+            tags = get_tags_local('alibaba/cooma')
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(set(TAGS) | {"v1.0;echo$(id)&'rc'"}, {tag['version_name'] for tag in tags})
+
+
+class ResultsCleanupTestCase(unittest.TestCase):
+    def test_calc_keeps_inputs(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            results_dir = f'{tmp}/OSSresults/alibaba/cooma/java/v1'
+            write_scan_results(results_dir, 'cooma', n_classes=20)
+            for name in ('cooma-Package.csv', 'sourcemeter/graph/cooma.graph', 'sourcemeter/temp/cooma.ljsi'):
+                os.makedirs(os.path.dirname(f'{results_dir}/{name}'), exist_ok=True)
+                open(f'{results_dir}/{name}', 'w').close()
+            project = SimpleNamespace(project_name='alibaba/cooma')
+            version = SimpleNamespace(project=project, version_name='v1', version_scan_results_dir=results_dir)
+            calculator = IndicatorsCalculator(version)
+            calculator.executor = None
+            hierarchy = calculator.calc_indicators()
+            self.assertGreater(len(hierarchy), 20)
+            kept = sorted(os.path.relpath(os.path.join(root, name), results_dir)
+                          for root, _, names in os.walk(results_dir) for name in names)
+            self.assertEqual(['cooma-Class.csv', 'cooma-Method.csv', 'sourcemeter/temp/cooma-PMD.xml'],
+                             [name for name in kept if not name.startswith('cooma-cache')])
+            self.assertFalse(os.path.exists(f'{results_dir}_backup'))
+            # 再次计算时使用保留的文件
+            self.assertEqual(len(hierarchy), len(calculator.calc_indicators()))
+
+
+if __name__ == '__main__':
+    unittest.main()
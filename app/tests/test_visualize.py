@@ -0,0 +1,143 @@
+"""
+可视化option生成测试用例
+"""
+import json
+import random
+import sys
+import unittest
+
+from test_hierarchy import make_classes, to_frame
+
+sys.path.append('.')
+from app.hierarchy import Hierarchy
+from app.visualize import INDICATORS, to_treemap, to_linechart
+
+try:
+    import pyecharts
+    import pyecharts.options as opts
+    from pyecharts.charts import TreeMap, Line, Grid
+except ImportError:
+    pyecharts = None
+
+# 默认值随pyecharts的版本变化，与requirements.txt中的版本比较
+PYECHARTS_VERSION = '1.9.0'
+
+
+# 原有的实现，作为对照；修正了extract遇到第一个类节点就返回、丢掉其后的兄弟节点的问题
+def extract(target, indicator, calc_results):
+    target['value'] = round(calc_results[indicator], 2)
+    for element in calc_results['children']:
+        child = {'name': element['name'], 'children': []}
+        target['children'].append(child)
+        if len(element['children']) == 0:
+            child['value'] = round(element[indicator], 2)
+        else:
+            extract(child, indicator, element)
+
+
+def pyecharts_treemap(data, proj, version):
+    treemap = TreeMap()
+    for indicator in INDICATORS:
+        tree = {'name': f'{proj}-{version}', 'children': []}
+        extract(tree, indicator, data)
+        treemap = treemap.add(series_name=indicator, data=[tree], leaf_depth=2, roam=False,
+                              label_opts=opts.LabelOpts(position='inside'))
+    treemap = treemap.set_global_opts(
+        tooltip_opts=opts.TooltipOpts(formatter='{b}<br/>{a}: {c}'),
+        toolbox_opts=opts.ToolboxOpts(feature=opts.ToolBoxFeatureOpts(
+            magic_type=opts.ToolBoxFeatureMagicTypeOpts(is_show=False),
+            data_zoom=opts.ToolBoxFeatureDataZoomOpts(is_show=False),
+            brush=opts.ToolBoxFeatureBrushOpts(type_='clear'))),
+        legend_opts=opts.LegendOpts(is_show=True, selected_mode='single', pos_top='7%', orient='horizontal',
+                                    padding=0),
+        title_opts=opts.TitleOpts(title=f'Code Quality Treemap of {proj}-{version}', pos_left='center'))
+    grid = Grid()
+    grid.add(treemap, grid_opts=opts.GridOpts(pos_top='100%'))
+    return json.loads(grid.dump_options_with_quotes())
+
+
+def pyecharts_linechart(data, proj):
+    linechart = Line().add_xaxis(xaxis_data=[version['version_name'] for version in data])
+    for indicator in INDICATORS:
+        linechart = linechart.add_yaxis(series_name=indicator, y_axis=[round(version[indicator], 2) for version in data],
+                                        is_smooth=True, label_opts=opts.LabelOpts(is_show=False),
+                                        linestyle_opts=opts.LineStyleOpts(width=2))
+    linechart = linechart.set_global_opts(
+        tooltip_opts=opts.TooltipOpts(trigger="axis", axis_pointer_type="cross"),
+        xaxis_opts=opts.AxisOpts(boundary_gap=False),
+        yaxis_opts=opts.AxisOpts(axislabel_opts=opts.LabelOpts(formatter="{value}"),
+                                 splitline_opts=opts.SplitLineOpts(is_show=True)),
+        toolbox_opts=opts.ToolboxOpts(feature=opts.ToolBoxFeatureOpts(
+            magic_type=opts.ToolBoxFeatureMagicTypeOpts(is_show=False),
+            data_zoom=opts.ToolBoxFeatureDataZoomOpts(is_show=False),
+            brush=opts.ToolBoxFeatureBrushOpts(type_='clear'))),
+        legend_opts=opts.LegendOpts(is_show=True, pos_top='middle', pos_left='1%', orient='vertical', padding=0),
+        datazoom_opts=opts.DataZoomOpts(type_='slider', range_start=0, range_end=100),
+        title_opts=opts.TitleOpts(title=f'Code Quality Linechart of {proj}', pos_left='center'))
+    grid = Grid()
+    grid.add(linechart, grid_opts=opts.GridOpts(pos_left='150'))
+    return json.loads(grid.dump_options_with_quotes())
+
+
+def make_versions(n_versions, seed=0):
+    rng = random.Random(seed)
+    return [{'version_name': f'0.{i}.0', **{indicator: rng.random() * 100 for indicator in INDICATORS}}
+            for i in range(n_versions)]
+
+
+class VisualizeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.hierarchy = Hierarchy.from_frame(to_frame(make_classes(200)), 'cooma', 'alibaba/cooma(v1)')
+        self.tree = self.hierarchy.to_legacy()
+
+    def test_treemap(self):
+        options = to_treemap(self.hierarchy, 'alibaba/cooma', 'v1')
+        self.assertEqual(INDICATORS, [series['name'] for series in options['series']])
+        for series in options['series']:
+            self.assertEqual('treemap', series['type'])
+            self.assertEqual(2, series['leafDepth'])
+            self.assertEqual('alibaba/cooma-v1', series['data'][0]['name'])
+            self.assertEqual(round(self.tree[series['name']], 2), series['data'][0]['value'])
+        self.assertEqual('single', options['legend'][0]['selectedMode'])
+        self.assertEqual('Code Quality Treemap of alibaba/cooma-v1', options['title'][0]['text'])
+        # 可以直接序列化
+        json.dumps(options)
+
+    def test_same_as_extract(self):
+        for full_names in (True, False):
+            tree = self.hierarchy.to_legacy(full_names)
+            options = to_treemap(self.hierarchy, 'alibaba/cooma', 'v1', full_names=full_names)
+            for series in options['series']:
+                expected = {'name': 'alibaba/cooma-v1', 'children': []}
+                extract(expected, series['name'], tree)
+                self.assertEqual([expected], series['data'])
+
+    def test_all_classes(self):
+        # 每个类节点都在树中
+        tree = to_treemap(self.hierarchy, 'alibaba/cooma', 'v1')['series'][0]['data'][0]
+        stack, n_leaves = [tree], 0
+        while stack:
+            node = stack.pop()
+            n_leaves += not node['children']
+            stack.extend(node['children'])
+        self.assertEqual(int(self.hierarchy.leaf.sum()), n_leaves)
+
+    def test_linechart(self):
+        versions = make_versions(20)
+        options = to_linechart(versions, 'alibaba/cooma')
+        self.assertEqual([version['version_name'] for version in versions], options['xAxis'][0]['data'])
+        self.assertEqual([[version['version_name'], round(version['complexity'], 2)] for version in versions],
+                         options['series'][0]['data'])
+        json.dumps(options)
+
+    @unittest.skipUnless(pyecharts and pyecharts.__version__ == PYECHARTS_VERSION,
+                         f'需要pyecharts {PYECHARTS_VERSION}')
+    def test_same_as_pyecharts(self):
+        self.assertEqual(pyecharts_treemap(self.tree, 'alibaba/cooma', 'v1'),
+                         to_treemap(self.hierarchy, 'alibaba/cooma', 'v1', full_names=True))
+        versions = make_versions(20)
+        self.assertEqual(pyecharts_linechart(versions, 'alibaba/cooma'), to_linechart(versions, 'alibaba/cooma'))
+
+
+if __name__ == '__main__':
+    unittest.main()
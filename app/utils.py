@@ -1,40 +1,66 @@
 """
 供其他模块调用的工具函数和工具类
 """
+import contextlib
 import datetime
 import json
 import os
-import sys
+import shutil
+import tempfile
+import threading
 import time
-from subprocess import getstatusoutput
+from collections import defaultdict
 
 import requests
 
 from .cq_calc import cq_calculator
+from .hierarchy import Hierarchy
+from .runner import TAIL_LINES, run_stream
+
+try:
+    import fcntl
+except ImportError:
+    # Windows上没有fcntl，只在进程内加锁
+    fcntl = None
+
+# 各版本的worktree所在的目录
+WORKTREES_DIR = 'OSSworktrees'
+# 对同一个clone的worktree增删依次进行：进程内用线程锁，各工作进程之间用clone中的文件锁
+WORKTREE_LOCKS = defaultdict(threading.Lock)
+WORKTREE_LOCK_FILE = '.git/worktree.lock'
+# clone、扫描的超时秒数
+CLONE_TIMEOUT = 3600
+SCAN_TIMEOUT = 6 * 3600
+# 计算各项指标的并行方式，见cq_calculator：thread、process或none（依次计算）
+# 工作进程已由run_workers启动多个，默认用线程池，进程池需部署时通过环境变量CALC_EXECUTOR=process启用
+CALC_EXECUTOR = os.getenv('CALC_EXECUTOR', 'thread')
+
+
+def run_cmd(args, cwd=None, max_lines=None, progress=None, cancelled=None, timeout=None):
+    """
+    不经过shell，在cwd目录中直接执行命令，参数见runner.run_stream
+    默认保留全部输出行，输出很多的命令应限制max_lines
+    :param args: 参数列表，参数中的空格、引号等不需要转义
+    """
+    print(f'\nrunning: {" ".join(args)}' + (f' (in {cwd})' if cwd else ''))
+    return run_stream(args, cwd=cwd, max_lines=max_lines, progress=progress, cancelled=cancelled, timeout=timeout)
 
 
-def run_cmd(cmd):
-    # print('*' * 80)
-    # print(f'path: {os.getcwd()}')
-    # print(f'command: {cmd}')
-    if not sys.platform.startswith('win'):
-        cmd = cmd.replace('&', ';')
-    print(f'\nrunning: {cmd}')
-    code, stdout = getstatusoutput(cmd)
-    # print('output:')
-    lines = []
-    for line in stdout.split('\n'):
-        if line:
-            # if re_pattern:
-            #     s = re.search(re_pattern, line.strip())
-            #     if s:
-            #         print(s.group(0))
-            # else:
-            #     print(line.strip())
-            lines.append(line.strip())
-    # print('*' * 80)
-    assert code == 0, f'command "{cmd}" gets error:\n{lines}'
-    return lines
+@contextlib.contextmanager
+def worktree_lock(project_path):
+    """
+    run_workers的多个工作进程可能同时检出同一项目的不同版本，git worktree prune、add需要依次执行
+    """
+    with WORKTREE_LOCKS[os.path.abspath(project_path)]:
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(project_path, WORKTREE_LOCK_FILE), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
 
 
 def to_time_str(t):
@@ -75,11 +101,9 @@ def get_tags_local(full_name):
     :param full_name: 项目全名
     :return: 按照committer date排序的版本号
     """
-    cmd0 = f'cd OSSprojects/{full_name}'
     # %D(tag name) %cn(committer name)<%cE(committer email)> %ct(committer date)
-    cmd1 = 'git log --tags --decorate --simplify-by-decoration --pretty="%D,%cn<%cE>,%ct"'
-    cmd = f'{cmd0} & {cmd1}'
-    lines = run_cmd(cmd)
+    args = ['git', 'log', '--tags', '--decorate', '--simplify-by-decoration', '--pretty=%D,%cn<%cE>,%ct']
+    lines = run_cmd(args, cwd=f'OSSprojects/{full_name}')
     versions_list = []
     for line in lines:
         # if line.startswith('HEAD'):
@@ -109,11 +133,9 @@ def get_last_commit_local(full_name):
     :param full_name: 项目全名
     :return: 按照committer date排序的版本号
     """
-    cmd0 = f'cd OSSprojects/{full_name}'
     # %D(tag name) %cn(committer name)<%cE(committer email)> %ct(committer date)
-    cmd1 = 'git log --decorate --simplify-by-decoration --pretty="%D,%cn<%cE>,%ct"'
-    cmd = f'{cmd0} & {cmd1}'
-    lines = run_cmd(cmd)
+    args = ['git', 'log', '--decorate', '--simplify-by-decoration', '--pretty=%D,%cn<%cE>,%ct']
+    lines = run_cmd(args, cwd=f'OSSprojects/{full_name}')
     committer_name, time_str = lines[0].split(',')[-2:]
     last_commit = {'version_name': 'fake tag (no tags)',
                    'version_committer': committer_name,
@@ -135,51 +157,95 @@ class CodeManager:
             return
         # 仅支持github的项目
         project_url = f"https://github.com.cnpmjs.org/{self.project_name}"
-        args = ["git", "clone", "--progress", project_url, f"{self.project_path}"]
-        cmd = " ".join(args)
-        run_cmd(cmd)
+        args = ["git", "clone", "--progress", project_url, self.project_path]
+        run_cmd(args, max_lines=TAIL_LINES, timeout=CLONE_TIMEOUT)
 
     def update(self):
-        args = ["cd", f"{self.project_path}", "&", "git", "pull", "--progress"]
-        cmd = " ".join(args)
-        run_cmd(cmd)
+        args = ["git", "pull", "--progress"]
+        run_cmd(args, cwd=self.project_path, max_lines=TAIL_LINES, timeout=CLONE_TIMEOUT)
 
     def remove(self):
-        if sys.platform.startswith('win'):
-            # rmdir /s（非空） /q（去掉确认）
-            args = ["cd", "OSSprojects", "&", "rd", "/s", "/q", f"{self.project_name}".replace('/', '\\')]
-            cmd = " ".join(args)
-            run_cmd(cmd)
-        else:
-            args = ["cd", f"OSSprojects", "&", "rm", "-rf", f"{self.project_path}"]
-            cmd = " ".join(args)
-            run_cmd(cmd)
+        shutil.rmtree(self.project_path, ignore_errors=True)
 
 
 class CodeScanner:
-    def __init__(self, version):
+    # 每个版本检出到单独的git worktree中扫描，同一项目的多个版本可以同时扫描；为False时在共用的clone中checkout
+    use_worktree = True
+
+    def __init__(self, version, progress=None, cancelled=None):
+        """
+        :param progress: 扫描进度的回调函数，见runner.run_stream
+        :param cancelled: threading.Event，被设置后结束正在执行的命令
+        """
         self.version = version
         self.project = version.project
+        self.progress = progress
+        self.cancelled = cancelled
+        self.worktree_path = f'{WORKTREES_DIR}/{self.project.project_name}/{self.version.version_name}'
 
     def checkout(self):
         if self.version.version_name != 'fake tag (no tags)':
-            args = ["cd", f"{self.project.project_path}", "&", "git", "checkout", f"{self.version.version_name}"]
-            cmd = " ".join(args)
-            run_cmd(cmd)
-
-    def scan(self):
+            args = ["git", "checkout", self.version.version_name]
+            run_cmd(args, cwd=self.project.project_path)
+
+    def add_worktree(self):
+        """
+        以detached HEAD检出到worktree_path，之前中断留下的同名worktree先删除
+        """
+        commit = 'HEAD' if self.version.version_name == 'fake tag (no tags)' else self.version.version_name
+        # git在clone的目录中执行，使用绝对路径
+        worktree_path = os.path.abspath(self.worktree_path)
+        with worktree_lock(self.project.project_path):
+            if os.path.exists(worktree_path):
+                shutil.rmtree(worktree_path)
+            run_cmd(['git', 'worktree', 'prune'], cwd=self.project.project_path)
+            os.makedirs(os.path.dirname(worktree_path), exist_ok=True)
+            run_cmd(['git', 'worktree', 'add', '--detach', worktree_path, commit], cwd=self.project.project_path)
+
+    def remove_worktree(self):
+        worktree_path = os.path.abspath(self.worktree_path)
+        with worktree_lock(self.project.project_path):
+            shutil.rmtree(worktree_path, ignore_errors=True)
+            run_cmd(['git', 'worktree', 'prune'], cwd=self.project.project_path)
+
+    def scan_version(self):
+        """
+        检出并扫描本版本，使用worktree时扫描后删除
+        """
+        if not self.use_worktree:
+            self.checkout()
+            self.scan()
+            return
+        # 已经存在，不再检出
+        if os.path.exists(self.version.version_scan_results_dir):
+            return
+        self.add_worktree()
+        try:
+            self.scan(self.worktree_path)
+        finally:
+            self.remove_worktree()
+
+    def scan(self, base_dir=None):
+        """
+        :param base_dir: 源码所在的目录，默认为项目的clone
+        """
+        results_dir = self.version.version_scan_results_dir
         # 已经存在，不再扫描
-        if os.path.exists(f'OSSresults/{self.project.project_name}/java/{self.version.version_name}'):
+        if os.path.exists(results_dir):
             return
-        # 将扫描结果放到'A/B'(project_name)中的'A'(maintainer)目录下
-        maintainer, proj_short_name = self.project.project_name.split('/')
+        proj_short_name = self.project.project_name.split('/')[-1]
+        # SourceMeter边运行边写入结果，先写到同一目录下的临时目录，成功后再移到results_dir
+        # 超时、取消或出错时删除临时目录，不完整的结果不会被下次扫描当作已完成
+        parent_dir = os.path.dirname(results_dir)
+        os.makedirs(parent_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix='.scanning-', dir=parent_dir)
         # cleanProject=true 清除在目录中留下痕迹，避免影响git操作
         # *=false 关闭一些冗余功能
         args = ["SourceMeterJava",
                 f"-projectName={proj_short_name}",
-                f"-projectBaseDir={self.project.project_path}",
-                f"-resultsDir=OSSresults/{maintainer}",
-                f'-currentDate="{self.version.version_name}"',
+                f"-projectBaseDir={base_dir or self.project.project_path}",
+                f"-resultsDir={tmp_dir}",
+                f'-currentDate={self.version.version_name}',
                 "-cleanProject=true",
                 '-runRTEHunter=false',
                 '-runAndroidHunter=false',
@@ -188,98 +254,18 @@ class CodeScanner:
                 '-runFB=false',
                 '-runUDM=false',
                 '-runFaultHunter=false']
-        cmd = " ".join(args)
-        run_cmd(cmd)
-
-
-# 构造所有要计算的粒度（各级目录、文件），用来找到children
-def generate_whole_set(index):
-    whole_set = set()
-    for path in index:
-        frags = path.split('/')
-        for i in range(len(frags), 0, -1):
-            p_path = '/'.join(frags[:i])
-            if p_path not in whole_set:
-                whole_set.add(p_path)
-            else:
-                # 已经出现过这个path，则path的前面部分也出现过，直接跳出
-                break
-    return whole_set
-
-
-# 找到子对象
-def find_children(parent_path, whole_set):
-    f = filter(lambda s: '/'.join(s.split('/')[:-1]) == parent_path, whole_set)
-    return f
-
-
-# 递归地将类粒度指标累加为各粒度指标
-def convert(target, proj_path, whole_set, fine_grained_dict):
-    maintainability, testability, readability, reusability, inheritance, complexity = 0, 0, 0, 0, 0, 0
-    for path in find_children(proj_path, whole_set):
-        child = {"name": path, "children": []}
-        target['children'].append(child)
-        # 如果已经到达类粒度
-        if path in fine_grained_dict:
-            child['maintainability'] = fine_grained_dict[path]['maintainability']
-            maintainability += fine_grained_dict[path]['maintainability']
-
-            child['testability'] = fine_grained_dict[path]['testability']
-            testability += fine_grained_dict[path]['testability']
-
-            child['readability'] = fine_grained_dict[path]['readability']
-            readability += fine_grained_dict[path]['readability']
-
-            child['reusability'] = fine_grained_dict[path]['reusability']
-            reusability += fine_grained_dict[path]['reusability']
-
-            child['inheritance'] = fine_grained_dict[path]['inheritance']
-            inheritance += fine_grained_dict[path]['inheritance']
-
-            child['complexity'] = fine_grained_dict[path]['complexity']
-            complexity += fine_grained_dict[path]['complexity']
-        else:
-            maintainability_, testability_, readability_, reusability_, inheritance_, complexity_ = \
-                convert(child, path, whole_set, fine_grained_dict)
-            maintainability += maintainability_
-            testability += testability_
-            readability += readability_
-            reusability += reusability_
-            inheritance += inheritance_
-            complexity += complexity_
-    target['maintainability'] = maintainability
-    target['testability'] = testability
-    target['readability'] = readability
-    target['reusability'] = reusability
-    target['inheritance'] = inheritance
-    target['complexity'] = complexity
-    return maintainability, testability, readability, reusability, inheritance, complexity
-
-
-def convert2tree(target, proj_path, whole_set, class_maintainability_dict):
-    """
-    将类粒度的可维护性指标转换为包含各粒度质量指标的树形结构
-    :param target: {"name": project_version, "children": []}，具有此结构的Python字典，project_version为代表项目版本的字符串
-    :param proj_path: 即项目路径（名称）
-    :param whole_set: 需要计算的实体集合
-    :param class_maintainability_dict: 维护从类名到对应可维护性值映射的字典
-    :return: 本项目的可维护性值
-    """
-    maintainability = 0
-    for child_path in find_children(proj_path, whole_set):
-        child = {"name": child_path, "children": []}
-        target['children'].append(child)
-        # 如果已经到达类粒度
-        if child_path in class_maintainability_dict:
-            child['maintainability'] = class_maintainability_dict[child_path]['maintainability']
-            maintainability = maintainability + class_maintainability_dict[child_path]['maintainability']
-        else:
-            maintainability = maintainability + convert2tree(child, child_path, whole_set, class_maintainability_dict)
-    target['maintainability'] = maintainability
-    return maintainability
+        try:
+            run_cmd(args, max_lines=TAIL_LINES, progress=self.progress, cancelled=self.cancelled,
+                    timeout=SCAN_TIMEOUT)
+            # SourceMeter的结果在<resultsDir>/<projectName>/java/<currentDate>中
+            os.replace(f'{tmp_dir}/{proj_short_name}/java/{self.version.version_name}', results_dir)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
 
 
 class IndicatorsCalculator:
+    executor = None if CALC_EXECUTOR == 'none' else CALC_EXECUTOR
+
     def __init__(self, version):
         self.version = version
         self.project = version.project
@@ -288,53 +274,27 @@ class IndicatorsCalculator:
     def calc_indicators(self):
         proj_short_name = self.project.project_name.split('/')[-1]
         # 注意此处是short_name
-        df = cq_calculator(self.version_scan_results_dir, proj_short_name)
-        index = df.index
-        # 将df转换为dict
-        fgd = df.to_dict('index')
-        target = {'name': f'{self.project.project_name}({self.version.version_name})', 'children': []}
-        whole_set = generate_whole_set(index)
-        convert(target, proj_short_name, whole_set, fgd)
-        # 删除冗余的扫描结果，节省磁盘空间
-        if sys.platform.startswith('win'):
-            # rmdir /s（非空） /q（去掉确认）
-            cd_cmd = f"cd OSSresults\\{self.project.project_name}\\java & "
-            # 新建version结果的备份文件夹
-            md_cmd = cd_cmd + f'mkdir {self.version.version_name}_backup\\sourcemeter\\temp'
-            run_cmd(md_cmd)
-            # mv三个文件到备份文件夹
-            mv_cmd1 = cd_cmd + f'move {self.version.version_name}\\{proj_short_name}-Class.csv {self.version.version_name}_backup'
-            run_cmd(mv_cmd1)
-            mv_cmd2 = cd_cmd + f'move {self.version.version_name}\\{proj_short_name}-Method.csv {self.version.version_name}_backup'
-            run_cmd(mv_cmd2)
-            mv_cmd3 = cd_cmd + f'move {self.version.version_name}\\sourcemeter\\temp\\{proj_short_name}-PMD.xml {self.version.version_name}_backup\\sourcemeter\\temp'
-            run_cmd(mv_cmd3)
-            # 删除原文件夹
-            del_cmd = cd_cmd + f'rd /s /q {self.version.version_name}'
-            run_cmd(del_cmd)
-            # 重命名
-            ren_cmd = cd_cmd + f'ren {self.version.version_name}_backup {self.version.version_name}'
-            run_cmd(ren_cmd)
-        else:
-            # rmdir /s（非空） /q（去掉确认）
-            cd_cmd = f"cd OSSresults/{self.project.project_name}/java & "
-            # 新建version结果的备份文件夹
-            md_cmd = cd_cmd + f'mkdir -p {self.version.version_name}_backup/sourcemeter/temp'
-            run_cmd(md_cmd)
-            # mv三个文件到备份文件夹
-            mv_cmd1 = cd_cmd + f'mv {self.version.version_name}/{proj_short_name}-Class.csv {self.version.version_name}_backup'
-            run_cmd(mv_cmd1)
-            mv_cmd2 = cd_cmd + f'mv {self.version.version_name}/{proj_short_name}-Method.csv {self.version.version_name}_backup'
-            run_cmd(mv_cmd2)
-            mv_cmd3 = cd_cmd + f'mv {self.version.version_name}/sourcemeter/temp/{proj_short_name}-PMD.xml {self.version.version_name}_backup/sourcemeter/temp'
-            run_cmd(mv_cmd3)
-            # 删除原文件夹
-            del_cmd = cd_cmd + f'rm -rf {self.version.version_name}'
-            run_cmd(del_cmd)
-            # 重命名
-            ren_cmd = cd_cmd + f'mv {self.version.version_name}_backup {self.version.version_name}'
-            run_cmd(ren_cmd)
-        return target
+        # 在worktree中扫描的版本，类路径以worktree的路径开头，按此截取
+        source_dir = CodeScanner(self.version).worktree_path if CodeScanner.use_worktree else None
+        df = cq_calculator(self.version_scan_results_dir, proj_short_name, executor=self.executor,
+                           source_dir=source_dir)
+        # 直接由df构造数组表示的指标树，不再逐类转换为dict
+        root_name = f'{self.project.project_name}({self.version.version_name})'
+        hierarchy = Hierarchy.from_frame(df, proj_short_name, root_name)
+        # 删除冗余的扫描结果，节省磁盘空间：保留的文件移到备份文件夹，删除原文件夹后重命名
+        results_dir = self.version_scan_results_dir
+        backup_dir = f'{results_dir}_backup'
+        kept = [f'{proj_short_name}-Class.csv', f'{proj_short_name}-Method.csv',
+                f'sourcemeter/temp/{proj_short_name}-PMD.xml']
+        # 保留解析结果的缓存
+        if os.path.exists(f'{results_dir}/{proj_short_name}-cache'):
+            kept.append(f'{proj_short_name}-cache')
+        os.makedirs(f'{backup_dir}/sourcemeter/temp', exist_ok=True)
+        for name in kept:
+            os.replace(f'{results_dir}/{name}', f'{backup_dir}/{name}')
+        shutil.rmtree(results_dir)
+        os.replace(backup_dir, results_dir)
+        return hierarchy
 
 
 if __name__ == '__main__':
@@ -1,99 +1,153 @@
 """
 可视化模块后端代码
+直接生成ECharts的option，与pyecharts 1.9.0的TreeMap、Line（放在Grid中）通过dump_options_with_quotes得到的结果相同，
+请求时不再构造pyecharts对象、也不再把option转为字符串后重新解析
 """
-import pyecharts.options as opts
-from pyecharts.charts import TreeMap, Line, Grid
+import gc
 
+import numpy
 
-def extract(target, indicator, calc_results):
-    target['value'] = round(calc_results[indicator], 2)
-    for index in range(len(calc_results['children'])):
-        element = calc_results['children'][index]
-        child = {'name': element['name'], 'children': []}
-        target['children'].append(child)
+INDICATORS = ['complexity', 'maintainability', 'testability', 'readability', 'reusability', 'inheritance']
 
-        if len(element['children']) == 0:
-            child['value'] = round(element.get(indicator, None), 2)
-            return
-        else:
-            extract(child, indicator, element)
+# 以下为pyecharts各配置项的默认值
+ANIMATION = {
+    'animation': True,
+    'animationThreshold': 2000,
+    'animationDuration': 1000,
+    'animationEasing': 'cubicOut',
+    'animationDelay': 0,
+    'animationDurationUpdate': 300,
+    'animationEasingUpdate': 'cubicOut',
+    'animationDelayUpdate': 0,
+}
+COLORS = ['#c23531', '#2f4554', '#61a0a8', '#d48265', '#749f83', '#ca8622', '#bda29a', '#6e7074', '#546570',
+          '#c4ccd3', '#f05b72', '#ef5b9c', '#f47920', '#905a3d', '#fab27b', '#2a5caa', '#444693', '#726930',
+          '#b2d235', '#6d8346', '#ac6767', '#1d953f', '#6950a1', '#918597']
+TOOLTIP = {
+    'show': True,
+    'trigger': 'item',
+    'triggerOn': 'mousemove|click',
+    'axisPointer': {'type': 'line'},
+    'showContent': True,
+    'alwaysShowContent': False,
+    'showDelay': 0,
+    'hideDelay': 100,
+    'textStyle': {'fontSize': 14},
+    'borderWidth': 0,
+    'padding': 5,
+}
+# 隐藏区域缩放与动态类型切换，brush只保留清除
+TOOLBOX = {
+    'show': True,
+    'orient': 'horizontal',
+    'itemSize': 15,
+    'itemGap': 10,
+    'left': '80%',
+    'feature': {
+        'saveAsImage': {'type': 'png', 'backgroundColor': 'auto', 'connectedBackgroundColor': '#fff', 'show': True,
+                        'title': '保存为图片', 'pixelRatio': 1},
+        'restore': {'show': True, 'title': '还原'},
+        'dataView': {'show': True, 'title': '数据视图', 'readOnly': False, 'lang': ['数据视图', '关闭', '刷新'],
+                     'backgroundColor': '#fff', 'textareaColor': '#fff', 'textareaBorderColor': '#333',
+                     'textColor': '#000', 'buttonColor': '#c23531', 'buttonTextColor': '#fff'},
+        'dataZoom': {'show': False, 'title': {'zoom': '区域缩放', 'back': '区域缩放还原'}, 'icon': {},
+                     'xAxisIndex': False, 'yAxisIndex': False, 'filterMode': 'filter'},
+        'magicType': {'show': False, 'type': ['line', 'bar', 'stack', 'tiled'],
+                      'title': {'line': '切换为折线图', 'bar': '切换为柱状图', 'stack': '切换为堆叠', 'tiled': '切换为平铺'},
+                      'icon': {}},
+        'brush': {'type': 'clear', 'icon': {},
+                  'title': {'rect': '矩形选择', 'polygon': '圈选', 'lineX': '横向选择', 'lineY': '纵向选择',
+                            'keep': '保持选择', 'clear': '清除选择'}},
+    },
+}
+LEGEND = {'show': True, 'padding': 0, 'itemGap': 10, 'itemWidth': 25, 'itemHeight': 14}
+GRID = {'show': False, 'zlevel': 0, 'z': 2, 'containLabel': False, 'backgroundColor': 'transparent',
+        'borderColor': '#ccc', 'borderWidth': 1}
+TITLE = {'left': 'center', 'padding': 5, 'itemGap': 10}
+LINE_STYLE = {'show': True, 'width': 1, 'opacity': 1, 'curveness': 0, 'type': 'solid'}
+AXIS = {'show': True, 'scale': False, 'nameLocation': 'end', 'nameGap': 15, 'gridIndex': 0, 'inverse': False,
+        'offset': 0, 'splitNumber': 5, 'minInterval': 0}
 
 
-def to_treemap(data, proj, version):
-    complexity = {'name': f'{proj}-{version}', 'children': []}
-    extract(complexity, 'complexity', data)
-    maintainability = {'name': f'{proj}-{version}', 'children': []}
-    extract(maintainability, 'maintainability', data)
-    testability = {'name': f'{proj}-{version}', 'children': []}
-    extract(testability, 'testability', data)
-    readability = {'name': f'{proj}-{version}', 'children': []}
-    extract(readability, 'readability', data)
-    reusability = {'name': f'{proj}-{version}', 'children': []}
-    extract(reusability, 'reusability', data)
-    inheritance = {'name': f'{proj}-{version}', 'children': []}
-    extract(inheritance, 'inheritance', data)
+def treemap_trees(hierarchy, root_name, full_names=False):
+    """
+    一次遍历同时生成各项指标的树：{"name", "children", "value"}，顺序同INDICATORS
+    ECharts中每个节点只有一个value，各树的节点不能共用，只共用名称字符串
+    指标先整体保留两位小数
+    """
+    names = hierarchy.full_names() if full_names else hierarchy.relative_names()
+    names[0] = root_name
+    columns = [hierarchy.indicators.index(indicator) for indicator in INDICATORS]
+    rows = numpy.round(hierarchy.values[:, columns].astype(numpy.float64), 2).tolist()
+    nodes = [[] for _ in INDICATORS]
+    # 大量新建的dict会反复触发垃圾回收，而树中没有循环引用，构造期间暂停回收
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for node, parent in enumerate(hierarchy.parent.tolist()):
+            name = names[node]
+            for tree_nodes, value in zip(nodes, rows[node]):
+                item = {'name': name, 'children': [], 'value': value}
+                tree_nodes.append(item)
+                if parent >= 0:
+                    tree_nodes[parent]['children'].append(item)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return [tree_nodes[0] for tree_nodes in nodes]
 
-    treemap = TreeMap()
-    for indicator in ['complexity', 'maintainability', 'testability', 'readability', 'reusability', 'inheritance']:
-        treemap = treemap.add(
-            series_name=indicator,
-            data=[locals()[indicator]],
-            leaf_depth=2,
-            roam=False,
-            label_opts=opts.LabelOpts(position='inside')
-        )
 
-    treemap = (
-        treemap.set_global_opts(
-            tooltip_opts=opts.TooltipOpts(formatter='{b}<br/>{a}: {c}'),
-            toolbox_opts=opts.ToolboxOpts(
-                feature=opts.ToolBoxFeatureOpts(
-                    magic_type=opts.ToolBoxFeatureMagicTypeOpts(is_show=False),
-                    data_zoom=opts.ToolBoxFeatureDataZoomOpts(is_show=False),
-                    brush=opts.ToolBoxFeatureBrushOpts(type_='clear')
-                )),
-            legend_opts=opts.LegendOpts(
-                is_show=True, selected_mode='single', pos_top='7%', orient='horizontal', padding=0),
-            title_opts=opts.TitleOpts(title=f'Code Quality Treemap of {proj}-{version}', pos_left='center')
-        )
-    )
-    grid = Grid()
-    grid.add(treemap, grid_opts=opts.GridOpts(pos_top='100%'))
-    return grid
+def base_options(title, tooltip, legend):
+    # 常量部分在各次调用之间共用，不要修改返回的option
+    options = dict(ANIMATION, color=list(COLORS))
+    options['legend'] = [dict({'data': list(INDICATORS), 'selected': dict.fromkeys(INDICATORS, True)}, **legend,
+                              **LEGEND)]
+    options['tooltip'] = dict(TOOLTIP, **tooltip)
+    options['title'] = [dict({'text': title}, **TITLE)]
+    options['toolbox'] = TOOLBOX
+    return options
+
+
+def to_treemap(hierarchy, proj, version, full_names=False):
+    """
+    :param hierarchy: Hierarchy
+    :param full_names: 节点名称为完整路径；默认只用最后一段
+    :return: ECharts的option
+    """
+    series = []
+    for indicator, tree in zip(INDICATORS, treemap_trees(hierarchy, f'{proj}-{version}', full_names)):
+        label = {'show': True, 'position': 'inside', 'margin': 8}
+        series.append({'type': 'treemap', 'name': indicator, 'data': [tree], 'width': '80%', 'height': '80%',
+                       'label': label, 'upperlabel': dict(label), 'leafDepth': 2, 'drillDownIcon': '▶',
+                       'roam': False, 'nodeClick': 'zoomToNode', 'zoomToNodeRatio': 0.1024,
+                       'colorMappingBy': 'index', 'visibleMin': 10, 'xAxisIndex': 0, 'yAxisIndex': 0})
+    options = base_options(f'Code Quality Treemap of {proj}-{version}', {'formatter': '{b}<br/>{a}: {c}'},
+                           {'selectedMode': 'single', 'top': '7%', 'orient': 'horizontal'})
+    options['series'] = series
+    options['grid'] = [dict(GRID, top='100%')]
+    return options
 
 
 def to_linechart(data, proj):
+    """
+    :return: ECharts的option
+    """
     versions = [version['version_name'] for version in data]
-    linechart = Line().add_xaxis(xaxis_data=versions)
-    for indicator in ['complexity', 'maintainability', 'testability', 'readability', 'reusability', 'inheritance']:
-        linechart = linechart.add_yaxis(
-            series_name=indicator,
-            y_axis=[round(version[indicator], 2) for version in data],
-            is_smooth=True,
-            label_opts=opts.LabelOpts(is_show=False),
-            linestyle_opts=opts.LineStyleOpts(width=2),
-        )
-
-    linechart = (
-        linechart.set_global_opts(
-            tooltip_opts=opts.TooltipOpts(trigger="axis", axis_pointer_type="cross"),
-            xaxis_opts=opts.AxisOpts(boundary_gap=False),
-            yaxis_opts=opts.AxisOpts(
-                axislabel_opts=opts.LabelOpts(formatter="{value}"),
-                splitline_opts=opts.SplitLineOpts(is_show=True),
-            ),
-            toolbox_opts=opts.ToolboxOpts(
-                feature=opts.ToolBoxFeatureOpts(
-                    magic_type=opts.ToolBoxFeatureMagicTypeOpts(is_show=False),
-                    data_zoom=opts.ToolBoxFeatureDataZoomOpts(is_show=False),
-                    brush=opts.ToolBoxFeatureBrushOpts(type_='clear')
-                )),
-            legend_opts=opts.LegendOpts(
-                is_show=True, pos_top='middle', pos_left='1%', orient='vertical', padding=0),
-            datazoom_opts=opts.DataZoomOpts(type_='slider', range_start=0, range_end=100),
-            title_opts=opts.TitleOpts(title=f'Code Quality Linechart of {proj}', pos_left='center')
-        )
-    )
-    grid = Grid()
-    grid.add(linechart, grid_opts=opts.GridOpts(pos_left='150'))
-    return grid
+    series = []
+    for indicator in INDICATORS:
+        series.append({'type': 'line', 'name': indicator, 'connectNulls': False, 'xAxisIndex': 0, 'yAxisIndex': 0,
+                       'symbolSize': 4, 'showSymbol': True, 'smooth': True, 'clip': True, 'step': False,
+                       'data': [[version['version_name'], round(version[indicator], 2)] for version in data],
+                       'hoverAnimation': True, 'label': {'show': False, 'position': 'top', 'margin': 8},
+                       'lineStyle': dict(LINE_STYLE, width=2), 'areaStyle': {'opacity': 0}, 'zlevel': 0, 'z': 0})
+    options = base_options(f'Code Quality Linechart of {proj}', {'trigger': 'axis', 'axisPointer': {'type': 'cross'}},
+                           {'left': '1%', 'top': 'middle', 'orient': 'vertical'})
+    options['series'] = series
+    options['xAxis'] = [dict(AXIS, boundaryGap=False, splitLine={'show': False, 'lineStyle': dict(LINE_STYLE)},
+                             data=versions)]
+    options['yAxis'] = [dict(AXIS, axisLabel={'show': True, 'position': 'top', 'margin': 8, 'formatter': '{value}'},
+                             splitLine={'show': True, 'lineStyle': dict(LINE_STYLE)})]
+    options['dataZoom'] = {'show': True, 'type': 'slider', 'realtime': True, 'start': 0, 'end': 100,
+                           'orient': 'horizontal', 'zoomLock': False, 'filterMode': 'filter'}
+    options['grid'] = [dict(GRID, left='150')]
+    return options
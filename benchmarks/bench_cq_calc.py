@@ -0,0 +1,169 @@
+"""
+cq_calc的基准测试：在合成的扫描结果上测量各计算类和整个cq_calculator的耗时与峰值内存
+每项在单独的进程中运行，结果写为JSON；给定--baseline时与之比较，耗时或内存超出容差时以状态1退出
+用法：
+python benchmarks/bench_cq_calc.py --sizes 1000 100000 --shapes mixed deep --output baseline.json
+python benchmarks/bench_cq_calc.py --sizes 1000 100000 --shapes mixed deep --baseline baseline.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append('.')
+from corpus import write_corpus
+
+NAME = 'bench'
+CALCULATOR_NAMES = ['Complexity', 'ISO25010', 'Readability', 'RU2000', 'Inheritance']
+# cq_calculator为不使用解析缓存的首次计算，cq_calculator[cached]为缓存已建好时的重复计算
+TARGETS = CALCULATOR_NAMES + ['cq_calculator', 'cq_calculator[cached]']
+
+
+def max_rss():
+    # Linux下ru_maxrss的单位为KB，macOS下为字节
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def run_target(directory, target, queue):
+    import app.cq_calc as cq_calc
+    from app.scan_result import ScanResult
+    base_rss = max_rss()
+    start = time.perf_counter()
+    if target in CALCULATOR_NAMES:
+        calculator = getattr(cq_calc, target)
+        scan = ScanResult(directory, NAME, cache=False, **cq_calc.required_columns([calculator]))
+        # 访问全部结果，使惰性计算的中间结果也计入耗时
+        for name, indicator in cq_calc.INDICATORS.items():
+            if indicator.calculator is calculator:
+                cq_calc.run_calculator(calculator, scan, [name])
+    else:
+        cq_calc.cq_calculator(directory, NAME)
+    queue.put({'seconds': time.perf_counter() - start, 'peak_rss': max_rss(), 'base_rss': base_rss})
+
+
+def generate(directory, n_classes, shape, seed, queue):
+    queue.put(write_corpus(directory, NAME, n_classes, shape, seed))
+
+
+def run_in_child(target, *args):
+    # 在新进程中运行，峰值内存互不影响；Linux下ru_maxrss会跨exec保留，所以生成数据也放在子进程中
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=target, args=(*args, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def prepare_corpus(workdir, n_classes, shape, seed):
+    """
+    同样参数的数据只生成一次，保存在workdir下供之后的运行复用
+    """
+    directory = f'{workdir}/{shape}-{n_classes}-s{seed}'
+    marker = f'{directory}/corpus.json'
+    if os.path.exists(marker):
+        with open(marker) as f:
+            return directory, json.load(f)
+    shutil.rmtree(directory, ignore_errors=True)
+    stats = run_in_child(generate, directory, n_classes, shape, seed)
+    with open(marker, 'w') as f:
+        json.dump(stats, f)
+    return directory, stats
+
+
+def bench_corpus(directory, targets, repeat):
+    results = {}
+    for target in targets:
+        runs = []
+        for _ in range(repeat):
+            if target == 'cq_calculator[cached]':
+                if not os.path.exists(f'{directory}/{NAME}-cache'):
+                    run_in_child(run_target, directory, 'cq_calculator')
+            else:
+                shutil.rmtree(f'{directory}/{NAME}-cache', ignore_errors=True)
+            runs.append(run_in_child(run_target, directory, target))
+        # 取最快的一次，内存取各次中的最大值
+        best = min(runs, key=lambda run: run['seconds'])
+        results[target] = {'seconds': best['seconds'], 'peak_mb': max(run['peak_rss'] for run in runs) / 2 ** 20,
+                           'base_mb': min(run['base_rss'] for run in runs) / 2 ** 20}
+    return results
+
+
+def compare(results, baseline, tolerance, min_seconds):
+    """
+    :return: 超出容差的(corpus, target)列表
+    """
+    regressions = []
+    print(f'{"corpus":<22}{"target":<24}{"seconds":>10}{"base s":>10}{"ratio":>8}{"peak MB":>10}{"base MB":>10}'
+          f'{"ratio":>8}')
+    for corpus, targets in results['results'].items():
+        for target, result in targets.items():
+            base = baseline['results'].get(corpus, {}).get(target)
+            if base is None:
+                print(f'{corpus:<22}{target:<24}{result["seconds"]:>10.3f}{"-":>10}{"":>8}{result["peak_mb"]:>10.1f}')
+                continue
+            time_ratio = result['seconds'] / max(base['seconds'], 1e-9)
+            memory_ratio = result['peak_mb'] / max(base['peak_mb'], 1e-9)
+            slower = time_ratio > 1 + tolerance and result['seconds'] - base['seconds'] > min_seconds
+            larger = memory_ratio > 1 + tolerance
+            flag = '  REGRESSION' if slower or larger else ''
+            print(f'{corpus:<22}{target:<24}{result["seconds"]:>10.3f}{base["seconds"]:>10.3f}{time_ratio:>8.2f}'
+                  f'{result["peak_mb"]:>10.1f}{base["peak_mb"]:>10.1f}{memory_ratio:>8.2f}{flag}')
+            if flag:
+                regressions.append((corpus, target))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--shapes', nargs='+', default=['mixed'], choices=['wide', 'mixed', 'deep'])
+    parser.add_argument('--targets', nargs='+', default=TARGETS, choices=TARGETS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--workdir', help='保存生成数据的目录，默认使用临时目录，运行结束后删除')
+    parser.add_argument('--output', help='结果JSON的路径')
+    parser.add_argument('--baseline', help='作为基线的结果JSON')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='允许的相对退化，默认20%%')
+    parser.add_argument('--min-seconds', type=float, default=0.05, help='小于该值的耗时差异不算退化')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='cq-bench-')
+    results = {'meta': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpus': os.cpu_count(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'seed': args.seed},
+               'corpora': {}, 'results': {}}
+    try:
+        for shape in args.shapes:
+            for n_classes in args.sizes:
+                directory, stats = prepare_corpus(workdir, n_classes, shape, args.seed)
+                corpus = f'{shape}-{n_classes}'
+                results['corpora'][corpus] = stats
+                print(f'{corpus}: {stats["classes"]} classes, {stats["methods"]} methods', file=sys.stderr)
+                results['results'][corpus] = bench_corpus(directory, args.targets, args.repeat)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    baseline = {'results': {}}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance, args.min_seconds)
+    if regressions:
+        print(f'{len(regressions)} regression(s) against {args.baseline}', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+lazy class计算的微基准：逐行DataFrame.apply与布尔掩码向量化实现的耗时对比
+用法：python benchmarks/bench_lazy_class.py --sizes 10000 100000 1000000
+"""
+import argparse
+import sys
+import time
+
+import numpy
+import pandas as pd
+
+sys.path.append('.')
+sys.path.append('app/tests')
+from app.cq_calc import ISO25010
+from cq_reference import get_lazy_class_part1, get_lazy_class_part2
+
+
+def make_calculator(n_classes, seed=0):
+    rng = numpy.random.RandomState(seed)
+    class_file = pd.DataFrame({
+        'NM': rng.randint(0, 30, n_classes),
+        'LOC': rng.randint(0, 800, n_classes),
+        'WMC': rng.randint(0, 90, n_classes),
+        'CBO': rng.randint(0, 20, n_classes),
+        'DIT': rng.randint(0, 5, n_classes),
+    }).astype(numpy.int32)
+    # 只设置lazy class用到的属性
+    calculator = ISO25010.__new__(ISO25010)
+    calculator.class_file = class_file
+    calculator.nom, calculator.loc, calculator.wmc = class_file['NM'], class_file['LOC'], class_file['WMC']
+    calculator.cbo, calculator.dit = class_file['CBO'], class_file['DIT']
+    calculator.loc_mean, calculator.cbo_mean = class_file['LOC'].mean(), class_file['CBO'].mean()
+    return calculator
+
+
+def row_wise(calculator):
+    part1 = calculator.class_file.apply(get_lazy_class_part1, axis=1, loc_mean=calculator.loc_mean)
+    part2 = calculator.class_file.apply(get_lazy_class_part2, axis=1, cbo_mean=calculator.cbo_mean)
+    return part1, part2
+
+
+def vectorized(calculator):
+    return calculator.get_lazy_class_part1(), calculator.get_lazy_class_part2()
+
+
+def timed(func, calculator):
+    start = time.perf_counter()
+    result = func(calculator)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+    print(f'{"classes":>10}{"apply s":>12}{"vectorized s":>15}{"speedup":>10}')
+    for n_classes in args.sizes:
+        calculator = make_calculator(n_classes)
+        apply_seconds, expected = timed(row_wise, calculator)
+        vectorized_seconds, actual = timed(vectorized, calculator)
+        for expected_part, actual_part in zip(expected, actual):
+            assert (expected_part.to_numpy() == actual_part.to_numpy()).all()
+        print(f'{n_classes:>10}{apply_seconds:>12.3f}{vectorized_seconds:>15.4f}'
+              f'{apply_seconds / vectorized_seconds:>9.0f}x')
+
+
+if __name__ == '__main__':
+    main()
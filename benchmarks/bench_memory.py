@@ -0,0 +1,87 @@
+"""
+读取SourceMeter扫描结果的内存基准：对比读取全部列与只读取各计算类声明的列（并压缩类型）时的峰值内存
+用法：python benchmarks/bench_memory.py --classes 50000
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy
+import pandas as pd
+
+sys.path.append('.')
+from app.cq_calc import CALCULATORS, required_columns
+from app.scan_result import ScanResult
+from corpus import CLASS_METRICS, FLOAT_METRICS, METHOD_METRICS
+
+
+def make_frame(long_names, paths, names, metrics, rng):
+    n = len(long_names)
+    data = {'ID': [f'L{i}' for i in range(n)], 'Name': names, 'LongName': long_names, 'Parent': 'L0',
+            'Component': 'L1', 'Path': paths, 'Line': rng.randint(1, 500, n), 'Column': 1}
+    for col in metrics:
+        data[col] = rng.rand(n).round(4) if col in FLOAT_METRICS else rng.randint(0, 60, n)
+    return pd.DataFrame(data)
+
+
+def write_csvs(directory, name, n_classes, methods_per_class=8, seed=0):
+    rng = numpy.random.RandomState(seed)
+    packages = [f'com.{name}.m{i % 40}.p{i % 400}' for i in range(n_classes)]
+    class_names = [f'{packages[i]}.C{i}' for i in range(n_classes)]
+    paths = [f'/home/mql/OSSprojects/alibaba/{name}/src/main/java/{p.replace(".", "/")}/C{i}.java'
+             for i, p in enumerate(packages)]
+    make_frame(class_names, paths, [f'C{i}' for i in range(n_classes)], CLASS_METRICS, rng) \
+        .to_csv(f'{directory}/{name}-Class.csv', index=False)
+    method_names = [f'{c}.m{j}(Ljava/lang/String;)V' for c in class_names for j in range(methods_per_class)]
+    method_paths = [p for p in paths for _ in range(methods_per_class)]
+    make_frame(method_names, method_paths, [f'm{j}' for _ in class_names for j in range(methods_per_class)],
+               METHOD_METRICS, rng).to_csv(f'{directory}/{name}-Method.csv', index=False)
+
+
+def load(directory, name, pruned, queue):
+    start = time.perf_counter()
+    columns = required_columns(CALCULATORS) if pruned else {}
+    # 不使用解析缓存，否则第二次运行读取的是第一次写入的缓存，比较的不再是按列解析
+    scan = ScanResult(directory, name, cache=False, **columns)
+    frame_bytes = scan.class_file.memory_usage(deep=True).sum() + scan.method_file.memory_usage(deep=True).sum()
+    # Linux下ru_maxrss的单位为KB
+    queue.put((time.perf_counter() - start, frame_bytes, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024))
+
+
+def run_in_child(target, *args):
+    # 在新进程中运行，峰值内存互不影响；Linux下ru_maxrss会跨exec保留，所以主进程本身也不能占用太多内存
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=target, args=(*args, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def generate(directory, name, n_classes, queue):
+    write_csvs(directory, name, n_classes)
+    queue.put(None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--classes', type=int, default=50000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        run_in_child(generate, directory, 'bench', args.classes)
+        csv_bytes = sum(os.path.getsize(f'{directory}/bench-{kind}.csv') for kind in ('Class', 'Method'))
+        print(f'{args.classes} classes, {csv_bytes / 2 ** 20:.1f} MB of csv')
+        print(f'{"mode":<8}{"seconds":>10}{"frames MB":>12}{"peak RSS MB":>14}')
+        for pruned in (False, True):
+            seconds, frame_bytes, peak = run_in_child(load, directory, 'bench', pruned)
+            print(f'{"pruned" if pruned else "full":<8}{seconds:>10.2f}{frame_bytes / 2 ** 20:>12.1f}'
+                  f'{peak / 2 ** 20:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
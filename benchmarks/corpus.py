@@ -0,0 +1,184 @@
+"""
+合成的SourceMeter扫描结果：按SourceMeter Java的列格式生成{name}-Class.csv、{name}-Method.csv和
+sourcemeter/temp/{name}-PMD.xml，不需要安装SourceMeter，也不需要联网
+分块写入，生成100万个类时内存占用也有上限
+用法：python benchmarks/corpus.py OUTPUT_DIR --classes 100000 --shape deep
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy
+import pandas as pd
+
+# SourceMeter Java的Class.csv、Method.csv中的度量列
+CLASS_METRICS = ['CC', 'CCL', 'CCO', 'CI', 'CLC', 'CLLC', 'LDC', 'LLDC', 'LCOM5', 'NL', 'NLE', 'WMC', 'CBO', 'CBOI',
+                 'NII', 'NOI', 'RFC', 'AD', 'CD', 'CLOC', 'DLOC', 'PDA', 'PUA', 'TCD', 'TCLOC', 'DIT', 'NOA', 'NOC',
+                 'NOD', 'NOP', 'LLOC', 'LOC', 'NA', 'NG', 'NLA', 'NLG', 'NLM', 'NLPA', 'NLPM', 'NLS', 'NM', 'NOS',
+                 'NPA', 'NPM', 'NS', 'TLLOC', 'TLOC', 'TNA', 'TNG', 'TNLA', 'TNLG', 'TNLM', 'TNLPA', 'TNLPM', 'TNLS',
+                 'TNM', 'TNOS', 'TNPA', 'TNPM', 'TNS']
+METHOD_METRICS = ['CC', 'CCL', 'CCO', 'CI', 'CLC', 'LDC', 'LLDC', 'HCPL', 'HDIF', 'HEFF', 'HNDB', 'HPL', 'HPV',
+                  'HTRP', 'HVOL', 'MIMS', 'MI', 'MISEI', 'MISM', 'McCC', 'NL', 'NLE', 'NII', 'NOI', 'CD', 'CLOC',
+                  'DLOC', 'TCD', 'TCLOC', 'LLOC', 'LOC', 'NOS', 'NUMPAR', 'TLLOC', 'TLOC', 'TNOS']
+FLOAT_METRICS = {'CC', 'CCL', 'CCO', 'CI', 'CLC', 'CLLC', 'LDC', 'LLDC', 'AD', 'CD', 'PDA', 'PUA', 'TCD', 'HCPL',
+                 'HDIF', 'HEFF', 'HNDB', 'HPL', 'HPV', 'HTRP', 'HVOL', 'MIMS', 'MI', 'MISEI', 'MISM'}
+# 包结构：(每层的子包数, 最大深度)
+SHAPES = {
+    'wide': (256, 2),
+    'mixed': (8, 6),
+    'deep': (2, 24),
+}
+CLASSES_PER_PACKAGE = 12
+RULESETS = ['Best Practices', 'Documentation', 'Design', 'Code Style', 'Error Prone', 'Multithreading',
+            'Performance', 'Security']
+CHUNK_CLASSES = 20000
+
+
+def package_segments(package_id, shape):
+    """
+    第package_id个包的各级名称：按fanout进制展开，深度在max_depth的一半到max_depth之间变化
+    """
+    fanout, max_depth = SHAPES[shape]
+    depth = max_depth - package_id % (max_depth // 2 + 1)
+    segments = []
+    for _ in range(depth):
+        segments.append(f'p{package_id % fanout}')
+        package_id //= fanout
+    return segments
+
+
+def make_classes(name, start, stop, shape, rng):
+    """
+    第start到stop个类；每10个类中有一个内部类，与外部类在同一个文件中
+    """
+    long_names, names, paths, parents = [], [], [], []
+    for i in range(start, stop):
+        segments = package_segments(i // CLASSES_PER_PACKAGE, shape)
+        package = '.'.join(['com', name, *segments])
+        directory = '/'.join(['com', name, *segments])
+        outer = f'C{i - i % 10}' if i % 10 == 9 else f'C{i}'
+        class_name = f'{outer}.Inner{i}' if i % 10 == 9 else outer
+        long_names.append(f'{package}.{class_name}')
+        names.append(class_name.split('.')[-1])
+        paths.append(f'/home/mql/OSSprojects/alibaba/{name}/src/main/java/{directory}/{outer}.java')
+        parents.append(f'L{i - i % 10}' if i % 10 == 9 else 'L0')
+    n = stop - start
+    frame = pd.DataFrame({'ID': [f'L{i}' for i in range(start, stop)], 'Name': names, 'LongName': long_names,
+                          'Parent': parents, 'Component': 'L1', 'Path': paths,
+                          'Line': rng.randint(1, 400, n), 'Column': 1})
+    # 方法数服从几何分布，约5%的类没有方法
+    nm = rng.geometric(0.12, n) - 1
+    for col in CLASS_METRICS:
+        if col in FLOAT_METRICS:
+            # 大部分类没有重复代码、注释较少
+            frame[col] = numpy.where(rng.rand(n) < 0.6, 0, rng.beta(1, 6, n)).round(4)
+        else:
+            frame[col] = rng.negative_binomial(2, 0.2, n)
+    frame['NM'] = nm
+    frame['NLM'] = nm
+    frame['WMC'] = nm + rng.poisson(nm * 0.8)
+    frame['LOC'] = numpy.maximum(1, (rng.lognormal(4, 1, n) + nm * 6).astype(numpy.int64))
+    frame['LLOC'] = numpy.maximum(1, (frame['LOC'] * rng.uniform(0.5, 0.9, n)).astype(numpy.int64))
+    frame['CLOC'] = (frame['LOC'] * rng.beta(1, 4, n)).astype(numpy.int64)
+    frame['DIT'] = rng.choice([0, 1, 1, 1, 2, 2, 3, 4, 6], n)
+    frame['LCOM5'] = rng.randint(0, 8, n)
+    frame['NA'] = rng.negative_binomial(1, 0.25, n)
+    frame['NPM'] = numpy.minimum(nm, rng.negative_binomial(2, 0.3, n))
+    return frame
+
+
+def make_methods(classes, rng):
+    repeats = classes['NM'].to_numpy()
+    n = int(repeats.sum())
+    owners = numpy.repeat(classes['LongName'].to_numpy(dtype=object), repeats)
+    ordinal = numpy.arange(n) - numpy.repeat(numpy.cumsum(repeats) - repeats, repeats)
+    names = [f'm{j}' for j in ordinal]
+    long_names = [f'{owner}.{method}(Ljava/lang/String;I)V' for owner, method in zip(owners, names)]
+    frame = pd.DataFrame({'ID': [f'M{j}' for j in range(n)], 'Name': names, 'LongName': long_names,
+                          'Parent': numpy.repeat(classes['ID'].to_numpy(dtype=object), repeats), 'Component': 'L1',
+                          'Path': numpy.repeat(classes['Path'].to_numpy(dtype=object), repeats),
+                          'Line': rng.randint(1, 2000, n), 'Column': 5})
+    for col in METHOD_METRICS:
+        if col in FLOAT_METRICS:
+            frame[col] = rng.rand(n).round(4)
+        else:
+            frame[col] = rng.negative_binomial(2, 0.3, n)
+    frame['NUMPAR'] = rng.choice([0, 0, 1, 1, 1, 2, 2, 3, 4, 6, 9], n)
+    frame['McCC'] = rng.geometric(0.45, n)
+    frame['NL'] = rng.choice([0, 0, 1, 1, 2, 3, 5, 7], n)
+    frame['LOC'] = numpy.maximum(1, rng.lognormal(2, 0.9, n).astype(numpy.int64))
+    frame['LLOC'] = numpy.maximum(1, (frame['LOC'] * 0.8).astype(numpy.int64))
+    frame['CLOC'] = numpy.where(rng.rand(n) < 0.4, 0, (frame['LOC'] * rng.beta(1, 3, n)).astype(numpy.int64))
+    return frame
+
+
+def pmd_lines(classes, rng):
+    """
+    每个类的violation数服从泊松分布；混入缺少class属性的violation（如包级别的规则）
+    """
+    yield '<?xml version="1.0" encoding="UTF-8"?>'
+    yield '<pmd xmlns="http://pmd.sourceforge.net/report/2.0.0" version="6.21.0" timestamp="2020-03-01T12:00:00.000">'
+    counts = rng.poisson(2.5, len(classes))
+    for (long_name, path), count in zip(classes[['LongName', 'Path']].itertuples(index=False), counts):
+        package, class_name = long_name.rsplit('.', 1)
+        yield f'<file name="{path}">'
+        for line, ruleset_id, priority in zip(rng.randint(1, 500, count), rng.randint(len(RULESETS), size=count),
+                                              rng.randint(1, 6, count)):
+            yield (f'<violation beginline="{line}" endline="{line + 3}" begincolumn="1" endcolumn="20" '
+                   f'rule="Rule{ruleset_id}" ruleset="{RULESETS[ruleset_id]}" package="{package}" '
+                   f'class="{class_name}" priority="{priority}">message</violation>')
+        if count and rng.rand() < 0.05:
+            yield (f'<violation beginline="1" endline="1" begincolumn="1" endcolumn="1" rule="PackageCase" '
+                   f'ruleset="Code Style" priority="3">no class</violation>')
+        yield '</file>'
+    yield '</pmd>'
+
+
+def write_corpus(directory, name, n_classes, shape='mixed', seed=0, pmd=True):
+    """
+    写入n_classes个类的扫描结果，返回类数、方法数等统计
+    """
+    os.makedirs(f'{directory}/sourcemeter/temp', exist_ok=True)
+    rng = numpy.random.RandomState(seed)
+    class_path, method_path = f'{directory}/{name}-Class.csv', f'{directory}/{name}-Method.csv'
+    pmd_file = open(f'{directory}/sourcemeter/temp/{name}-PMD.xml', 'w', encoding='utf-8') if pmd else None
+    n_methods = 0
+    try:
+        for start in range(0, max(n_classes, 1), CHUNK_CLASSES):
+            stop = min(start + CHUNK_CLASSES, n_classes)
+            classes = make_classes(name, start, stop, shape, rng)
+            methods = make_methods(classes, rng)
+            n_methods += len(methods)
+            header = start == 0
+            classes.to_csv(class_path, mode='w' if header else 'a', header=header, index=False)
+            methods.to_csv(method_path, mode='w' if header else 'a', header=header, index=False)
+            if pmd_file is not None:
+                for line in pmd_lines(classes, rng):
+                    # 各块的文件头尾只写一次
+                    if (line.startswith('<?xml') or line.startswith('<pmd ')) and not header:
+                        continue
+                    if line == '</pmd>' and stop < n_classes:
+                        continue
+                    pmd_file.write(line + '\n')
+    finally:
+        if pmd_file is not None:
+            pmd_file.close()
+    return {'classes': n_classes, 'methods': n_methods, 'shape': shape, 'seed': seed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory')
+    parser.add_argument('--name', default='bench')
+    parser.add_argument('--classes', type=int, default=10000)
+    parser.add_argument('--shape', choices=sorted(SHAPES), default='mixed')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    stats = write_corpus(args.directory, args.name, args.classes, args.shape, args.seed)
+    json.dump(stats, sys.stdout)
+    print()
+
+
+if __name__ == '__main__':
+    main()
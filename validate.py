@@ -6,6 +6,7 @@ import pandas as pd
 
 from app.cq_calc import ISO25010, RU2000, Readability, Complexity, Inheritance
 from app.models import Project, Version
+from app.scan_result import ScanResult
 from app.utils import CodeScanner
 from scipy import stats
 
@@ -44,11 +45,11 @@ def add_sheet(data, excel_writer, sheet_name):
 
 
 def cq_validate(version_scan_results_directory, project_name):
-    params = [version_scan_results_directory, project_name]
-    complexity_calculator = Complexity(*params)
+    scan = ScanResult(version_scan_results_directory, project_name)
+    complexity_calculator = Complexity(scan)
     complexity, index = complexity_calculator.complexity, complexity_calculator.index
 
-    maintainability_calculator = ISO25010(*params)
+    maintainability_calculator = ISO25010(scan)
     maintainability = maintainability_calculator.maintainability
     testablility = maintainability_calculator.testability
     loc = maintainability_calculator.class_file['LOC']
@@ -64,9 +65,9 @@ def cq_validate(version_scan_results_directory, project_name):
     ca = maintainability_calculator.class_file['NII']
     lcom = maintainability_calculator.class_file['LCOM5']
 
-    readability = Readability(*params).readability
-    reusability = RU2000(*params).reusability
-    inheritance = Inheritance(*params).inheritance
+    readability = Readability(scan).readability
+    reusability = RU2000(scan).reusability
+    inheritance = Inheritance(scan).inheritance
 
     # 合并该版本的计算结果，readability少，会被自动补充为nan
     df = pd.concat([remove_dup(maintainability),
@@ -0,0 +1,22 @@
+"""
+启动扫描、计算任务的工作进程池，需与gunicorn在同一目录下运行（扫描结果使用相对路径）
+用法：python worker.py --workers 2
+计算指标默认在各工作进程内用线程池并行，设置环境变量CALC_EXECUTOR=process时改用进程池，none时依次计算
+"""
+import argparse
+import os
+
+from dotenv import load_dotenv
+
+dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
+if os.path.exists(dotenv_path):
+    load_dotenv(dotenv_path)
+
+from app.jobs import run_workers
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=int(os.getenv('JOB_WORKERS', 2)),
+                        help='工作进程数，默认取环境变量JOB_WORKERS或2')
+    args = parser.parse_args()
+    run_workers(f"{os.getenv('MONGODB_URL')}/run", args.workers)